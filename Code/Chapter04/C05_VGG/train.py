@@ -16,10 +16,10 @@ from VGG import vgg
 import logging
 import sys
 import os
-from copy import deepcopy
 
 sys.path.append("../../")
 from utils import logger_init
+from utils import Trainer
 
 
 class ModelConfig(object):
@@ -71,43 +71,8 @@ def train(config):
         model.load_state_dict(checkpoint)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
     writer = SummaryWriter(config.summary_writer_dir)
-    model = model.to(config.device)
-    max_test_acc = 0
-    global_steps = 0
-    for epoch in range(config.epochs):
-        for i, (x, y) in enumerate(train_iter):
-            x, y = x.to(config.device), y.to(config.device)
-            loss, logits = model(x, y)
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()  # 执行梯度下降
-            global_steps += 1
-            if i % 50 == 0:
-                acc = (logits.argmax(1) == y).float().mean()
-                logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
-                             f"--Acc: {round(acc.item(), 4)}--loss: {round(loss.item(), 4)}")
-                writer.add_scalar('Training/Accuracy', acc, global_steps)
-            writer.add_scalar('Training/Loss', loss.item(), global_steps)
-        test_acc = evaluate(test_iter, model, config.device)
-        logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--Acc on test {test_acc}")
-        writer.add_scalar('Testing/Accuracy', test_acc, global_steps)
-        if test_acc > max_test_acc:
-            max_test_acc = test_acc
-            state_dict = deepcopy(model.state_dict())
-            torch.save(state_dict, config.model_save_path)
-
-
-def evaluate(data_iter, model, device):
-    model.eval()
-    with torch.no_grad():
-        acc_sum, n = 0.0, 0
-        for x, y in data_iter:
-            x, y = x.to(device), y.to(device)
-            logits = model(x)
-            acc_sum += (logits.argmax(1) == y).float().sum().item()
-            n += len(y)
-        model.train()
-        return acc_sum / n
+    trainer = Trainer(model, optimizer, config, writer=writer)
+    trainer.train(train_iter, test_iter)
 
 
 def inference(config, test_iter):
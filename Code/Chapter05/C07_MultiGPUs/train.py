@@ -16,10 +16,11 @@ import torch.nn as nn
 import logging
 import sys
 import os
-from copy import deepcopy
 
 sys.path.append("../../")
 from utils import logger_init
+from utils import MetricsSink
+from utils import CheckpointManager
 from utils import get_gpus
 from Chapter04.C08_ResNet.ResNet import resnet18
 
@@ -71,8 +72,8 @@ def train(config):
     model = model.to(config.device[config.master_gpu_id])  # 指定主GPU
     model = nn.DataParallel(model, device_ids=config.device)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
-    writer = SummaryWriter(config.summary_writer_dir)
-    max_test_acc = 0
+    writer = MetricsSink(SummaryWriter(config.summary_writer_dir))  # 在后台线程中批量写入
+    checkpoints = CheckpointManager(config.model_save_path, keep_last=2, keep_best=1)  # 在后台线程中保存模型
     global_steps = 0
     for epoch in range(config.epochs):
         for i, (x, y) in enumerate(train_iter):
@@ -88,14 +89,13 @@ def train(config):
                 logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
                              f"--Acc: {round(acc.item(), 4)}--loss: {round(loss.sum().item(), 4)}")
                 writer.add_scalar('Training/Accuracy', acc, global_steps)
-            writer.add_scalar('Training/Loss', loss.sum().item(), global_steps)
+            writer.add_scalar('Training/Loss', loss.detach().sum(), global_steps)
         test_acc = evaluate(test_iter, model, config.device[config.master_gpu_id])
         logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--Acc on test {test_acc}")
         writer.add_scalar('Testing/Accuracy', test_acc, global_steps)
-        if test_acc > max_test_acc:
-            max_test_acc = test_acc
-            state_dict = deepcopy(model.module.state_dict())
-            torch.save(state_dict, config.model_save_path)
+        checkpoints.save(model.module.state_dict(), global_steps, metric=test_acc)  # 准确率提升时更新model_save_path
+    checkpoints.close()
+    writer.close()
 
 
 def evaluate(data_iter, model, device):
@@ -13,11 +13,12 @@ from CharRNN import CharRNN
 import os
 from torch.utils.tensorboard import SummaryWriter
 from transformers import optimization
-from copy import deepcopy
 
 sys.path.append("../../")
 from utils import TangShi
 from utils import logger_init
+from utils import Trainer
+from utils import num_update_steps
 
 class ModelConfig(object):
     def __init__(self):
@@ -54,65 +55,27 @@ def train(config):
         model.load_state_dict(checkpoint)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
     writer = SummaryWriter(config.summary_writer_dir)
-    model = model.to(config.device)
-    max_test_acc = 0
-    steps = len(train_iter) * config.epochs
+    steps = num_update_steps(len(train_iter), config)  # 使用梯度累积时为参数更新的次数
     scheduler = optimization.get_cosine_schedule_with_warmup(optimizer, num_warmup_steps=config.num_warmup_steps,
                                                              num_training_steps=steps, num_cycles=2)
-    for epoch in range(config.epochs):
-        for i, (x, y) in enumerate(train_iter):
-            x, y = x.to(config.device), y.to(config.device)
-            loss, logits = model(x, y)
-            optimizer.zero_grad()
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(), config.clip_max_norm)
-            optimizer.step()  # 执行梯度下降
-            scheduler.step()
-            if i % 50 == 0:
-                acc, _, _ = accuracy(logits, y, 1)
-                logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
-                             f"--Acc: {round(acc, 4)}--loss: {round(loss.item(), 4)}")
-                writer.add_scalar('Training/Accuracy', acc, scheduler.last_epoch)
-            writer.add_scalar('Training/Loss', loss.item(), scheduler.last_epoch)
-        # test_acc = evaluate(val_iter, model, config.device)
-        test_acc = evaluate(train_iter, model, config.device)
-        logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--Acc on val {test_acc}")
-        writer.add_scalar('Testing/Accuracy', test_acc, scheduler.last_epoch)
-        if test_acc > max_test_acc: # 因为
-            max_test_acc = test_acc
-            state_dict = deepcopy(model.state_dict())
-            torch.save(state_dict, config.model_save_path)
+    trainer = Trainer(model, optimizer, config, scheduler=scheduler, writer=writer, metric_fn=count_correct)
+    trainer.train(train_iter, train_iter)  # 在训练集上评估
 
 
-def evaluate(data_iter, model, device):
-    model.eval()
-    with torch.no_grad():
-        corrects, totals = 0, 0
-        for x, y in data_iter:
-            x, y = x.to(device), y.to(device)
-            logits = model(x)
-            _, c, t = accuracy(logits, y)
-            corrects += c
-            totals += t
-        model.train()
-        return float(corrects) / totals
-
-
-def accuracy(logits, y_true, PAD_IDX=1):
+def count_correct(logits, y_true, PAD_IDX=1):
     """
+    统计非padding位置上预测正确的数量，结果保留在设备上，供Trainer累计
     :param logits:  [batch_size,src_len,vocab_size]
     :param y_true:  [batch_size,tgt_len]
     :param PAD_IDX:
-    :return:
+    :return: correct, total
     """
     y_pred = logits.argmax(axis=2).reshape(-1)
     y_true = y_true.reshape(-1)
     acc = y_pred.eq(y_true)  # 计算预测值与正确值比较的情况
     mask = torch.logical_not(y_true.eq(PAD_IDX))  # 找到真实标签中，mask位置的信息。 mask位置为FALSE，非mask位置为TRUE
     acc = acc.logical_and(mask)  # 去掉acc中mask的部分
-    correct = acc.sum().item()
-    total = mask.sum().item()
-    return float(correct) / total, correct, total
+    return acc.sum(), mask.sum()
 
 
 if __name__ == '__main__':
@@ -9,7 +9,6 @@
 from transformers import optimization
 from torch.utils.tensorboard import SummaryWriter
 import torch
-from copy import deepcopy
 import sys
 import logging
 import os
@@ -18,6 +17,8 @@ from TextCNN import TextCNN
 sys.path.append("../../")
 from utils import TouTiaoNews
 from utils import logger_init
+from utils import Trainer
+from utils import num_update_steps
 
 class ModelConfig(object):
     def __init__(self):
@@ -53,45 +54,11 @@ def train(config):
         model.load_state_dict(checkpoint)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
     writer = SummaryWriter(config.summary_writer_dir)
-    model = model.to(config.device)
-    max_test_acc = 0
-    steps = len(train_iter) * config.epochs
+    steps = num_update_steps(len(train_iter), config)  # 使用梯度累积时为参数更新的次数
     scheduler = optimization.get_cosine_schedule_with_warmup(optimizer, num_warmup_steps=config.num_warmup_steps,
                                                              num_training_steps=steps, num_cycles=2)
-    for epoch in range(config.epochs):
-        for i, (x, y) in enumerate(train_iter):
-            x, y = x.to(config.device), y.to(config.device)
-            loss, logits = model(x, y)
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()  # 执行梯度下降
-            scheduler.step()
-            if i % 50 == 0:
-                acc = (logits.argmax(1) == y).float().mean()
-                logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
-                             f"--Acc: {round(acc.item(), 4)}--loss: {round(loss.item(), 4)}")
-                writer.add_scalar('Training/Accuracy', acc, scheduler.last_epoch)
-            writer.add_scalar('Training/Loss', loss.item(), scheduler.last_epoch)
-        test_acc = evaluate(val_iter, model, config.device)
-        logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--Acc on val {test_acc}")
-        writer.add_scalar('Testing/Accuracy', test_acc, scheduler.last_epoch)
-        if test_acc > max_test_acc:
-            max_test_acc = test_acc
-            state_dict = deepcopy(model.state_dict())
-            torch.save(state_dict, config.model_save_path)
-
-
-def evaluate(data_iter, model, device):
-    model.eval()
-    with torch.no_grad():
-        acc_sum, n = 0.0, 0
-        for x, y in data_iter:
-            x, y = x.to(device), y.to(device)
-            logits = model(x)
-            acc_sum += (logits.argmax(1) == y).float().sum().item()
-            n += len(y)
-        model.train()
-        return acc_sum / n
+    trainer = Trainer(model, optimizer, config, scheduler=scheduler, writer=writer)
+    trainer.train(train_iter, val_iter)
 
 
 def inference(config, test_iter):
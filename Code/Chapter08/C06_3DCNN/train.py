@@ -9,16 +9,17 @@
 from transformers import optimization
 from torch.utils.tensorboard import SummaryWriter
 import torch
-from copy import deepcopy
 import sys
 import logging
 import os
 from KTH3DCNN import KTH3DCNN
-import torchvision.transforms as transforms
 
 sys.path.append("../../")
 from utils import KTHData
+from utils import VideoBatchTransform
 from utils import logger_init
+from utils import Trainer
+from utils import num_update_steps
 
 
 class ModelConfig(object):
@@ -33,6 +34,7 @@ class ModelConfig(object):
         self.width = 80  # 原始大小为160
         self.num_warmup_steps = 300
         self.model_save_path = 'model.pt'
+        self.num_workers = 2  # 构造batch的进程数
         self.summary_writer_dir = "runs/model"
         self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
         # 判断是否存在GPU设备，其中0表示指定第0块设备
@@ -43,13 +45,12 @@ class ModelConfig(object):
 
 
 def train(config):
-    trans = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Resize((config.height, config.width)),
-        transforms.RandomHorizontalFlip(0.5)])
+    trans = VideoBatchTransform(size=(config.height, config.width), flip_prob=0.5)  # 同一片段中的帧翻转一致
     data_load = KTHData(frame_len=config.frame_len,
                         batch_size=config.batch_size,
-                        transforms=trans)
+                        batch_transforms=trans,
+                        num_workers=config.num_workers,
+                        pin_memory=torch.cuda.is_available())
     train_iter, val_iter = data_load.load_train_val_test_data(is_train=True)
     model = KTH3DCNN(config)
     if os.path.exists(config.model_save_path):
@@ -58,58 +59,22 @@ def train(config):
         model.load_state_dict(checkpoint)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
     writer = SummaryWriter(config.summary_writer_dir)
-    model = model.to(config.device)
-    max_test_acc = 0
-    steps = len(train_iter) * config.epochs
+    steps = num_update_steps(len(train_iter), config)  # 使用梯度累积时为参数更新的次数
     scheduler = optimization.get_cosine_schedule_with_warmup(optimizer, num_warmup_steps=config.num_warmup_steps,
                                                              num_training_steps=steps, num_cycles=2)
-    for epoch in range(config.epochs):
-        for i, (x, y) in enumerate(train_iter):
-            # x: [batch_size, frame_len, channels, height, width]
-            x = x.permute(0, 2, 1, 3, 4)  # [batch_size, channels, frame_len, height, width]
-            x, y = x.to(config.device), y.to(config.device)
-            loss, logits = model(x, y)
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()  # 执行梯度下降
-            scheduler.step()
-            if i % 50 == 0:
-                acc = (logits.argmax(1) == y).float().mean()
-                logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
-                             f"--Acc: {round(acc.item(), 4)}--loss: {round(loss.item(), 4)}")
-                writer.add_scalar('Training/Accuracy', acc, scheduler.last_epoch)
-            writer.add_scalar('Training/Loss', loss.item(), scheduler.last_epoch)
-        test_acc = evaluate(val_iter, model, config.device)
-        logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--Acc on val {test_acc}")
-        writer.add_scalar('Testing/Accuracy', test_acc, scheduler.last_epoch)
-        if test_acc > max_test_acc:
-            max_test_acc = test_acc
-            state_dict = deepcopy(model.state_dict())
-            torch.save(state_dict, config.model_save_path)
-
-
-def evaluate(data_iter, model, device):
-    model.eval()
-    with torch.no_grad():
-        acc_sum, n = 0.0, 0
-        for x, y in data_iter:
-            x = x.permute(0, 2, 1, 3, 4)
-            x, y = x.to(device), y.to(device)
-            logits = model(x)
-            acc_sum += (logits.argmax(1) == y).float().sum().item()
-            n += len(y)
-        model.train()
-        return acc_sum / n
+    # x: [batch_size, frame_len, channels, height, width] -> [batch_size, channels, frame_len, height, width]
+    trainer = Trainer(model, optimizer, config, scheduler=scheduler, writer=writer,
+                      batch_fn=lambda x, y: (x.permute(0, 2, 1, 3, 4), y))
+    trainer.train(train_iter, val_iter)
 
 
 def inference(config, ):
-    trans = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Resize((config.height, config.width)),
-        transforms.RandomHorizontalFlip(0.5)])
+    trans = VideoBatchTransform(size=(config.height, config.width), flip_prob=0.5)  # 同一片段中的帧翻转一致
     data_load = KTHData(frame_len=config.frame_len,
                         batch_size=config.batch_size,
-                        transforms=trans)
+                        batch_transforms=trans,
+                        num_workers=config.num_workers,
+                        pin_memory=torch.cuda.is_available())
     test_iter = data_load.load_train_val_test_data(is_train=False)
     model = KTH3DCNN(config)
     model.to(config.device)
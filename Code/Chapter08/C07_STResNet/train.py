@@ -9,7 +9,6 @@ import numpy as np
 from transformers import optimization
 from torch.utils.tensorboard import SummaryWriter
 import torch
-from copy import deepcopy
 import sys
 import logging
 import os
@@ -18,6 +17,8 @@ from STResNet import STResNet
 sys.path.append("../../")
 from utils import TaxiBJ
 from utils import logger_init
+from utils import CheckpointManager
+from utils import MetricsSink
 
 class ModelConfig(object):
     def __init__(self):
@@ -38,6 +39,7 @@ class ModelConfig(object):
         self.learning_rate = 4e-3
         self.num_warmup_steps = 300
         self.model_save_path = 'model.pt'
+        self.resume = False  # 是否从上一次被中断的训练（model_checkpoints中最近的checkpoint）继续
         self.summary_writer_dir = "runs/model"
         self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
         # 判断是否存在GPU设备，其中0表示指定第0块设备
@@ -57,14 +59,27 @@ def train(config):
         checkpoint = torch.load(config.model_save_path)
         model.load_state_dict(checkpoint)
     optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
-    writer = SummaryWriter(config.summary_writer_dir)
+    writer = MetricsSink(SummaryWriter(config.summary_writer_dir))  # 在后台线程中批量写入
     model = model.to(config.device)
     steps = len(train_iter) * config.epochs
     scheduler = optimization.get_cosine_schedule_with_warmup(optimizer, num_warmup_steps=config.num_warmup_steps,
                                                              num_training_steps=steps, num_cycles=2)
-    max_train_loss = 10000.
-    for epoch in range(config.epochs):
-        total_loss = 0
+    checkpoints = CheckpointManager(config.model_save_path, keep_last=2, keep_best=1, mode='min',
+                                    resume=config.resume)  # 在后台线程中保存模型
+    start_epoch = 0
+    if config.resume and checkpoints.latest() is not None:  # 同时恢复优化器和学习率的位置，避免重新开始warmup
+        checkpoint = torch.load(checkpoints.latest(), map_location='cpu', weights_only=False)
+        if checkpoint["epoch"] < config.epochs:
+            logging.info(f" # 从{checkpoints.latest()}恢复训练状态...")
+            model.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            scheduler.load_state_dict(checkpoint["scheduler"])
+            start_epoch = checkpoint["epoch"]
+        else:
+            logging.warning(f" ## {checkpoints.latest()} 已经训练完{checkpoint['epoch']}轮，不再从中恢复，将重新开始训练")
+            checkpoints.reset()
+    for epoch in range(start_epoch, config.epochs):
+        total_loss = torch.zeros((), dtype=torch.float64, device=config.device)  # 在设备上累计，避免每一步都同步
         for i, (XC, XP, XT, Y, meta_feature, _) in enumerate(train_iter):
             XC = XC.to(config.device)  # [batch_size, 2*len_closeness, 32,32]
             XP = XP.to(config.device)  # [batch_size, 2*len_period, 32,32]
@@ -76,19 +91,20 @@ def train(config):
             loss.backward()
             optimizer.step()  # 执行梯度下降
             scheduler.step()
-            total_loss += loss.item()
+            total_loss += loss.detach()
             if i % 50 == 0:
                 logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
                              f"--loss: {round(loss.item(), 4)}")
-                writer.add_scalar('Training/Loss', loss.item(), scheduler.last_epoch)
+                writer.add_scalar('Training/Loss', loss.detach(), scheduler.last_epoch)
+        total_loss = total_loss.item()
         logging.info(f"Epochs[{epoch + 1}/{config.epochs}] --Total loss: {total_loss}")
-        if total_loss < max_train_loss:
-            max_train_loss = total_loss
-            state_dict = deepcopy(model.state_dict())
-            torch.save(state_dict, config.model_save_path)
+        extra = {"optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(), "epoch": epoch + 1}
+        if checkpoints.save(model.state_dict(), scheduler.last_epoch, metric=total_loss, extra=extra):  # 损失下降时更新model_save_path
             rmse = evaluate(train_iter, model, config.device, mmn)
             logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--RMSE on train: {round(rmse, 4)}")
         # inference(config)
+    checkpoints.close()
+    writer.close()
 
 
 def compute_rmse(all_logits=None, all_labels=None, mmn=None):
@@ -10,6 +10,7 @@ from gensim.models import Word2Vec
 from gensim.models import KeyedVectors
 import logging
 import sys
+import os
 
 sys.path.append('../../')
 from utils import MyCorpus
@@ -26,6 +27,7 @@ class ModelConfig(object):
         self.negative = 5  # the int for negative specifies how many "noise words" should be drawn (usually between 5-20).
         self.cbow_mean = 1  # If 0, use the sum of the context word vectors. If 1, use the mean, only applies when cbow is used.
         self.epochs = 3
+        self.workers = os.cpu_count()  # 以corpus_file方式训练时，每个worker各自读取语料文件中的一段
         self.model_save_path = 'word2vec.model'
         self.model_save_path_bin = 'word2vec.bin'
         logger_init(log_file_name='log', log_level=logging.INFO, log_dir='log')
@@ -36,16 +38,19 @@ class ModelConfig(object):
 
 def train(config, update=False):
     sentences = MyCorpus()
+    corpus_file = sentences.export_corpus_file()
     if not update:
         logging.info(f" \n## 模型开始训练\n")
-        model = Word2Vec(sentences=sentences, vector_size=config.vector_size, window=config.window,
+        model = Word2Vec(corpus_file=corpus_file, vector_size=config.vector_size, window=config.window,
                          min_count=config.min_count, sg=config.sg, hs=config.hs,
-                         negative=config.negative, cbow_mean=config.cbow_mean, epochs=config.epochs)
+                         negative=config.negative, cbow_mean=config.cbow_mean, epochs=config.epochs,
+                         workers=config.workers)
     else:
         logging.info(f" \n ## 模型开始进行增量训练\n")
         model = Word2Vec.load(config.model_save_path)
-        model.build_vocab(sentences, update=update)
-        model.train(sentences, total_examples=model.corpus_count,epochs=config.epochs)
+        model.build_vocab(corpus_file=corpus_file, update=update)
+        model.train(corpus_file=corpus_file, total_examples=model.corpus_count,
+                    total_words=model.corpus_total_words, epochs=config.epochs)
     model.save(config.model_save_path)
     model.wv.save_word2vec_format(config.model_save_path_bin, binary=True)
 
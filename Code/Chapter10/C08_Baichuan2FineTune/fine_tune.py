@@ -40,6 +40,13 @@ class TrainingArguments(transformers.TrainingArguments):
         },
     )
     use_lora: bool = field(default=False)
+    dynamic_padding: bool = field(
+        default=False,
+        metadata={
+            "help": "Pad each batch to its longest sample instead of model_max_length. "
+                    "Use together with --group_by_length to batch samples of similar length."
+        },
+    )
 
 
 class SupervisedDataset(Dataset):
@@ -52,6 +59,7 @@ class SupervisedDataset(Dataset):
             model_max_length,
             user_tokens=[195],  # <reserved_106> 区分是来自用户的文本
             assistant_tokens=[196],  # <reserved_107> 区分是来自助手回答的文本，即希望模型根据用户输入的文本生成的文本
+            pad_to_max_length=True,  # 为False时不在此处padding，而是由DataCollatorForSupervisedDataset按batch进行padding
     ):
         super(SupervisedDataset, self).__init__()
         self.data = json.load(open(data_path))  # 载入原始所有数据，返回的是一个列表，即每个元素为一个样本（包含有多轮的上下文对话）
@@ -60,6 +68,7 @@ class SupervisedDataset(Dataset):
         self.user_tokens = user_tokens
         self.assistant_tokens = assistant_tokens
         self.ignore_index = -100  # 序号忽略token的ID
+        self.pad_to_max_length = pad_to_max_length
         item = self.preprocessing(self.data[0])  # 处理第1个样本，即取出第1个对话内容：
         """
         { "id": "77771","conversations": [
@@ -136,8 +145,9 @@ class SupervisedDataset(Dataset):
         labels.append(self.tokenizer.eos_token_id)
         input_ids = input_ids[: self.model_max_length]  # 截取最大窗口长度
         labels = labels[: self.model_max_length]
-        input_ids += [self.tokenizer.pad_token_id] * (self.model_max_length - len(input_ids))  # padding
-        labels += [self.ignore_index] * (self.model_max_length - len(labels))  #
+        if self.pad_to_max_length:
+            input_ids += [self.tokenizer.pad_token_id] * (self.model_max_length - len(input_ids))  # padding
+            labels += [self.ignore_index] * (self.model_max_length - len(labels))  #
         input_ids = torch.LongTensor(input_ids)
         labels = torch.LongTensor(labels)
         attention_mask = input_ids.ne(self.tokenizer.pad_token_id)
@@ -151,6 +161,27 @@ class SupervisedDataset(Dataset):
         return self.preprocessing(self.data[idx])
 
 
+@dataclass
+class DataCollatorForSupervisedDataset:
+    """
+    以batch中最长的样本为准进行padding，配合 --group_by_length 使用时，
+    Trainer会将长度相近的样本放到同一个batch中，从而减少padding带来的无效计算
+    """
+    pad_token_id: int
+    ignore_index: int = -100
+
+    def __call__(self, instances):
+        input_ids = [instance["input_ids"] for instance in instances]
+        labels = [instance["labels"] for instance in instances]
+        input_ids = torch.nn.utils.rnn.pad_sequence(input_ids, batch_first=True, padding_value=self.pad_token_id)
+        labels = torch.nn.utils.rnn.pad_sequence(labels, batch_first=True, padding_value=self.ignore_index)
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "attention_mask": input_ids.ne(self.pad_token_id),
+        }
+
+
 def train():
     parser = transformers.HfArgumentParser((ModelArguments, DataArguments, TrainingArguments))
     model_args, data_args, training_args = parser.parse_args_into_dataclasses()
@@ -185,10 +216,15 @@ def train():
         model.print_trainable_parameters()
 
     dataset = SupervisedDataset(
-        data_args.data_path, tokenizer, training_args.model_max_length
+        data_args.data_path, tokenizer, training_args.model_max_length,
+        pad_to_max_length=not training_args.dynamic_padding
     )  # 构造数据集
-    trainer = transformers.Trainer(model=model, args=training_args,
-                                   train_dataset=dataset, tokenizer=tokenizer)
+    data_collator = None
+    if training_args.dynamic_padding:
+        data_collator = DataCollatorForSupervisedDataset(pad_token_id=tokenizer.pad_token_id,
+                                                         ignore_index=dataset.ignore_index)
+    trainer = transformers.Trainer(model=model, args=training_args, train_dataset=dataset,
+                                   tokenizer=tokenizer, data_collator=data_collator)
     trainer.train()
     trainer.save_state()  # 保存整个trainer状态
     trainer.save_model(output_dir=training_args.output_dir)  # 仅保存模型权重
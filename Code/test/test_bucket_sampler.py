@@ -0,0 +1,47 @@
+import sys
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.append('../')
+
+from utils.data_helper import BucketBatchSampler
+
+
+def check_epoch(sampler, lengths, max_tokens=None):
+    """
+    检查一轮中：batch数与len(sampler)一致，每个样本恰好出现一次，且每个batch都不超过max_tokens
+    """
+    num_batches = len(sampler)  # 迭代后epoch会加1，需要先取得长度
+    batches = list(sampler)
+    assert len(batches) == num_batches
+    indices = sorted(idx for batch in batches for idx in batch)
+    assert indices == list(range(len(lengths)))
+    for batch in batches:
+        assert 0 < len(batch) <= sampler.batch_size
+        if max_tokens is not None:
+            assert len(batch) * max(lengths[idx] for idx in batch) <= max_tokens
+    return batches
+
+
+if __name__ == '__main__':
+    torch.manual_seed(2023)
+    # 长短样本混杂：大部分是短句，少数是长文本
+    lengths = torch.cat([torch.randint(5, 20, (1800,)), torch.randint(100, 300, (200,))])
+    lengths = lengths[torch.randperm(len(lengths))].tolist()
+    batch_size, max_tokens = 32, 2000
+
+    for max_tok in [None, max_tokens]:
+        sampler = BucketBatchSampler(lengths, batch_size=batch_size, pool_size=10, max_tokens=max_tok)
+        epoch_batches = [check_epoch(sampler, lengths, max_tok) for _ in range(3)]
+        assert epoch_batches[0] != epoch_batches[1]  # 每一轮的划分都不相同
+
+    # 作为DataLoader的batch_sampler使用时，batch数同样与len(loader)一致
+    sampler = BucketBatchSampler(lengths, batch_size=batch_size, max_tokens=max_tokens)
+    loader = DataLoader(lengths, batch_sampler=sampler, collate_fn=lambda x: x)
+    num_batches = len(loader)
+    assert sum(1 for _ in loader) == num_batches
+
+    bucket_ratio, random_ratio = BucketBatchSampler(lengths, batch_size=batch_size).padding_efficiency()
+    assert bucket_ratio > random_ratio
+    print(f"样本数: {len(lengths)}, 每轮batch数: {num_batches}, "
+          f"非padding位置的比例 分桶: {bucket_ratio:.2%}, 随机: {random_ratio:.2%}")
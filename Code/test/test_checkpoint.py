@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import torch
+import torch.nn as nn
+from copy import deepcopy
+
+sys.path.append('../')
+
+from utils import CheckpointManager
+
+
+def train_step(model):
+    with torch.no_grad():  # 模拟一次原地更新参数的梯度下降
+        for p in model.parameters():
+            p.add_(0.01)
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        torch.manual_seed(2023)
+        model = nn.Sequential(nn.Linear(1024, 1024), nn.ReLU(), nn.Linear(1024, 1024))
+        metrics = [0.1, 0.5, 0.3, 0.7, 0.2, 0.6]  # 模拟每个epoch在验证集上的准确率
+
+        # 原来的保存方式：deepcopy后在训练循环中阻塞写入
+        old_path = os.path.join(tmp_dir, 'old.pt')
+        start = time.time()
+        for metric in metrics:
+            train_step(model)
+            torch.save(deepcopy(model.state_dict()), old_path)
+        t_old = time.time() - start
+
+        new_path = os.path.join(tmp_dir, 'model.pt')
+        manager = CheckpointManager(new_path, keep_last=2, keep_best=2, mode='max')
+        expected = {}
+        t_new = 0.
+        for step, metric in enumerate(metrics):
+            train_step(model)
+            expected[step] = deepcopy(model.state_dict())  # 用于校验，不计入耗时
+            start = time.time()
+            manager.save(model.state_dict(), step, metric=metric)
+            t_new += time.time() - start
+        manager.close()
+
+        # 保存的是调用save()时的参数，之后的原地更新不会影响写入的内容
+        files = sorted(f for f in os.listdir(manager.checkpoint_dir) if f.startswith('ckpt_'))
+        assert files == ['ckpt_00000003.pt', 'ckpt_00000004.pt', 'ckpt_00000005.pt'], files  # 最近2个 + 最优2个
+        for name in files:
+            step = int(name[5:13])
+            state_dict = torch.load(os.path.join(manager.checkpoint_dir, name))
+            assert all(torch.equal(state_dict[k], expected[step][k]) for k in state_dict)
+        best = torch.load(new_path)  # model_save_path仍是可以直接load_state_dict的最优模型参数
+        assert all(torch.equal(best[k], expected[3][k]) for k in best) and manager.best_metric == 0.7
+        assert not [f for f in os.listdir(tmp_dir) if f.startswith('.tmp_ckpt_')]  # 没有残留的临时文件
+        for r in manager.history:
+            print(f"step: {r['step']}, metric: {r['metric']}, 大小: {r['bytes'] / 1024 ** 2:.2f}MB, "
+                  f"写入耗时: {r['seconds'] * 1000:.1f}ms")
+        print(f"保存{len(metrics)}次，训练循环中的耗时 阻塞写入: {t_old * 1000:.1f}ms, "
+              f"CheckpointManager: {t_new * 1000:.1f}ms, 加速比: {t_old / t_new:.2f}x")
+
+        # resume=True时接着上一次的记录继续保留和比较
+        manager = CheckpointManager(new_path, keep_last=2, keep_best=2, resume=True)
+        assert manager.best_metric == 0.7 and manager.latest().endswith('ckpt_00000005.pt')
+        manager.close()
+        # 重新开始一次新的训练时不受上一次训练的影响：即使指标更差也会更新model_save_path，且不会删除新的checkpoint
+        manager = CheckpointManager(new_path, keep_last=1, keep_best=0)
+        assert manager.best_metric is None and manager.latest() is None
+        manager.save(model.state_dict(), 0, metric=0.05)
+        manager.close()
+        assert manager.latest().endswith('ckpt_00000000.pt') and os.path.exists(manager.latest())
+        assert all(torch.equal(v, model.state_dict()[k]) for k, v in torch.load(new_path).items())
+
+        # 写入失败时，异常会在主线程中抛出
+        manager = CheckpointManager(os.path.join(tmp_dir, 'model.pt'), checkpoint_dir=os.path.join(tmp_dir, 'bad'))
+        shutil.rmtree(manager.checkpoint_dir)
+        manager.save(model.state_dict(), 0)
+        try:
+            manager.wait()
+            raise AssertionError("后台线程中的异常应当在主线程中抛出")
+        except FileNotFoundError as e:
+            print(f"捕获到后台线程中的异常: {e}")
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,73 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append('../')
+
+from utils import TaxiBJ
+from utils.data_helper import STMatrix
+from utils.tools import string2timestamp, find_gaps
+
+
+def complete_day_index_reference(timestamps, T=48):
+    """
+    改写前逐个时间片遍历的实现，用于对比结果和耗时
+    """
+    days = []
+    i = 0
+    while i < len(timestamps):
+        if int(timestamps[i][8:]) != 1:
+            i += 1
+        elif i + T - 1 < len(timestamps) and int(timestamps[i + T - 1][8:]) == T:
+            days.append(timestamps[i][:8])
+            i += T
+        else:
+            i += 1
+    days = set(days)
+    return [i for i, t in enumerate(timestamps) if t[:8] in days]
+
+
+def check_complete_reference(timestamps, T=48):
+    missing_timestamps = []
+    offset = pd.DateOffset(minutes=24 * 60 // T)
+    pd_timestamps = string2timestamp(timestamps, T)
+    i = 1
+    while i < len(pd_timestamps):
+        if pd_timestamps[i - 1] + offset != pd_timestamps[i]:
+            missing_timestamps.append((timestamps[i - 1], timestamps[i]))
+        i += 1
+    return missing_timestamps
+
+
+if __name__ == '__main__':
+    T = 48
+    rng = np.random.RandomState(2023)
+    days = pd.date_range('2013-07-01', periods=365 * 4).strftime('%Y%m%d')
+    timestamps = [f"{d}{s:02d}".encode() for d in days for s in range(1, T + 1)]
+    keep = rng.rand(len(timestamps)) > 0.005  # 随机缺失部分时间片
+    timestamps = [t for t, k in zip(timestamps, keep) if k]
+    print(f"时间片数量: {len(timestamps)}")
+
+    start = time.time()
+    expected = complete_day_index_reference(timestamps, T)
+    t_old = time.time() - start
+    start = time.time()
+    result = TaxiBJ.complete_day_index(timestamps, T)
+    t_new = time.time() - start
+    assert np.array_equal(expected, result)
+    print(f"complete_day_index, 原始实现: {t_old * 1000:.2f}ms, 当前实现: {t_new * 1000:.2f}ms, "
+          f"加速比: {t_old / t_new:.2f}x")
+
+    start = time.time()
+    expected = check_complete_reference(timestamps, T)
+    t_old = time.time() - start
+    start = time.time()
+    result = find_gaps(timestamps, T)
+    t_new = time.time() - start
+    assert expected == [(g['start'], g['end']) for g in result]
+    print(f"检测到{len(result)}处不连续，缺失{sum(g['missing'] for g in result)}个时间片")
+    print(f"check_complete, 原始实现: {t_old * 1000:.2f}ms, 当前实现: {t_new * 1000:.2f}ms, "
+          f"加速比: {t_old / t_new:.2f}x")
+    st = STMatrix(np.zeros(len(timestamps)), timestamps, T, CheckComplete=False)
+    assert st._pd_timestamps is None  # 构造时不再生成pandas时间戳
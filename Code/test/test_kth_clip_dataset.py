@@ -0,0 +1,77 @@
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from torch.utils.data import DataLoader
+
+sys.path.append('../')
+
+from utils import KTHData
+
+
+def make_frame_store(out_path, num_videos=6, num_frames=40, seed=2023):
+    """
+    构造一份与KTHData.data_process返回格式相同的模拟帧存储，帧以内存映射方式保存
+    每个视频在文件中预留num_frames帧，其中部分视频实际写入的帧数更少（与解码时帧数不足的情况一致）
+    """
+    rng = np.random.RandomState(seed)
+    frames = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint8,
+                                       shape=(num_videos * num_frames, 120, 160, 1))
+    frames[:] = rng.randint(0, 256, frames.shape, dtype=np.uint8)
+    frames.flush()
+    written = [num_frames - 7 * (i % 2) for i in range(num_videos)]
+    spans = np.array([(i * num_frames, i * num_frames + n) for i, n in enumerate(written)], dtype=np.int64)
+    return {"frames": np.load(out_path, mmap_mode='r'), "spans": spans,
+            "labels": np.arange(num_videos, dtype=np.int64) % len(KTHData.CATEGORIES),
+            "people_ids": np.array([1, 2, 3] * (num_videos // 3), dtype=np.int64)}
+
+
+def expected_clip(data, kth, video_id, start):
+    begin = data['spans'][video_id][0] + start
+    return data['frames'][begin:begin + kth.frame_len * kth.frame_step:kth.frame_step]
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        data = make_frame_store(os.path.join(tmp_dir, 'frames.npy'))
+        kth = KTHData(frame_len=5, stride=3, frame_step=2)
+        dataset = kth.make_dataset(data, people_ids=[1, 3])
+        window = (kth.frame_len - 1) * kth.frame_step + 1
+        for video_id, start, label in dataset.clips:  # 每个样本都位于所属视频实际写入的帧内
+            begin, end = data['spans'][video_id]
+            assert data['people_ids'][video_id] in [1, 3] and label == data['labels'][video_id]
+            assert start % kth.stride == 0 and begin + start + window <= end
+        assert len(dataset) > 0
+
+        # pickle时只传递内存映射文件的位置，还原后的样本与帧存储中的完全一致
+        buffer = pickle.dumps(dataset)
+        assert len(buffer) < data['frames'].nbytes / 100
+        restored = pickle.loads(buffer)
+        assert isinstance(restored.frames, np.ndarray) and len(restored) == len(dataset)
+        for i in [0, len(dataset) // 2, len(dataset) - 1]:
+            frames, label = restored[i]
+            video_id, start, _ = dataset.clips[i]
+            assert frames.shape == (kth.frame_len, 120, 160, 1) and label == dataset[i][1]
+            assert np.array_equal(frames, expected_clip(data, kth, video_id, start))
+
+        # 在多个worker中读取样本，fork方式共享父进程的内存映射，spawn方式会经过pickle在子进程中重新打开
+        for context in [None, 'spawn']:
+            loader = DataLoader(dataset, batch_size=4, shuffle=False, num_workers=2, multiprocessing_context=context,
+                                collate_fn=kth.generate_batch)
+            i = 0
+            for batch_frames, batch_label in loader:
+                assert batch_frames.shape[1:] == (kth.frame_len, 1, 120, 160)
+                for frames, label in zip(batch_frames.numpy(), batch_label.tolist()):
+                    video_id, start, expected_label = dataset.clips[i]
+                    assert label == expected_label
+                    expected = expected_clip(data, kth, video_id, start).transpose(0, 3, 1, 2)
+                    assert np.array_equal(frames, expected)
+                    i += 1
+            assert i == len(dataset)
+        print(f"样本数: {len(dataset)}, pickle后的大小: {len(buffer)}字节, 帧存储大小: {data['frames'].nbytes}字节, "
+              f"DataLoader(num_workers=2)读取的样本与帧存储一致")
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+
+sys.path.append('../')
+
+from utils import KTHData
+
+
+def load_avi_frames_reference(path, is_gray=False):
+    """
+    改写前逐帧通过PIL转换灰度图的实现，用于对比结果和耗时
+    """
+    import cv2
+    video = cv2.VideoCapture(path)
+    frames = []
+    while video.isOpened():
+        ret, frame = video.read()
+        if not ret:
+            break
+        if is_gray:
+            frame = Image.fromarray(frame)
+            frame = frame.convert("L")
+            frame = np.array(frame.getdata()).reshape((120, 160, 1))
+        frames.append(frame)
+    return np.array(frames, dtype=np.uint8)
+
+
+def make_synthetic_videos(video_dir, num_videos=12, num_frames=200, seed=2023):
+    """
+    当本地没有KTH数据集时，构造一批与KTH格式相同（160x120）的模拟视频
+    """
+    import cv2
+    rng = np.random.RandomState(seed)
+    paths = []
+    for i in range(num_videos):
+        path = os.path.join(video_dir, f"person{i % 25 + 1:02d}_boxing_d1_uncomp.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (160, 120))
+        background = rng.randint(0, 256, (120, 160, 3), dtype=np.uint8)
+        for t in range(num_frames):
+            writer.write(np.roll(background, t, axis=1))
+        writer.release()
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    category_dir = os.path.join(KTHData.DATA_DIR, KTHData.CATEGORIES[0])
+    if os.path.isdir(category_dir):
+        paths = [os.path.join(category_dir, name) for name in sorted(os.listdir(category_dir))][:24]
+    else:
+        print("未找到KTH数据集，使用模拟视频")
+        paths = make_synthetic_videos(tmp_dir)
+    try:
+        start = time.time()
+        expected = [load_avi_frames_reference(path, is_gray=True) for path in paths]
+        t_old = time.time() - start
+        num_frames = sum(len(frames) for frames in expected)
+        print(f"视频数: {len(paths)}, 帧数: {num_frames}")
+        print(f"原始实现: {num_frames / t_old:.1f}帧/秒")
+        for num_proc in [1, 2, 4, 8]:
+            if num_proc > os.cpu_count():
+                break
+            kth = KTHData(is_gray=True, num_proc=num_proc)
+            out_path = os.path.join(tmp_dir, f"frames_{num_proc}.npy")
+            start = time.time()
+            frames, spans = kth.decode_videos(paths, out_path)
+            t_new = time.time() - start
+            for (begin, end), e in zip(spans, expected):
+                assert np.array_equal(frames[begin:end], e)
+            print(f"num_proc = {num_proc}, 当前实现: {num_frames / t_new:.1f}帧/秒, 加速比: {t_old / t_new:.2f}x")
+        assert np.array_equal(KTHData.load_avi_frames(paths[0], is_gray=True), expected[0])
+    finally:
+        shutil.rmtree(tmp_dir)
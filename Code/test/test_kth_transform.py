@@ -0,0 +1,41 @@
+import sys
+import timeit
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+
+sys.path.append('../')
+
+from utils import KTHData, VideoBatchTransform
+
+if __name__ == '__main__':
+    torch.manual_seed(2023)
+    rng = np.random.RandomState(2023)
+    batch_size, frame_len = 64, 15
+    data_batch = [(rng.randint(0, 256, (frame_len, 120, 160, 1), dtype=np.uint8), i % 6) for i in range(batch_size)]
+    trans = transforms.Compose([transforms.ToTensor(), transforms.Resize((60, 80))])
+    per_frame = KTHData(transforms=trans)
+    batched = KTHData(batch_transforms=VideoBatchTransform(size=(60, 80)))
+    x_old, y_old = per_frame.generate_batch(data_batch)
+    x_new, y_new = batched.generate_batch(data_batch)
+    assert x_old.shape == x_new.shape and torch.equal(y_old, y_new)
+    print(f"最大误差: {(x_old - x_new).abs().max().item():.2e}")
+    assert torch.allclose(x_old, x_new, atol=1e-5)  # 与逐帧先转换为浮点数再缩放的结果一致
+
+    # 标准化与 transforms.Normalize 一致
+    norm = transforms.Compose([transforms.ToTensor(), transforms.Normalize([0.5], [0.25])])
+    x_old = KTHData(transforms=norm).generate_batch(data_batch)[0]
+    x_new = KTHData(batch_transforms=VideoBatchTransform(mean=[0.5], std=[0.25])).generate_batch(data_batch)[0]
+    assert torch.allclose(x_old, x_new, atol=1e-5)
+
+    # 同一个片段中所有帧的裁剪位置和翻转一致
+    clip = torch.arange(120 * 160, dtype=torch.uint8).view(1, 1, 120, 160, 1).repeat(batch_size, frame_len, 1, 1, 1)
+    out = VideoBatchTransform(crop_size=(100, 140), flip_prob=0.5)(clip)
+    assert out.shape == (batch_size, frame_len, 1, 100, 140)
+    assert torch.equal(out, out[:, :1].expand_as(out))
+
+    number = 5
+    t_old = timeit.timeit(lambda: per_frame.generate_batch(data_batch), number=number) / number
+    t_new = timeit.timeit(lambda: batched.generate_batch(data_batch), number=number) / number
+    print(f"batch_size = {batch_size}, frame_len = {frame_len}, 逐帧变换: {t_old * 1000:.2f}ms, "
+          f"整体变换: {t_new * 1000:.2f}ms, 加速比: {t_old / t_new:.2f}x")
@@ -0,0 +1,65 @@
+import os
+import sys
+import csv
+import json
+import weakref
+import time
+import shutil
+import tempfile
+import torch
+from torch.utils.tensorboard import SummaryWriter
+from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+
+sys.path.append('../')
+
+from utils import MetricsSink
+
+
+def read_scalars(log_dir, tag):
+    acc = EventAccumulator(log_dir)
+    acc.Reload()
+    return [(e.step, e.value) for e in acc.Scalars(tag)]
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        torch.manual_seed(2023)
+        num_steps = 2000
+        losses = [torch.rand(()) * 3 for _ in range(num_steps)]  # 模拟每一步的损失
+
+        old_dir, new_dir = os.path.join(tmp_dir, 'old'), os.path.join(tmp_dir, 'new')
+        writer = SummaryWriter(old_dir)
+        start = time.time()
+        for step, loss in enumerate(losses):
+            writer.add_scalar('Training/Loss', loss.item(), step)
+        t_old = time.time() - start
+        writer.close()
+
+        csv_path, jsonl_path = os.path.join(tmp_dir, 'metrics.csv'), os.path.join(tmp_dir, 'metrics.jsonl')
+        sink = MetricsSink(SummaryWriter(new_dir), csv_path=csv_path, jsonl_path=jsonl_path)
+        start = time.time()
+        for step, loss in enumerate(losses):
+            sink.add_scalar('Training/Loss', loss, step)
+        t_new = time.time() - start
+        sink.add_scalar('Testing/Accuracy', 0.5, num_steps)  # 也可以直接传入Python数值
+        sink.close()
+
+        expected = read_scalars(old_dir, 'Training/Loss')
+        assert len(expected) == num_steps and read_scalars(new_dir, 'Training/Loss') == expected  # 曲线完全一致
+        with open(csv_path) as f:
+            rows = list(csv.DictReader(f))
+        assert [(int(r['step']), float(r['value'])) for r in rows[:-1]] == [(s, l.item()) for s, l in
+                                                                           enumerate(losses)]
+        with open(jsonl_path) as f:
+            records = [json.loads(line) for line in f]
+        assert records[-1]['tag'] == 'Testing/Accuracy' and records[-1]['value'] == 0.5
+
+        ref = weakref.ref(sink)
+        sink.close()  # 重复关闭不会出错
+        del sink
+        assert ref() is None  # close()注销了atexit并结束了后台线程，sink可以被回收
+        print(f"步数: {num_steps}, 逐步写入: {t_old * 1000:.1f}ms, 训练循环中MetricsSink的耗时: {t_new * 1000:.1f}ms, "
+              f"加速比: {t_old / t_new:.2f}x")
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,45 @@
+import sys
+import timeit
+import torch
+
+sys.path.append('../')
+
+from utils.data_helper import pad_sequence
+
+
+def pad_sequence_reference(sequences, batch_first=False, max_len=None, padding_value=0):
+    """
+    改写前逐样本拼接padding内容的实现，用于对比结果和耗时
+    """
+    if max_len is None:
+        max_len = max([s.size(0) for s in sequences])
+    out_tensors = []
+    for tensor in sequences:
+        if tensor.size(0) < max_len:
+            padding_content = [padding_value] * (max_len - tensor.size(0))
+            tensor = torch.cat([tensor, torch.tensor(padding_content)], dim=0)
+        else:
+            tensor = tensor[:max_len]
+        out_tensors.append(tensor)
+    out_tensors = torch.stack(out_tensors, dim=1)
+    if batch_first:
+        return out_tensors.transpose(0, 1)
+    return out_tensors
+
+
+if __name__ == '__main__':
+    torch.manual_seed(2023)
+    for batch_size in [32, 64, 128, 256, 512, 1024]:
+        sequences = [torch.randint(2, 3000, [int(l)]) for l in torch.randint(5, 100, [batch_size])]
+        for batch_first in [True, False]:
+            for max_len in [None, 50]:
+                expected = pad_sequence_reference(sequences, batch_first, max_len, padding_value=1)
+                result = pad_sequence(sequences, batch_first, max_len, padding_value=1)
+                assert torch.equal(expected, result)
+        x, lengths, mask = pad_sequence(sequences, True, None, 1, return_lengths=True, return_mask=True)
+        assert torch.equal(mask.sum(1), lengths) and torch.all(x[~mask] == 1)
+        number = 50
+        t_old = timeit.timeit(lambda: pad_sequence_reference(sequences, True, None, 1), number=number) / number
+        t_new = timeit.timeit(lambda: pad_sequence(sequences, True, None, 1), number=number) / number
+        print(f"batch_size = {batch_size}, 原始实现: {t_old * 1000:.3f}ms, "
+              f"当前实现: {t_new * 1000:.3f}ms, 加速比: {t_old / t_new:.2f}x")
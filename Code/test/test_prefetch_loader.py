@@ -0,0 +1,62 @@
+import sys
+import time
+import torch
+from torch.utils.data import Dataset
+
+sys.path.append('../')
+
+from utils import make_loader, DevicePrefetcher
+
+
+class SlowDataset(Dataset):
+    """
+    每个样本需要load_time秒才能构造完成的模拟数据集
+    """
+
+    def __init__(self, n=64, load_time=0.002, fail_at=None):
+        self.n = n
+        self.load_time = load_time
+        self.fail_at = fail_at
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, idx):
+        if idx == self.fail_at:
+            raise ValueError(f"样本{idx}读取失败")
+        time.sleep(self.load_time)
+        return {"x": torch.full((8,), float(idx)), "y": torch.tensor(idx)}
+
+
+def run(loader, step_time=0.02):
+    start = time.time()
+    ys = []
+    for batch in loader:
+        time.sleep(step_time)  # 模拟一步前向和反向传播
+        ys += batch["y"].tolist()
+    return ys, time.time() - start
+
+
+if __name__ == '__main__':
+    data = SlowDataset()
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    plain = make_loader(data, batch_size=8)
+    prefetched = make_loader(data, batch_size=8, device=device)
+    assert isinstance(prefetched, DevicePrefetcher) and len(prefetched) == len(plain)
+    ys_old, t_old = run(plain)
+    ys_new, t_new = run(prefetched)
+    assert ys_old == ys_new == list(range(len(data)))  # 顺序与原来一致
+    stats = prefetched.wait_stats()
+    assert stats["steps"] == len(plain)
+    print(f"同步读取: {t_old:.3f}s, 后台预取: {t_new:.3f}s, 加速比: {t_old / t_new:.2f}x, "
+          f"等待数据总耗时: {stats['wait_total']:.3f}s")
+
+    for batch in make_loader(data, batch_size=8, num_workers=2, prefetch_factor=4, device=device):
+        assert batch["x"].device.type == torch.device(device).type
+        break  # 中途退出时后台线程能够正常结束
+
+    try:
+        list(make_loader(SlowDataset(fail_at=20), batch_size=8, device=device))
+        raise AssertionError("后台线程中的异常应当在主线程中抛出")
+    except ValueError as e:
+        print(f"捕获到后台线程中的异常: {e}")
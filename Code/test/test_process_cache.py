@@ -0,0 +1,42 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.append('../')
+
+from utils import process_cache
+
+
+class ToyData(object):
+    def __init__(self, cache_dir, race=False):
+        self.top_k = 10
+        self.race = race
+        self.calls = 0
+        self.cache_dir = cache_dir
+
+    @process_cache(unique_key=['top_k'], backend='mmap')
+    def data_process(self, file_path=None):
+        self.calls += 1
+        if self.race:  # 模拟另一个任务在本任务处理完成之前写入了同一份缓存
+            ToyData(self.cache_dir).data_process(file_path=file_path)
+        return {"x": np.arange(1 << 19, dtype=np.int64) * self.top_k}
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_path = os.path.join(tmp_dir, 'toy.txt')
+        with open(file_path, 'w') as f:
+            f.write('toy')
+        data = ToyData(tmp_dir, race=True).data_process(file_path=file_path)
+        assert np.array_equal(data["x"], np.arange(1 << 19, dtype=np.int64) * 10)
+        names = os.listdir(tmp_dir)
+        assert not [n for n in names if n.startswith('.tmp_cache_')], names  # 没有残留的临时目录
+        assert len([n for n in names if n.endswith('.mmap')]) == 1
+        again = ToyData(tmp_dir)
+        assert np.array_equal(again.data_process(file_path=file_path)["x"], data["x"]) and again.calls == 0
+        print("并发写入同一份缓存时，后完成的任务直接载入已有的缓存")
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,127 @@
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import torch
+import torch.nn as nn
+from torch.utils.data import TensorDataset
+import math
+
+sys.path.append('../')
+
+from utils import Trainer
+from utils import make_loader
+from utils import ResumableSampler
+
+
+class MLP(nn.Module):
+    def __init__(self, in_features=32, num_classes=10):
+        super(MLP, self).__init__()
+        self.net = nn.Sequential(nn.Linear(in_features, 64), nn.ReLU(), nn.Dropout(0.3), nn.Linear(64, num_classes))
+
+    def forward(self, x, labels=None):
+        logits = self.net(x)
+        if labels is not None:
+            loss = nn.CrossEntropyLoss(reduction='mean')(logits, labels)
+            return loss, logits
+        return logits
+
+
+class ModelConfig(object):
+    def __init__(self, model_save_path):
+        self.epochs = 3
+        self.model_save_path = model_save_path
+        self.device = torch.device('cpu')
+        self.save_every_steps = 7
+        self.resume = True
+
+
+class Preempted(Exception):
+    pass
+
+
+def make_trainer(config, num_batches, stop_at=None):
+    """
+    :param stop_at: 训练到第stop_at个batch时模拟任务被抢占
+    """
+    model = MLP()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    total = num_batches * config.epochs  # 与 get_cosine_schedule_with_warmup 相同的学习率变化
+    scheduler = torch.optim.lr_scheduler.LambdaLR(
+        optimizer, lambda step: step / 20 if step < 20 else 0.5 * (1 + math.cos(math.pi * (step - 20) / (total - 20))))
+    steps = [0]
+
+    def batch_fn(x, y):
+        steps[0] += 1
+        if steps[0] == stop_at:
+            raise Preempted()
+        return x, y
+
+    return Trainer(model, optimizer, config, scheduler=scheduler, batch_fn=batch_fn)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        g = torch.Generator().manual_seed(2023)
+        data = TensorDataset(torch.randn(800, 32, generator=g), torch.randint(0, 10, (800,), generator=g))
+        train_iter = make_loader(data, batch_size=16, shuffle=True)
+        assert isinstance(train_iter.sampler, ResumableSampler)
+
+        # 不中断的训练过程
+        torch.manual_seed(2023)
+        expected = make_trainer(ModelConfig(os.path.join(tmp_dir, 'a', 'model.pt')), len(train_iter))
+        os.makedirs(os.path.join(tmp_dir, 'a'), exist_ok=True)
+        expected.train(make_loader(data, batch_size=16, shuffle=True), train_iter)
+
+        # 在第2轮中途被抢占，随后用全新的模型和优化器恢复训练
+        config = ModelConfig(os.path.join(tmp_dir, 'b', 'model.pt'))
+        os.makedirs(os.path.join(tmp_dir, 'b'), exist_ok=True)
+        stop_at = len(train_iter) + 31
+        torch.manual_seed(2023)
+        trainer = make_trainer(config, len(train_iter), stop_at=stop_at)
+        try:
+            trainer.train(make_loader(data, batch_size=16, shuffle=True), train_iter)
+        except Preempted:
+            trainer.checkpoints.wait()
+        torch.manual_seed(0)  # 恢复后不依赖于当前的随机状态
+        resumed = make_trainer(config, len(train_iter))
+        resumed.train(make_loader(data, batch_size=16, shuffle=True), train_iter)
+
+        for p, q in zip(expected.model.parameters(), resumed.model.parameters()):
+            assert torch.equal(p, q)  # 与不中断时得到的参数完全一致
+        assert expected.scheduler.last_epoch == resumed.scheduler.last_epoch == len(train_iter) * config.epochs
+        assert expected.max_test_acc == resumed.max_test_acc
+        # 已经训练完成的checkpoint不会被恢复，而是重新开始训练
+        rerun = make_trainer(config, len(train_iter))
+        rerun.train(make_loader(data, batch_size=16, shuffle=True), train_iter)
+        assert rerun.global_steps == len(train_iter) * config.epochs
+
+        finished = stop_at - 1  # 被抢占前已经完成的batch数
+        redo_step = finished - finished % config.save_every_steps
+        redo_epoch = finished - finished % len(train_iter)
+        print(f"被抢占前已训练{finished}个batch，恢复后需要重新训练的batch数 "
+              f"按轮保存: {finished - redo_epoch}, 每{config.save_every_steps}步保存: {finished - redo_step}")
+
+        # 数据的顺序与RandomSampler一样由torch.manual_seed决定，跳过的样本不计入长度
+        orders = []
+        for seed in [1, 1, 2]:
+            torch.manual_seed(seed)
+            orders.append(list(ResumableSampler(data)))
+        assert orders[0] == orders[1] != orders[2]
+        sampler = ResumableSampler(data, seed=1)
+        sampler.start_index = 5 * 16
+        loader = make_loader(data, batch_size=16, sampler=sampler)
+        assert len(loader) == len(train_iter) - 5 and len(list(loader)) == len(train_iter) - 5
+        assert len(loader) == len(train_iter)
+
+        # 只能逐个丢弃batch的DataLoader同样可以恢复到正确的位置
+        sequential = make_loader(data, batch_size=16, shuffle=False)
+        trainer = make_trainer(ModelConfig(None), len(sequential))
+        trainer.batch_in_epoch = 5
+        first = next(trainer.iter_epoch(sequential, epoch=0))
+        assert torch.equal(first[0], data.tensors[0][5 * 16:6 * 16])
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,50 @@
+import sys
+import random
+from collections import Counter
+
+sys.path.append('../')
+
+from utils.tools import SpaceSaving
+from utils.data_helper import Vocab
+
+
+def make_skewed_texts(num_texts=4000, words_per_text=50, vocab_size=5000, s=1.2, seed=2023):
+    """
+    构造词频服从Zipf分布的语料，少数高频词占据了大部分出现次数
+    """
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    weights = [1. / (i + 1) ** s for i in range(vocab_size)]
+    return [" ".join(rng.choices(words, weights=weights, k=words_per_text)) for _ in range(num_texts)]
+
+
+if __name__ == '__main__':
+    texts = make_skewed_texts()
+    tokens = [token for text in texts for token in text.split()]
+    exact = Counter(tokens)
+
+    top_n, capacity = 50, 500  # 计数器个数远小于不同token的个数（5000）
+    sketch = SpaceSaving(capacity=capacity)
+    sketch.update(tokens)
+    assert sketch.total == len(tokens) and len(sketch.counts) == capacity
+    for item, count in sketch.counts.items():
+        assert count >= exact[item]  # 估计值不会低估真实频次
+        assert count - sketch.errors[item] <= exact[item]  # 减去误差后不会高估真实频次
+        assert sketch.errors[item] <= sketch.error_bound
+
+    # guaranteed()给出的元素一定位于真实的前top_n名（频次不低于真实的第top_n名）
+    items = sketch.most_common(top_n + 1)
+    threshold = items[top_n][1]
+    guaranteed = [item for item, count in items[:top_n] if count - sketch.errors[item] >= threshold]
+    assert len(guaranteed) == sketch.guaranteed(top_n) > 0
+    nth_count = exact.most_common(top_n)[-1][1]
+    assert all(exact[item] >= nth_count for item in guaranteed)
+
+    # 流式构建的词表与精确统计得到的词表前top_k个token完全一致
+    top_k = top_n + 2
+    stream_vocab = Vocab.from_stream(texts, top_k=top_k, capacity=capacity, chunk_size=500)
+    exact_vocab = Vocab(top_k=top_k, data=texts)
+    assert stream_vocab.itos == exact_vocab.itos[:top_k]
+    print(f"token总数: {len(tokens)}, 不同token个数: {len(exact)}, 计数器容量: {capacity}, "
+          f"误差上界: {sketch.error_bound:.1f}, 前{top_n}名中可保证的个数: {len(guaranteed)}, "
+          f"流式词表前{top_k}个token与精确词表一致")
@@ -0,0 +1,59 @@
+import sys
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append('../')
+
+from utils.data_helper import STMatrix, STWindowDataset
+
+
+def make_synthetic_data(num_days=30, T=48, missing_ratio=0.02, seed=2023):
+    """
+    构造一份含缺失时间片的模拟流量数据
+    """
+    rng = np.random.RandomState(seed)
+    days = pd.date_range('2013-07-01', periods=num_days).strftime('%Y%m%d')
+    timestamps = [f"{d}{s:02d}".encode() for d in days for s in range(1, T + 1)]
+    keep = rng.rand(len(timestamps)) > missing_ratio
+    timestamps = [t for t, k in zip(timestamps, keep) if k]
+    data = rng.rand(len(timestamps), 2, 32, 32).astype(np.float32)
+    return data, timestamps
+
+
+if __name__ == '__main__':
+    kwargs = dict(len_closeness=3, len_period=2, len_trend=1)
+    blocks = [make_synthetic_data(seed=i) for i in range(2)]  # 与TaxiBJ一样由多个文件拼接而成
+
+    XC, XP, XT, Y, timestamps_Y, index, target, num_frames = [], [], [], [], [], [], [], 0
+    for data, timestamps in blocks:
+        st = STMatrix(data, timestamps, CheckComplete=False)
+        xc, xp, xt, y, ts = st.create_dataset(**kwargs)  # 完全展开的样本
+        XC.append(xc), XP.append(xp), XT.append(xt), Y.append(y), timestamps_Y.extend(ts)
+        _index, _target = st.create_index(**kwargs)  # 按需构造时只保存索引，需加上前面数据块中的帧数
+        index.append(_index + num_frames)
+        target.append(_target + num_frames)
+        num_frames += len(data)
+    XC, XP, XT, Y = np.vstack(XC), np.vstack(XP), np.vstack(XT), np.vstack(Y)
+
+    flow = torch.from_numpy(np.vstack([data for data, _ in blocks]))
+    meta_feature = torch.arange(len(Y), dtype=torch.float32).unsqueeze(-1)
+    dataset = STWindowDataset(flow, torch.from_numpy(np.vstack(index)), torch.from_numpy(np.hstack(target)),
+                              meta_feature, timestamps_Y, kwargs['len_closeness'], kwargs['len_period'])
+    assert len(dataset) == len(Y) > 0
+
+    n0 = len(index[0])  # 第一个数据块中的样本数
+    for i in [0, 1, n0 // 2, n0 - 1, n0, len(dataset) - 1]:  # 包括第一个和最后一个有效窗口，以及数据块的交界处
+        x_c, x_p, x_t, y, meta, timestamp = dataset[i]
+        assert np.array_equal(x_c.numpy(), XC[i]) and np.array_equal(x_p.numpy(), XP[i])
+        assert np.array_equal(x_t.numpy(), XT[i]) and np.array_equal(y.numpy(), Y[i])
+        assert meta.item() == i and timestamp == timestamps_Y[i]
+
+    idx = [0, n0, len(dataset) - 1]  # 一次取出整个batch
+    x_c, x_p, x_t, y, meta, timestamp = dataset[idx]
+    assert np.array_equal(x_c.numpy(), XC[idx]) and np.array_equal(x_p.numpy(), XP[idx])
+    assert np.array_equal(x_t.numpy(), XT[idx]) and np.array_equal(y.numpy(), Y[idx])
+    assert timestamp == [timestamps_Y[i] for i in idx]
+    expanded = XC.nbytes + XP.nbytes + XT.nbytes + Y.nbytes
+    print(f"样本数: {len(dataset)}, 完全展开占用: {expanded / 1024 ** 2:.1f}MB, "
+          f"按需构造占用: {flow.numpy().nbytes / 1024 ** 2:.1f}MB, 抽样检查的样本与完全展开时一致")
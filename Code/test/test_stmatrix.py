@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append('../')
+
+from utils import TaxiBJ
+from utils.data_helper import STMatrix
+
+
+def create_dataset_reference(st, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+    """
+    改写前逐个时间片构造样本的实现，用于对比结果和耗时
+    """
+    offset_frame = pd.DateOffset(minutes=24 * 60 // st.T)
+    XC, XP, XT, Y, timestamps_Y = [], [], [], [], []
+    depends = [range(1, len_closeness + 1),
+               [PeriodInterval * st.T * j for j in range(1, len_period + 1)],
+               [TrendInterval * st.T * j for j in range(1, len_trend + 1)]]
+    i = max(st.T * TrendInterval * len_trend, st.T * PeriodInterval * len_period, len_closeness)
+    while i < len(st.pd_timestamps):
+        Flag = True
+        for depend in depends:
+            if Flag is False:
+                break
+            Flag = st.check_it([st.pd_timestamps[i] - j * offset_frame for j in depend])
+        if Flag is False:
+            i += 1
+            continue
+        x_c = [st.get_matrix(st.pd_timestamps[i] - j * offset_frame) for j in depends[0]]
+        x_p = [st.get_matrix(st.pd_timestamps[i] - j * offset_frame) for j in depends[1]]
+        x_t = [st.get_matrix(st.pd_timestamps[i] - j * offset_frame) for j in depends[2]]
+        y = st.get_matrix(st.pd_timestamps[i])
+        if len_closeness > 0:
+            XC.append(np.vstack(x_c))
+        if len_period > 0:
+            XP.append(np.vstack(x_p))
+        if len_trend > 0:
+            XT.append(np.vstack(x_t))
+        Y.append(y)
+        timestamps_Y.append(st.timestamps[i])
+        i += 1
+    return np.asarray(XC), np.asarray(XP), np.asarray(XT), np.asarray(Y), timestamps_Y
+
+
+def make_synthetic_data(num_days=180, T=48, missing_ratio=0.02, seed=2023):
+    """
+    当本地没有TaxiBJ数据集时，构造一份含缺失时间片的模拟数据
+    """
+    rng = np.random.RandomState(seed)
+    days = pd.date_range('2013-07-01', periods=num_days).strftime('%Y%m%d')
+    timestamps = [f"{d}{s:02d}".encode() for d in days for s in range(1, T + 1)]
+    keep = rng.rand(len(timestamps)) > missing_ratio
+    timestamps = [t for t, k in zip(timestamps, keep) if k]
+    data = rng.rand(len(timestamps), 2, 32, 32).astype(np.float32)
+    return data, timestamps
+
+
+def compare(data, timestamps, T=48, **kwargs):
+    st = STMatrix(data, timestamps, T, CheckComplete=False)
+    start = time.time()
+    expected = create_dataset_reference(st, **kwargs)
+    t_old = time.time() - start
+    start = time.time()
+    result = st.create_dataset(**kwargs)
+    t_new = time.time() - start
+    for e, r in zip(expected[:4], result[:4]):
+        assert e.dtype == r.dtype and e.shape == r.shape and np.array_equal(e, r)
+    assert expected[4] == result[4]
+    print(f"样本数: {len(result[3])}, 原始实现: {t_old:.2f}s, 当前实现: {t_new:.2f}s, 加速比: {t_old / t_new:.2f}x")
+    return t_old, t_new
+
+
+if __name__ == '__main__':
+    configs = [dict(len_closeness=3, len_period=1, len_trend=1),
+               dict(len_closeness=3, len_period=3, len_trend=3)]
+    if all(os.path.exists(f) for f in TaxiBJ.FILE_PATH_FLOW):
+        blocks = []
+        for fname in TaxiBJ.FILE_PATH_FLOW:
+            data, timestamps = TaxiBJ.load_stdata(fname)
+            blocks.append(TaxiBJ.remove_incomplete_days(data, timestamps))
+    else:
+        print("未找到TaxiBJ数据集，使用模拟数据")
+        blocks = [make_synthetic_data(seed=i) for i in range(4)]
+    for kwargs in configs:
+        print(kwargs)
+        total_old, total_new = 0., 0.
+        for data, timestamps in blocks:
+            t_old, t_new = compare(data, timestamps, **kwargs)
+            total_old, total_new = total_old + t_old, total_new + t_new
+        print(f"总计 原始实现: {total_old:.2f}s, 当前实现: {total_new:.2f}s, 加速比: {total_old / total_new:.2f}x")
+    # 边界情况：时间片数量不足以构造任何样本
+    compare(*make_synthetic_data(num_days=3), len_closeness=3, len_period=1, len_trend=1)
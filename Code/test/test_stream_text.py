@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+from torch.utils.data import DataLoader
+
+sys.path.append('../')
+
+from utils import TouTiaoNews
+from utils.data_helper import StreamTextDataset, iter_file_shard
+
+
+def make_synthetic_news(path, num_lines=20000, seed=2023):
+    """
+    当本地没有头条新闻数据集时，构造一份格式相同（样本_!_标签）的模拟数据
+    """
+    rng = np.random.RandomState(seed)
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_lines):
+            f.write(''.join(rng.choice(chars, rng.randint(5, 30))) + f"_!_{i % 15}\n")
+
+
+def to_key(sample):
+    return tuple(sample[0].tolist()), int(sample[1])
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    TouTiaoNews.DATA_DIR = tmp_dir
+    TouTiaoNews.FILE_PATH = [os.path.join(tmp_dir, f'toutiao_{s}.txt') for s in ['train', 'val', 'test']]
+    for i, path in enumerate(TouTiaoNews.FILE_PATH):
+        make_synthetic_news(path, seed=i)
+    try:
+        path = TouTiaoNews.FILE_PATH[0]
+        lines = open(path, encoding='utf-8').readlines()
+        for num_shards in [1, 2, 3, 7]:  # 所有分片拼接后与整个文件一致
+            assert sum([list(iter_file_shard(path, k, num_shards)) for k in range(num_shards)], []) == lines
+
+        toutiao_news = TouTiaoNews(top_k=2000, batch_size=64)
+        streaming_news = TouTiaoNews(top_k=2000, batch_size=64, streaming=True)
+        assert streaming_news.vocab.itos == toutiao_news.vocab.itos  # 流式构建的词表与原来一致
+
+        tracemalloc.start()
+        start = time.time()
+        data = toutiao_news.data_process(file_path=path)
+        t_old = time.time() - start
+        peak_old = tracemalloc.get_traced_memory()[1]
+        expected = [to_key(sample) for sample in data]
+        del data
+        stream = StreamTextDataset(streaming_news, path)
+        tracemalloc.reset_peak()
+        start = time.time()
+        first = None
+        for sample in stream:
+            first = first or time.time() - start
+        t_new = time.time() - start
+        peak_new = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert [to_key(sample) for sample in stream] == expected
+        print(f"样本数: {len(expected)}, 预处理整个数据集: {t_old:.2f}s, 峰值内存{peak_old / 2 ** 20:.1f}MB; "
+              f"流式读取: {t_new:.2f}s, 首个样本{first * 1000:.1f}ms, 峰值内存{peak_new / 2 ** 20:.1f}MB")
+
+        # 多个worker读取且开启打乱后，每个样本恰好出现一次
+        shuffled = StreamTextDataset(streaming_news, path, shuffle_buffer=1000)
+        loader = DataLoader(shuffled, batch_size=None, num_workers=2, persistent_workers=True)
+        epochs = [[to_key(sample) for sample in loader] for _ in range(2)]
+        for result in epochs:
+            assert sorted(result) == sorted(expected) and result != expected
+        assert epochs[0] != epochs[1]  # 每一轮的顺序不同
+
+        train_iter, val_iter = TouTiaoNews(top_k=2000, batch_size=64, streaming=True,
+                                           num_workers=2).load_train_val_test_data(is_train=True)
+        x, y = next(iter(train_iter))
+        assert x.shape[0] == 64 and y.shape == (64,)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,74 @@
+import sys
+import time
+import timeit
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append('../')
+
+from utils.tools import string2timestamp, timestamp2vec, holiday2vec, slot2vec
+
+
+def string2timestamp_reference(strings, T=48):
+    """
+    改写前逐个构造datetime的实现，用于对比结果和耗时
+    """
+    timestamps = []
+    time_per_slot = 24.0 / T
+    num_per_T = T // 24
+    for t in strings:
+        year, month, day, slot = int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:]) - 1
+        timestamp = datetime(year, month, day, hour=int(slot * time_per_slot),
+                             minute=(slot % num_per_T) * int(60.0 * time_per_slot))
+        timestamps.append(pd.Timestamp(timestamp))
+    return timestamps
+
+
+def timestamp2vec_reference(timestamps):
+    vec = [time.strptime(str(t[:8], encoding='utf-8'), '%Y%m%d').tm_wday for t in timestamps]
+    ret = []
+    for i in vec:
+        v = [0 for _ in range(7)]
+        v[i] = 1
+        if i >= 5:
+            v.append(0)
+        else:
+            v.append(1)
+        ret.append(v)
+    return np.asarray(ret)
+
+
+def holiday2vec_reference(timestamps, holidays):
+    holidays = set(holidays)
+    H = np.zeros(len(timestamps))
+    for i, slot in enumerate(timestamps):
+        if slot[:8] in holidays:
+            H[i] = 1
+    return H[:, None]
+
+
+if __name__ == '__main__':
+    T = 48
+    # 约2.2万个时间片，与TaxiBJ 4个文件中的时间片总数相当
+    days = pd.date_range('2013-07-01', periods=460).strftime('%Y%m%d')
+    timestamps = [f"{d}{s:02d}".encode() for d in days for s in range(1, T + 1)]
+    holidays = [d for d in days[::17]]
+    assert string2timestamp(timestamps, T) == string2timestamp_reference(timestamps, T)
+    hourly = [f"{d}{s:02d}".encode() for d in days[:10] for s in range(1, 25)]
+    assert string2timestamp(hourly, 24) == string2timestamp_reference(hourly, 24)
+    assert np.array_equal(timestamp2vec(timestamps), timestamp2vec_reference(timestamps))
+    holidays_bytes = [h.encode() for h in holidays]
+    assert np.array_equal(holiday2vec(timestamps, holidays_bytes), holiday2vec_reference(timestamps, holidays_bytes))
+    assert holiday2vec(timestamps, holidays).sum() == len(holidays) * T
+    assert np.array_equal(slot2vec(timestamps, T).argmax(1), np.tile(np.arange(T), len(days)))
+    cases = [("string2timestamp", lambda: string2timestamp_reference(timestamps, T),
+              lambda: string2timestamp(timestamps, T)),
+             ("timestamp2vec", lambda: timestamp2vec_reference(timestamps), lambda: timestamp2vec(timestamps)),
+             ("holiday2vec", lambda: holiday2vec_reference(timestamps, holidays_bytes),
+              lambda: holiday2vec(timestamps, holidays_bytes))]
+    print(f"时间片数量: {len(timestamps)}")
+    for name, old, new in cases:
+        t_old = timeit.timeit(old, number=3) / 3
+        t_new = timeit.timeit(new, number=3) / 3
+        print(f"{name}, 原始实现: {t_old * 1000:.2f}ms, 当前实现: {t_new * 1000:.2f}ms, 加速比: {t_old / t_new:.2f}x")
@@ -0,0 +1,111 @@
+import sys
+import time
+import logging
+import torch
+import torch.nn as nn
+from copy import deepcopy
+
+sys.path.append('../')
+
+from utils import Trainer
+from utils import num_update_steps
+
+
+class MLP(nn.Module):
+    def __init__(self, in_features=32, num_classes=10):
+        super(MLP, self).__init__()
+        self.net = nn.Sequential(nn.Linear(in_features, 64), nn.ReLU(), nn.Linear(64, num_classes))
+
+    def forward(self, x, labels=None):
+        logits = self.net(x)
+        if labels is not None:
+            loss = nn.CrossEntropyLoss(reduction='mean')(logits, labels)
+            return loss, logits
+        return logits
+
+
+class ModelConfig(object):
+    def __init__(self):
+        self.epochs = 2
+        self.model_save_path = None
+        self.device = torch.device('cpu')
+
+
+def make_batches(num_batches=200, batch_size=32, seed=2023):
+    g = torch.Generator().manual_seed(seed)
+    return [(torch.randn(batch_size, 32, generator=g), torch.randint(0, 10, (batch_size,), generator=g))
+            for _ in range(num_batches)]
+
+
+def train_reference(model, optimizer, train_iter, config):
+    """
+    改写前各章节train.py中的训练过程
+    """
+    for epoch in range(config.epochs):
+        for i, (x, y) in enumerate(train_iter):
+            x, y = x.to(config.device), y.to(config.device)
+            loss, logits = model(x, y)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()  # 执行梯度下降
+            if i % 50 == 0:
+                acc = (logits.argmax(1) == y).float().mean()
+                logging.info(f"Epochs[{epoch + 1}/{config.epochs}]--batch[{i}/{len(train_iter)}]"
+                             f"--Acc: {round(acc.item(), 4)}--loss: {round(loss.item(), 4)}")
+
+
+def max_diff(a, b):
+    return max((p - q).abs().max().item() for p, q in zip(a.parameters(), b.parameters()))
+
+
+if __name__ == '__main__':
+    config = ModelConfig()
+    batches = make_batches()
+    torch.manual_seed(2023)
+    init = MLP()
+
+    warmup = deepcopy(init)
+    train_reference(warmup, torch.optim.SGD(warmup.parameters(), lr=0.1), batches[:10], config)
+    model_old, model_new = deepcopy(init), deepcopy(init)
+    start = time.time()
+    train_reference(model_old, torch.optim.SGD(model_old.parameters(), lr=0.1), batches, config)
+    t_old = time.time() - start
+    trainer = Trainer(model_new, torch.optim.SGD(model_new.parameters(), lr=0.1), config)
+    start = time.time()
+    trainer.train(batches)
+    t_new = time.time() - start
+    assert max_diff(model_old, model_new) < 1e-6  # 与原来的训练过程得到的参数一致
+    print(f"原始训练过程: {t_old:.3f}s, Trainer: {t_new:.3f}s")
+
+    # 梯度累积：2个batch累积一次与直接使用两倍大小的batch等价
+    model_a, model_b = deepcopy(init), deepcopy(init)
+    Trainer(model_a, torch.optim.SGD(model_a.parameters(), lr=0.1), config, accumulation_steps=2).train(batches)
+    merged = [(torch.cat([batches[i][0], batches[i + 1][0]]), torch.cat([batches[i][1], batches[i + 1][1]]))
+              for i in range(0, len(batches), 2)]
+    Trainer(model_b, torch.optim.SGD(model_b.parameters(), lr=0.1), config).train(merged)
+    assert max_diff(model_a, model_b) < 1e-5
+
+    # 最后不足accumulation_steps个的batch按实际数量求平均；scheduler只在更新参数时调用
+    model_a, model_b = deepcopy(init), deepcopy(init)
+    config.accumulation_steps = 3
+    optimizer = torch.optim.SGD(model_a.parameters(), lr=0.1)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: 1.)
+    Trainer(model_a, optimizer, config, scheduler=scheduler).train(batches[:8])
+    assert scheduler.last_epoch == num_update_steps(8, config) == 6
+    config.accumulation_steps = 1
+    merged = [(torch.cat([b[0] for b in batches[i:min(i + 3, 8)]]), torch.cat([b[1] for b in batches[i:min(i + 3, 8)]]))
+              for i in range(0, 8, 3)]  # 最后一组只有2个batch
+    Trainer(model_b, torch.optim.SGD(model_b.parameters(), lr=0.1), config).train(merged)
+    assert max_diff(model_a, model_b) < 1e-5
+
+    # 在验证集上的准确率与逐batch调用.item()的结果一致
+    acc = trainer.evaluate(batches)
+    with torch.no_grad():
+        expected = sum((model_new(x).argmax(1) == y).sum().item() for x, y in batches) / sum(len(y) for _, y in batches)
+    assert abs(acc - expected) < 1e-12
+
+    # bf16混合精度
+    model_bf16 = deepcopy(init)
+    trainer = Trainer(model_bf16, torch.optim.SGD(model_bf16.parameters(), lr=0.1), config, amp_dtype='bf16')
+    trainer.train(batches)
+    assert trainer.evaluate(batches) > 0.1 and model_bf16.net[0].weight.dtype == torch.float32
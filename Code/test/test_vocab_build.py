@@ -0,0 +1,24 @@
+import sys
+import time
+import os
+
+sys.path.append('../')
+
+from utils import MR
+from utils.data_helper import Vocab
+
+if __name__ == '__main__':
+    samples, _ = MR.load_raw_data(MR.FILE_PATH[0])  # 使用仓库中自带的MR数据集
+    samples = samples * 20  # 重复多次以便观察多进程带来的加速
+    Vocab(top_k=3000, data=samples[:1000], cut_words=False)  # 预热，避免首次运行的开销计入单进程的耗时
+    results = {}
+    # 至少比较1个和2个进程，即使只有1个CPU也会走多进程的统计和合并过程
+    for num_proc in sorted({1, 2, min(4, os.cpu_count() or 1)}):
+        start = time.time()
+        vocab = Vocab(top_k=3000, data=samples, cut_words=False, num_proc=num_proc)
+        results[num_proc] = (time.time() - start, vocab)
+    base_time, base_vocab = results[1]
+    for num_proc, (cost, vocab) in results.items():
+        assert vocab.stoi == base_vocab.stoi and vocab.itos == base_vocab.itos  # 多进程的结果与单进程完全一致
+        print(f"样本数: {len(samples)}, CPU数: {os.cpu_count()}, num_proc = {num_proc}, "
+              f"耗时: {cost:.2f}s, 加速比: {base_time / cost:.2f}x")
@@ -0,0 +1,54 @@
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append('../')
+
+from utils import TouTiaoNews
+from utils import get_cache_stats
+
+
+def make_dataset(data_dir):
+    """
+    在data_dir中构造与头条新闻格式一致的小数据集
+    """
+
+    class ToyNews(TouTiaoNews):
+        DATA_DIR = data_dir
+        FILE_PATH = [os.path.join(data_dir, f'toutiao_{name}.txt') for name in ['train', 'val', 'test']]
+
+    for i, path in enumerate(ToyNews.FILE_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            for j in range(40):
+                f.write(f"{'春夏秋冬山水'[(i + j) % 6]}风{'花雪月'[j % 3]}第{j % 7}篇_!_{j % 3}\n")
+    return ToyNews
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ToyNews = make_dataset(tmp_dir)
+        vocab_path = os.path.join(tmp_dir, 'vocab.bin')
+        ToyNews(top_k=8, vocab_path=vocab_path).load_train_val_test_data(is_train=True)
+        misses = get_cache_stats()["misses"]
+
+        # 使用同一份词表时命中缓存
+        ToyNews(top_k=8, vocab_path=vocab_path).load_train_val_test_data(is_train=True)
+        assert get_cache_stats()["misses"] == misses
+
+        # 更换词表后不会误用由旧词表得到的缓存
+        os.remove(vocab_path)
+        news = ToyNews(top_k=12, vocab_path=vocab_path)
+        assert news.vocab_digest != ToyNews(top_k=8).vocab_digest
+        news.load_train_val_test_data(is_train=True)
+        assert get_cache_stats()["misses"] > misses
+
+        # 载入的词表大于top_k时直接报错
+        try:
+            ToyNews(top_k=8, vocab_path=vocab_path)
+            raise AssertionError("词表大小与top_k不一致时应当报错")
+        except ValueError as e:
+            print(f"捕获到词表与top_k不一致的错误: {e}")
+    finally:
+        shutil.rmtree(tmp_dir)
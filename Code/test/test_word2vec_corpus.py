@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.append('../')
+
+from gensim.models import Word2Vec
+from utils import MyCorpus
+
+
+def make_synthetic_corpus(path, num_lines=20000, vocab_size=5000, seed=2023):
+    """
+    当本地没有SougoNews数据集时，构造一份分词后（以空格分隔）的模拟语料
+    """
+    rng = np.random.RandomState(seed)
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 200)]
+    words = [''.join(rng.choice(chars, rng.randint(2, 4))) for _ in range(vocab_size)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(num_lines):
+            ids = rng.zipf(1.3, rng.randint(0, 60)) % vocab_size
+            f.write(' '.join(words[i] for i in ids) + '\n')
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    MyCorpus.DATA_DIR = tmp_dir
+    make_synthetic_corpus(os.path.join(tmp_dir, 'SougoNews_word2vec.txt'))
+    try:
+        start = time.time()
+        corpus = MyCorpus()
+        print(f"转换为二进制语料耗时: {time.time() - start:.2f}s")
+        text_corpus = MyCorpus(use_binary=False)
+        expected = list(text_corpus)
+        assert list(corpus) == expected
+        with open(corpus.export_corpus_file(), encoding='utf-8') as f:
+            assert [line.split() for line in f] == expected
+
+        epochs = 5
+        start = time.time()
+        for _ in range(epochs):
+            for _ in text_corpus:
+                pass
+        t_old = time.time() - start
+        start = time.time()
+        for _ in range(epochs):
+            for _ in corpus:
+                pass
+        t_new = time.time() - start
+        print(f"遍历{epochs}轮, 文本语料: {t_old:.2f}s, 二进制语料: {t_new:.2f}s, 加速比: {t_old / t_new:.2f}x")
+
+        model = Word2Vec(corpus_file=corpus.export_corpus_file(), vector_size=16, min_count=1, epochs=1,
+                         workers=os.cpu_count())
+        assert model.corpus_total_words == sum(len(s) for s in expected)  # 空行在corpus_file模式下会被跳过
+        assert len(model.wv) == len({w for s in expected for w in s})
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -6,11 +6,18 @@
 知 乎: @月来客栈 https://www.zhihu.com/people/the_lastest
 """
 from .log_manage import logger_init
+from .log_manage import MetricsSink
 from .tools import get_gpus
+from .tools import set_cache_config
+from .tools import get_cache_stats
 from .data_helper import TouTiaoNews
 from .data_helper import TangShi
 from .data_helper import process_cache
 from .data_helper import KTHData
+from .data_helper import VideoBatchTransform
+from .data_helper import DevicePrefetcher
+from .data_helper import make_loader
+from .data_helper import ResumableSampler
 from .data_helper import TaxiBJ
 from .data_helper import DATA_HOME
 from .data_helper import SougoNews
@@ -18,20 +25,33 @@ from .data_helper import MyCorpus
 from .data_helper import MR
 from .data_helper import MR4ELMo
 from .data_helper import tokenize
+from .trainer import Trainer
+from .trainer import num_update_steps
+from .trainer import CheckpointManager
 
 __all__ = [
     "DATA_HOME",
     "tools",
     "process_cache",
+    "set_cache_config",
+    "get_cache_stats",
     "logger_init",
+    "MetricsSink",
     "get_gpus",
     "TouTiaoNews",
     "TangShi",
     "KTHData",
+    "VideoBatchTransform",
+    "DevicePrefetcher",
+    "make_loader",
+    "ResumableSampler",
     "TaxiBJ",
     "SougoNews",
     "MyCorpus",
     "MR",
     "MR4ELMo",
-    "tokenize"
+    "tokenize",
+    "Trainer",
+    "num_update_steps",
+    "CheckpointManager"
 ]
@@ -6,27 +6,46 @@
 知 乎: @月来客栈 https://www.zhihu.com/people/the_lastest
 """
 import json
+import hashlib
+import array
 import os
+import tempfile
+import struct
 import torch
 import logging
 import h5py
 import time
+import queue
+import threading
 
 from tqdm import tqdm
 import numpy as np
-from copy import copy
-from PIL import Image
 from torch.utils.data import DataLoader
+from torch.utils.data import Sampler
+from torch.utils.data import Dataset
+from torch.utils.data import IterableDataset
+from torch.utils.data import get_worker_info
+from torch.utils.data import BatchSampler
+from torch.utils.data import RandomSampler
+from torch.utils.data import SequentialSampler
 from collections import Counter
+from itertools import chain, repeat, islice
 import matplotlib.pyplot as plt
 import unicodedata
-import pandas as pd
+from multiprocessing import Pool
 from gensim import utils
 from .tools import process_cache
 from .tools import MinMaxNormalization
 from .tools import timestamp2vec
+from .tools import holiday2vec
+from .tools import slot2vec
 from .tools import string2timestamp
 from .tools import contains_chinese
+from .tools import SpaceSaving
+from .tools import parse_timeslots
+from .tools import find_gaps
+from .tools import memmap_reference
+from .tools import open_memmap_reference
 
 PROJECT_HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_HOME = os.path.join(PROJECT_HOME, 'data')
@@ -41,40 +60,262 @@ class Vocab(object):
     print(vocab.stoi)  # 得到一个字典，返回词表中每个词的索引；
     print(vocab.stoi['[UNK]'])  # 通过单词返回得到词表中对应的索引
     print(len(vocab))  # 返回词表长度
+    ids, offsets = vocab.encode_batch([['上', '联'], ['下', '联']])  # 批量编码，返回拼接后的int32数组和偏移量
+    print(vocab.decode_batch(torch.tensor([[3, 5], [6, 5]])))  # 批量解码整个张量
+    vocab.save('vocab.bin')  # 以二进制格式保存词表
+    vocab = Vocab.load('vocab.bin')  # 载入二进制格式的词表
+    vocab = Vocab.from_stream(open(path, encoding='utf-8'), top_k=50000)  # 在固定内存下流式构建词表
     :param top_k:  取出现频率最高的前top_k个token
     :param data: 为一个列表，每个元素为一句文本
+    :param num_proc: 统计词频时使用的进程数，大于1时将语料切分成num_proc份并行统计，
+                     结果与单进程完全一致
     :return:
     """
     UNK = '[UNK]'  # 0
     PAD = '[PAD]'  # 1
+    MAGIC = b'DLWMVOC1'  # 二进制词表文件的文件头
 
-    def __init__(self, top_k=2000, data=None, show_distribution=False, cut_words=False):
+    def __init__(self, top_k=2000, data=None, show_distribution=False, cut_words=False, num_proc=1):
         logging.info(f" ## 正在根据训练集构建词表……")
-        counter = Counter()
-        self.stoi = {Vocab.UNK: 0, Vocab.PAD: 1}
-        self.itos = [Vocab.UNK, Vocab.PAD]
-        for text in data:
-            token = tokenize(text, cut_words)
-            # ['上', '联', '：', '一', '夜', '春', '风', '去', '，', '怎', '么', '对', '下', '联', '？']
-            counter.update(token)  # 统计每个token出现的频率
+        if num_proc > 1:
+            counter = self.count_tokens_parallel(data, cut_words, num_proc)
+        else:
+            counter = _count_tokens((data, cut_words))
         if show_distribution:
             count_w = sorted(list(counter.values()))
             plt.scatter(range(len(count_w)), count_w[::-1], s=5)
             plt.ylim(-20, 2500)
             plt.show()
         top_k_words = counter.most_common(top_k - 2)  # 取前top_k - 2 个，加上UNK和PAD，一共top_k个
-        for i, word in enumerate(top_k_words):
-            self.stoi[word[0]] = i + 2  # 2表示已有了UNK和PAD
-            self.itos.append(word[0])
+        self._build_index([Vocab.UNK, Vocab.PAD] + [word[0] for word in top_k_words])
         logging.info(f" ## 词表构建完毕，前100个词为: {list(self.stoi.items())[:100]}")
 
+    def _build_index(self, itos):
+        """
+        根据itos构建索引，其中itos_array为object类型的numpy数组，
+        用于对整个张量进行批量解码
+        :param itos: ['[UNK]', '[PAD]', '，', ...]
+        :return:
+        """
+        self.itos = list(itos)
+        self.stoi = {token: i for i, token in enumerate(self.itos)}
+        self.itos_array = np.empty(len(self.itos), dtype=object)
+        self.itos_array[:] = self.itos
+        self.unk_idx = self.stoi[Vocab.UNK]
+
+    def encode_batch(self, batch_tokens):
+        """
+        批量将token转换为索引
+        :param batch_tokens: [['上', '联', '：'], ['一', '夜']]
+        :return: ids: 所有样本拼接后的索引，np.int32, 形状为 [n_tokens, ]，如 [17, 41, 9, 33, 207]
+                 offsets: 第i个样本对应ids[offsets[i]:offsets[i + 1]], np.int64, 形状为 [n + 1, ]，如 [0, 3, 5]
+        """
+        offsets = np.zeros(len(batch_tokens) + 1, dtype=np.int64)
+        np.cumsum([len(tokens) for tokens in batch_tokens], out=offsets[1:])
+        flat_tokens = chain.from_iterable(batch_tokens)
+        ids = np.fromiter(map(self.stoi.get, flat_tokens, repeat(self.unk_idx)),
+                          dtype=np.int32, count=int(offsets[-1]))
+        return ids, offsets
+
+    def encode(self, tokens):
+        """
+        :param tokens: ['上', '联', '：']
+        :return: np.int32 [17, 41, 9]
+        """
+        return self.encode_batch([tokens])[0]
+
+    def decode_batch(self, ids, offsets=None):
+        """
+        批量将索引转换为token
+        :param ids: 任意形状的张量（或numpy数组），如 tensor([[17, 41, 9], [33, 207, 1]])
+        :param offsets: 若不为None，则ids为encode_batch返回的一维拼接结果，按offsets切分后返回
+        :return: 与ids形状相同的嵌套列表，如 [['上', '联', '：'], ['一', '夜', '[PAD]']]
+        """
+        if isinstance(ids, torch.Tensor):
+            ids = ids.cpu().numpy()
+        tokens = self.itos_array[np.asarray(ids)]
+        if offsets is None:
+            return tokens.tolist()
+        return [tokens[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+    def save(self, path):
+        """
+        以二进制格式保存词表，格式为：
+        文件头(8字节) | 词表大小n(8字节) | 每个token的字节偏移量(int64, n+1个) | utf-8编码后拼接的所有token
+        :param path:
+        :return:
+        """
+        encoded = [token.encode('utf-8') for token in self.itos]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        with open(path, 'wb') as f:
+            f.write(Vocab.MAGIC + struct.pack('<Q', len(encoded)))
+            f.write(offsets.tobytes())
+            f.write(b''.join(encoded))
+        logging.info(f" ## 词表已保存至 {path}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        载入由save()保存的二进制词表
+        :param path:
+        :return: Vocab
+        """
+        with open(path, 'rb') as f:
+            buffer = f.read()
+        if buffer[:8] != Vocab.MAGIC:
+            raise ValueError(f"{path} 不是合法的词表文件")
+        n = struct.unpack('<Q', buffer[8:16])[0]
+        offsets = np.frombuffer(buffer, dtype=np.int64, count=n + 1, offset=16)
+        blob = buffer[16 + 8 * (n + 1):]
+        vocab = cls.__new__(cls)
+        vocab._build_index([blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n)])
+        logging.info(f" ## 载入词表 {path}，一共{len(vocab)}个词")
+        return vocab
+
+    @classmethod
+    def from_stream(cls, texts, top_k=2000, cut_words=False, capacity=None, chunk_size=2000):
+        """
+        在固定内存下以流式的方式构建词表，适用于无法在内存中保存完整词频统计结果的大规模语料（如SougoNews）
+        vocab = Vocab.from_stream(open(path, encoding='utf-8'), top_k=50000, cut_words=True, capacity=500000)
+        print(vocab.stream_stats)  # 词频估计的误差信息
+        :param texts: 可迭代对象，每次返回一句文本，例如直接传入打开的文件对象
+        :param top_k: 取出现频率最高的前top_k个token
+        :param cut_words:
+        :param capacity: 最多保存多少个token的计数，决定了内存占用和误差上界，默认为top_k的10倍
+        :param chunk_size: 每次读取并tokenize的文本条数
+        :return: Vocab
+        """
+        logging.info(f" ## 正在以流式方式构建词表……")
+        capacity = capacity or 10 * top_k
+        sketch = SpaceSaving(capacity=capacity)
+        texts = iter(texts)
+        while True:
+            chunk = list(islice(texts, chunk_size))
+            if not chunk:
+                break
+            for tokens in _tokenize_chunk((chunk, cut_words)):
+                sketch.update(tokens)
+        top_k_words = sketch.most_common(top_k - 2)
+        vocab = cls.__new__(cls)
+        vocab._build_index([Vocab.UNK, Vocab.PAD] + [word[0] for word in top_k_words])
+        max_error = max([sketch.errors[word[0]] for word in top_k_words], default=0)
+        vocab.stream_stats = {"num_tokens": sketch.total, "capacity": capacity,
+                              "error_bound": sketch.error_bound, "max_error": max_error,
+                              "guaranteed": sketch.guaranteed(top_k - 2)}
+        logging.info(f" ## 词表构建完毕，一共统计token {sketch.total}个，计数器容量为{capacity}，"
+                     f"词频估计误差上界为{sketch.error_bound:.2f}，词表中最大误差为{max_error}，"
+                     f"其中{vocab.stream_stats['guaranteed']}个词能够保证位于真实的前{top_k - 2}名")
+        logging.info(f" ## 前100个词为: {list(vocab.stoi.items())[:100]}")
+        return vocab
+
+    @staticmethod
+    def count_tokens_parallel(data, cut_words=False, num_proc=4):
+        """
+        多进程统计词频：将语料按顺序切分为num_proc个分片，每个进程统计一个分片，
+        最后按分片顺序合并。由于Counter按token首次出现的顺序保存键值，
+        而most_common对频率相同的token保持插入顺序，因此按顺序合并后得到的
+        stoi、itos与单进程统计的结果完全相同。
+        :param data: 为一个列表，每个元素为一句文本
+        :param cut_words:
+        :param num_proc: 进程数
+        :return: Counter
+        """
+        shards = split_chunks(data, num_proc)
+        logging.info(f" ## 使用{len(shards)}个进程并行统计词频，每个分片约{len(shards[0])}条样本")
+        with Pool(processes=len(shards)) as pool:
+            partial_counters = pool.map(_count_tokens, [(shard, cut_words) for shard in shards])
+        counter = Counter()
+        for c in partial_counters:  # 必须按分片顺序合并，以保证结果的确定性
+            counter.update(c)
+        return counter
+
+    def digest(self):
+        """
+        词表内容（所有token及其顺序）的摘要，用作预处理缓存键的一部分，词表改变时缓存随之失效
+        :return: 如 '3f2a9c0d41be'
+        """
+        return hashlib.sha1('\n'.join(self.itos).encode('utf-8')).hexdigest()[:12]
+
     def __getitem__(self, token):
-        return self.stoi.get(token, self.stoi.get(Vocab.UNK))
+        return self.stoi.get(token, self.unk_idx)
 
     def __len__(self):
         return len(self.itos)
 
 
+def split_chunks(data, num_chunks):
+    """
+    将列表按顺序切分成num_chunks个连续的分片（分片之间长度最多相差1）
+    :param data: [1, 2, 3, 4, 5]
+    :param num_chunks: 2
+    :return: [[1, 2, 3], [4, 5]]
+    """
+    num_chunks = max(1, min(num_chunks, len(data)))
+    size, rest = divmod(len(data), num_chunks)
+    chunks, start = [], 0
+    for i in range(num_chunks):
+        end = start + size + (1 if i < rest else 0)
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def _count_tokens(args):
+    """
+    统计一个分片中每个token出现的频率，定义在模块层级以便被子进程序列化调用
+    :param args: (data, cut_words)
+    :return: Counter
+    """
+    data, cut_words = args
+    counter = Counter()
+    for token in _tokenize_chunk((data, cut_words)):
+        # ['上', '联', '：', '一', '夜', '春', '风', '去', '，', '怎', '么', '对', '下', '联', '？']
+        counter.update(token)  # 统计每个token出现的频率
+    return counter
+
+
+def _tokenize_chunk(args):
+    """
+    对一个分片中的所有文本进行tokenize，与逐条调用tokenize()的结果完全一致，
+    但jieba只导入一次，且省去了逐条样本的函数调用开销
+    :param args: (texts, cut_words)
+    :return: [['上', '联', ...], [...], ...]
+    """
+    texts, cut_words = args
+    import jieba
+    results = []
+    for text in texts:
+        if contains_chinese(text):  # 中文
+            if cut_words:  # 分词
+                text = jieba.cut(text)  # 词粒度
+            text = " ".join(text)  # 不分词则是字粒度
+        results.append(text.split())
+    return results
+
+
+def tokenize_batch(texts, cut_words=False, num_proc=1, chunk_size=2000):
+    """
+    批量tokenize，将texts按chunk_size切分成若干块后分发给num_proc个进程处理，
+    返回结果的顺序与texts保持一致
+    :param texts: ['上联：一夜春风去，怎么对下联？', '隋唐五代｜欧阳询《温彦博碑》']
+    :param cut_words: 是否分词
+    :param num_proc: 进程数，为1时在当前进程中处理
+    :param chunk_size: 每次分发给子进程的样本数量
+    :return: [['上', '联', '：', ...], ['隋', '唐', ...]]
+    """
+    chunks = [(texts[i:i + chunk_size], cut_words) for i in range(0, len(texts), chunk_size)]
+    results = []
+    if num_proc > 1 and len(chunks) > 1:
+        with Pool(processes=min(num_proc, len(chunks))) as pool:
+            for tokens in tqdm(pool.imap(_tokenize_chunk, chunks), total=len(chunks), ncols=80):
+                results += tokens
+    else:
+        for chunk in tqdm(chunks, ncols=80):
+            results += _tokenize_chunk(chunk)
+    return results
+
+
 def tokenize(text, cut_words=False):
     """
     tokenize方法
@@ -82,16 +323,37 @@ def tokenize(text, cut_words=False):
     :return:
     words: 字粒度： ['上', '联', '：', '一', '夜', '春', '风', '去', '，', '怎', '么', '对', '下', '联', '？']
     """
-    import jieba
-    if contains_chinese(text):  # 中文
-        if cut_words:  # 分词
-            text = jieba.cut(text)  # 词粒度
-        text = " ".join(text)  # 不分词则是字粒度
-    words = text.split()
+    words = _tokenize_chunk(([text], cut_words))[0]
     return words
 
 
-def pad_sequence(sequences, batch_first=False, max_len=None, padding_value=0):
+def iter_file_shard(file_path, shard_id=0, num_shards=1):
+    """
+    按字节范围将文件切分成num_shards份，逐行读取其中第shard_id份。
+    每一行归属于其起始字节所在的分片，因此所有分片拼接后与按顺序读取整个文件的结果完全一致，
+    且各分片之间没有重复和遗漏，可用于DataLoader中多个worker分别读取同一个文件
+    :param file_path:
+    :param shard_id: 当前分片的编号
+    :param num_shards: 分片数
+    :return: 逐行返回解码后的文本（包含换行符）
+    """
+    size = os.path.getsize(file_path)
+    start, end = size * shard_id // num_shards, size * (shard_id + 1) // num_shards
+    with open(file_path, 'rb') as f:
+        pos = start
+        if start > 0:  # 跳过起始位置所在的行，该行属于上一个分片
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode('utf-8')
+
+
+def pad_sequence(sequences, batch_first=False, max_len=None, padding_value=0,
+                 return_lengths=False, return_mask=False):
     """
     对一个List中的元素进行padding
     Pad a list of variable length Tensors with ``padding_value``
@@ -106,22 +368,421 @@ def pad_sequence(sequences, batch_first=False, max_len=None, padding_value=0):
         max_len :
                 当max_len = 50时，表示以某个固定长度对样本进行padding，多余的截掉；
                 当max_len=None是，表示以当前batch中最长样本的长度对其它进行padding；
+        return_lengths: 是否同时返回每个样本截断后的真实长度，形状为 [batch_size, ]
+        return_mask: 是否同时返回padding mask，非padding位置为True，形状与输出的前两个维度相同
     Returns:
+        out_tensors 或 (out_tensors, [lengths], [mask])
+    实现上先一次性分配填充了padding_value的输出张量，然后将所有样本拼接后通过mask一次性写入，
+    避免了逐个样本构造padding内容和拼接
     """
+    lengths = torch.tensor([s.size(0) for s in sequences], dtype=torch.long)
     if max_len is None:
-        max_len = max([s.size(0) for s in sequences])
-    out_tensors = []
-    for tensor in sequences:
-        if tensor.size(0) < max_len:
-            padding_content = [padding_value] * (max_len - tensor.size(0))
-            tensor = torch.cat([tensor, torch.tensor(padding_content)], dim=0)
+        max_len = int(lengths.max())
+    else:
+        sequences = [s[:max_len] for s in sequences]
+        lengths = lengths.clamp(max=max_len)
+    out_tensors = sequences[0].new_full((len(sequences), max_len) + sequences[0].shape[1:],
+                                        padding_value)  # [batch_size, max_len, ...]
+    mask = torch.arange(max_len) < lengths[:, None]  # [batch_size, max_len]
+    out_tensors[mask] = torch.cat(sequences, dim=0)
+    if not batch_first:
+        out_tensors = out_tensors.transpose(0, 1).contiguous()  # [max_len, batch_size, ...]
+        mask = mask.transpose(0, 1)
+    if not (return_lengths or return_mask):
+        return out_tensors
+    outputs = (out_tensors,)
+    if return_lengths:
+        outputs += (lengths,)
+    if return_mask:
+        outputs += (mask,)
+    return outputs
+
+
+class FlatTextDataset(Dataset):
+    """
+    以CSR形式存储的文本数据集：所有样本的token id拼接后保存在一个连续的int32张量中，
+    第i个样本为 token_ids[offsets[i]:offsets[i + 1]]。相比于为每个样本单独保存一个张量，
+    缓存文件更小，载入时也只需反序列化少数几个大张量。
+    __getitem__ 返回的格式与原来的 (token_ids_tensor, label) 一致，因此可直接使用原有的generate_batch。
+    :param token_ids: 所有样本拼接后的token id，int32，形状为 [n_tokens, ]
+    :param offsets: int64，形状为 [n + 1, ]
+    :param labels: 若label_offsets为None，则为每个样本的标签，形状为 [n, ]；
+                   否则为所有样本标签序列拼接后的token id（如TangShi中的标签）
+    :param label_offsets: 标签序列的偏移量
+    """
+
+    def __init__(self, token_ids, offsets, labels, label_offsets=None):
+        super(FlatTextDataset, self).__init__()
+        self.token_ids = token_ids
+        self.offsets = offsets
+        self.labels = labels
+        self.label_offsets = label_offsets
+
+    @property
+    def lengths(self):
+        return self.offsets[1:] - self.offsets[:-1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        token_ids = self.token_ids[int(self.offsets[idx]):int(self.offsets[idx + 1])].long()
+        if self.label_offsets is None:
+            return token_ids, self.labels[idx]
+        label = self.labels[int(self.label_offsets[idx]):int(self.label_offsets[idx + 1])].long()
+        return token_ids, label
+
+
+class BucketBatchSampler(Sampler):
+    """
+    按样本长度分桶的batch采样器：先将所有样本随机打乱，然后每次取出 pool_size * batch_size 个样本构成一个池，
+    在池内按长度排序后再依次划分成batch，最后打乱所有batch的顺序。这样每个batch中的样本长度相近，
+    以batch中最长样本为准进行padding时产生的[PAD]更少，同时保留了一定的随机性。
+    sampler = BucketBatchSampler(lengths=[len(x) for x, _ in train_data], batch_size=64)
+    train_iter = DataLoader(train_data, batch_sampler=sampler, collate_fn=generate_batch)
+    :param lengths: 每个样本的长度
+    :param batch_size: 每个batch中最多包含的样本数
+    :param pool_size: 每个池中包含pool_size个batch的样本
+    :param max_tokens: 若不为None，则每个batch中 样本数 * 最大长度 不超过max_tokens（至少包含1个样本）
+    :param shuffle: 是否打乱，为False时按池内长度排序后的顺序输出
+    :param drop_last: 是否丢弃每个池中最后一个不足batch_size的batch
+    :param seed: 随机种子，第epoch轮使用 seed + epoch 作为种子
+    从中断处继续训练时，将start_batch设为当前轮已经训练过的batch数，下一次迭代会从该batch开始
+    """
+
+    def __init__(self, lengths, batch_size, pool_size=100, max_tokens=None,
+                 shuffle=True, drop_last=False, seed=2023):
+        super(BucketBatchSampler, self).__init__()
+        self.lengths = torch.as_tensor(lengths, dtype=torch.long)
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self._cache = (None, None)  # (epoch, batches)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+
+    def _split_pool(self, pool):
+        """
+        将一个已按长度排序的池划分成若干batch
+        """
+        if self.max_tokens is None:
+            batches = [pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size)]
+        else:
+            batches, batch, batch_max_len = [], [], 0
+            for idx in pool:
+                length = int(self.lengths[idx])
+                new_max_len = max(batch_max_len, length)
+                if batch and (len(batch) >= self.batch_size or (len(batch) + 1) * new_max_len > self.max_tokens):
+                    batches.append(batch)
+                    batch, new_max_len = [], length
+                batch.append(idx)
+                batch_max_len = new_max_len
+            if batch:
+                batches.append(batch)
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def get_batches(self, epoch=None):
+        """
+        得到第epoch轮的所有batch，同一轮的结果会被缓存以便__len__与__iter__保持一致
+        :param epoch:
+        :return: [[idx, idx, ...], [...], ...]
+        """
+        epoch = self.epoch if epoch is None else epoch
+        if self._cache[0] == epoch:
+            return self._cache[1]
+        g = torch.Generator()
+        g.manual_seed(self.seed + epoch)
+        n = len(self.lengths)
+        indices = torch.randperm(n, generator=g) if self.shuffle else torch.arange(n)
+        pool_len = self.pool_size * self.batch_size
+        batches = []
+        for i in range(0, n, pool_len):
+            pool = indices[i:i + pool_len]
+            order = torch.argsort(self.lengths[pool], stable=True)
+            batches += self._split_pool(pool[order].tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=g).tolist()]
+        self._cache = (epoch, batches)
+        return batches
+
+    def padding_efficiency(self, epoch=None):
+        """
+        计算一轮中非padding位置占所有位置的比例，并与随机划分batch时的比例进行对比
+        :return: (bucket_ratio, random_ratio)
+        """
+        batches = self.get_batches(epoch)
+        total = int(self.lengths.sum())
+        bucket_slots = sum(len(b) * int(self.lengths[b].max()) for b in batches)
+        g = torch.Generator()
+        g.manual_seed(self.seed)
+        random_lengths = self.lengths[torch.randperm(len(self.lengths), generator=g)]
+        random_slots = sum(len(b) * int(b.max()) for b in torch.split(random_lengths, self.batch_size))
+        return total / max(bucket_slots, 1), total / max(random_slots, 1)
+
+    def __iter__(self):
+        batches = self.get_batches()
+        start, self.start_batch = self.start_batch, 0
+        self.epoch += 1
+        return iter(batches[start:])
+
+    def __len__(self):
+        return len(self.get_batches()) - self.start_batch
+
+
+class ResumableSampler(Sampler):
+    """
+    可以从中断处继续的采样器：第epoch轮的顺序由 seed + epoch 唯一确定，因此只需要记录种子、轮数以及
+    当前轮已经训练过的样本数，就能在恢复训练时从同一个位置继续，而不必重新训练整轮。
+    shuffle=True时make_loader默认使用该采样器代替RandomSampler。
+    sampler = ResumableSampler(train_data)
+    sampler.set_epoch(epoch)
+    sampler.start_index = trained_batches * batch_size  # 跳过当前轮已经训练过的样本
+    train_iter = DataLoader(train_data, batch_size=batch_size, sampler=sampler)
+    :param data_source:
+    :param shuffle:
+    :param seed: 随机种子，第epoch轮使用 seed + epoch 作为种子；默认为 torch.initial_seed()，
+                 因此与RandomSampler一样，数据的顺序由 torch.manual_seed 决定
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=None):
+        super(ResumableSampler, self).__init__()
+        self.num_samples = len(data_source)
+        self.shuffle = shuffle
+        self.seed = torch.initial_seed() if seed is None else seed
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed((self.seed + self.epoch) % 2 ** 64)  # 未设置种子时initial_seed可能接近2**64
+            indices = torch.randperm(self.num_samples, generator=g)
         else:
-            tensor = tensor[:max_len]
-        out_tensors.append(tensor)
-    out_tensors = torch.stack(out_tensors, dim=1)
-    if batch_first:
-        return out_tensors.transpose(0, 1)
-    return out_tensors
+            indices = torch.arange(self.num_samples)
+        start, self.start_index = self.start_index, 0
+        self.epoch += 1  # 未调用set_epoch时每一轮的顺序也不相同
+        return iter(indices[start:].tolist())
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+
+class StreamTextDataset(IterableDataset):
+    """
+    流式文本数据集：在DataLoader的每个worker中逐行读取原始文本，并以chunk_size条为单位在线完成tokenize和向量化，
+    内存占用与语料大小无关，也无需在训练开始前预处理整个数据集。
+    各worker通过 dataset.iter_raw_data(file_path, worker_id, num_workers) 读取互不重叠的分片，
+    再经过一个容量为shuffle_buffer的缓冲区进行近似的随机打乱。
+    stream = StreamTextDataset(toutiao_news, toutiao_news.FILE_PATH[0], shuffle_buffer=10000)
+    train_iter = DataLoader(stream, batch_size=64, collate_fn=toutiao_news.generate_batch, num_workers=4)
+    :param dataset: TouTiaoNews等数据集对象，需实现 iter_raw_data 和 encode_samples
+    :param file_path: 原始文本路径
+    :param shuffle_buffer: 打乱缓冲区的容量，为0时按文件顺序输出
+    :param chunk_size: 每次tokenize和向量化的样本数
+    :param seed: 随机种子，第epoch轮第k个worker使用 (seed, epoch, k) 作为种子
+    """
+
+    def __init__(self, dataset, file_path, shuffle_buffer=0, chunk_size=256, seed=2023):
+        super(StreamTextDataset, self).__init__()
+        self.dataset = dataset
+        self.file_path = file_path
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def iter_encoded(self, worker_id=0, num_workers=1):
+        raw_data = self.dataset.iter_raw_data(self.file_path, worker_id, num_workers)
+        while True:
+            chunk = list(islice(raw_data, self.chunk_size))
+            if not chunk:
+                break
+            samples, labels = zip(*chunk)
+            yield from self.dataset.encode_samples(list(samples), list(labels))
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        samples = self.iter_encoded(worker_id, num_workers)
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        self.epoch += 1  # 在worker中只会修改其副本，因此需要开启persistent_workers或在每轮调用set_epoch
+        if self.shuffle_buffer <= 0:
+            yield from samples
+            return
+        buffer = list(islice(samples, self.shuffle_buffer))
+        for sample in samples:  # 缓冲区满后每来一个新样本，便随机输出缓冲区中的一个样本并用新样本替换
+            idx = rng.integers(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = sample
+        for idx in rng.permutation(len(buffer)):
+            yield buffer[idx]
+
+
+def move_to_device(batch, device, non_blocking=False):
+    """
+    将batch中的所有张量移动到device，支持张量以及由其构成的tuple、list、dict
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=non_blocking)
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(move_to_device(item, device, non_blocking) for item in batch)
+    if isinstance(batch, dict):
+        return {key: move_to_device(value, device, non_blocking) for key, value in batch.items()}
+    return batch
+
+
+class DevicePrefetcher(object):
+    """
+    在后台线程中从DataLoader中取出batch并提前拷贝到device上，计算当前batch的同时准备后续depth个batch。
+    使用GPU时拷贝在单独的CUDA stream上进行，配合pin_memory可与计算重叠。
+    每一步等待数据的耗时记录在wait_times中，若其占每步耗时的比例较大则说明训练受限于数据读取。
+    train_iter = DevicePrefetcher(DataLoader(...), device='cuda:0')
+    for x, y in train_iter:  # x, y 已经位于device上
+        ...
+    logging.info(train_iter.wait_stats())
+    :param loader: DataLoader或任意可迭代对象
+    :param device:
+    :param depth: 最多提前准备的batch数量
+    """
+
+    def __init__(self, loader, device, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self.wait_times = []  # 最近一轮中每一步等待数据的耗时，单位为秒
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _produce(self, loader_iter, buffer, stop):
+        try:
+            for batch in loader_iter:
+                event = None
+                if self.stream is not None:
+                    with torch.cuda.stream(self.stream):
+                        batch = move_to_device(batch, self.device, non_blocking=True)
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                else:
+                    batch = move_to_device(batch, self.device)
+                while not stop.is_set():
+                    try:
+                        buffer.put((batch, event, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put((None, None, None))
+        except Exception as e:  # 将异常交由主线程抛出
+            buffer.put((None, None, e))
+
+    def __iter__(self):
+        self.wait_times = []
+        # 在调用线程中创建DataLoader的迭代器，使其对全局随机状态的使用与直接遍历DataLoader时一致
+        return self._iterate(iter(self.loader))
+
+    def _iterate(self, loader_iter):
+        buffer, stop = queue.Queue(maxsize=self.depth), threading.Event()
+        thread = threading.Thread(target=self._produce, args=(loader_iter, buffer, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                batch, event, error = buffer.get()
+                wait_time = time.perf_counter() - start
+                if error is not None:
+                    raise error
+                if batch is None:
+                    break
+                self.wait_times.append(wait_time)
+                if event is not None:
+                    stream = torch.cuda.current_stream(self.device)
+                    stream.wait_event(event)
+                    for item in self._tensors(batch):  # 告知缓存分配器这些张量会在当前stream上被使用
+                        item.record_stream(stream)
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def _tensors(self, batch):
+        if isinstance(batch, torch.Tensor):
+            yield batch
+        elif isinstance(batch, (tuple, list)):
+            for item in batch:
+                yield from self._tensors(item)
+        elif isinstance(batch, dict):
+            for item in batch.values():
+                yield from self._tensors(item)
+
+    def wait_stats(self):
+        """
+        :return: 最近一轮的步数、等待数据的总耗时、平均耗时和最大耗时（秒）
+        """
+        total = sum(self.wait_times)
+        return {"steps": len(self.wait_times), "wait_total": total,
+                "wait_mean": total / max(len(self.wait_times), 1), "wait_max": max(self.wait_times, default=0.)}
+
+
+def make_loader(data, batch_size=1, shuffle=False, sampler=None, batch_sampler=None, collate_fn=None,
+                num_workers=0, pin_memory=False, prefetch_factor=2, device=None, prefetch_depth=2, seed=None):
+    """
+    所有数据集类构造DataLoader的统一入口
+    :param data: Dataset 或 IterableDataset
+    :param batch_size: 与DataLoader一致，为None时表示sampler每次直接返回一个batch的索引
+    :param shuffle: 为True且未指定sampler时使用ResumableSampler，以便从中断处继续训练
+    :param sampler:
+    :param batch_sampler:
+    :param collate_fn:
+    :param num_workers: 构造batch的进程数，大于0时worker在多轮之间保持存活
+    :param pin_memory: 是否将batch放入锁页内存，以便异步拷贝到GPU
+    :param prefetch_factor: 每个worker提前准备的batch数量
+    :param device: 若不为None，则返回DevicePrefetcher，在后台线程中提前将batch拷贝到device上
+    :param prefetch_depth: DevicePrefetcher最多提前准备的batch数量
+    :param seed: shuffle=True时ResumableSampler的随机种子，默认为 torch.initial_seed()
+    :return: DataLoader 或 DevicePrefetcher
+    """
+    kwargs = dict(collate_fn=collate_fn, num_workers=num_workers, pin_memory=pin_memory,
+                  persistent_workers=num_workers > 0, prefetch_factor=prefetch_factor if num_workers > 0 else None)
+    if shuffle and sampler is None and batch_sampler is None and not isinstance(data, IterableDataset):
+        sampler, shuffle = ResumableSampler(data, seed=seed), False
+    if batch_sampler is not None:
+        loader = DataLoader(data, batch_sampler=batch_sampler, **kwargs)
+    else:
+        loader = DataLoader(data, batch_size=batch_size, shuffle=shuffle, sampler=sampler, **kwargs)
+    if device is None:
+        return loader
+    return DevicePrefetcher(loader, device, depth=prefetch_depth)
 
 
 class TouTiaoNews(object):
@@ -139,14 +800,53 @@ class TouTiaoNews(object):
                  max_sen_len=None,
                  batch_size=4,
                  is_sample_shuffle=True,
-                 cut_words=False):
+                 cut_words=False,
+                 num_proc=1,
+                 vocab_path=None,
+                 use_bucket=False,
+                 max_tokens=None,
+                 flat_storage=False,
+                 streaming=False,
+                 shuffle_buffer=10000,
+                 num_workers=0,
+                 pin_memory=False,
+                 prefetch_factor=2,
+                 device=None):
         self.top_k = top_k
         self.cut_words = cut_words
-        raw_data_train, _ = self.load_raw_data(self.FILE_PATH[0])
-        self.vocab = Vocab(top_k=self.top_k, data=raw_data_train, cut_words=self.cut_words)
+        self.num_proc = num_proc  # 数据预处理时使用的进程数，大于1时开启多进程
+        self.streaming = streaming  # 是否以StreamTextDataset的形式流式读取数据，不再预处理整个数据集
+        self.shuffle_buffer = shuffle_buffer  # 流式读取时打乱缓冲区的容量
+        self.num_workers = num_workers  # DataLoader中构造batch的进程数，流式读取时每个worker读取原始文件的一个分片
+        self.pin_memory = pin_memory  # 是否将batch放入锁页内存，以便异步拷贝到GPU
+        self.prefetch_factor = prefetch_factor  # 每个worker提前准备的batch数量
+        self.device = device  # 若不为None，则在后台线程中提前将batch拷贝到device上，见DevicePrefetcher
+        if vocab_path is not None and os.path.exists(vocab_path):  # 指定了词表路径且存在则直接载入
+            self.vocab = Vocab.load(vocab_path)
+            if len(self.vocab) > self.top_k:
+                raise ValueError(f"词表 {vocab_path} 的大小为{len(self.vocab)}，超过了top_k={self.top_k}，"
+                                 f"请删除该文件以重新构建词表，或使用与之对应的top_k")
+            train_path = self.FILE_PATH[0]
+            if os.path.exists(train_path) and os.path.getmtime(vocab_path) < os.path.getmtime(train_path):
+                logging.warning(f" ## 词表 {vocab_path} 早于训练集 {train_path} 生成，可能与当前的训练集不一致")
+        elif self.streaming:  # 流式构建词表，无需将训练集全部载入内存
+            texts = (sample for sample, _ in self.iter_raw_data(self.FILE_PATH[0]))
+            self.vocab = Vocab.from_stream(texts, top_k=self.top_k, cut_words=self.cut_words)
+            if vocab_path is not None:
+                self.vocab.save(vocab_path)
+        else:
+            raw_data_train, _ = self.load_raw_data(self.FILE_PATH[0])
+            self.vocab = Vocab(top_k=self.top_k, data=raw_data_train, cut_words=self.cut_words,
+                               num_proc=self.num_proc)
+            if vocab_path is not None:
+                self.vocab.save(vocab_path)
+        self.vocab_digest = self.vocab.digest()  # 预处理缓存与词表绑定，更换或重新生成词表后不会误用旧的缓存
         self.max_sen_len = max_sen_len
         self.batch_size = batch_size
         self.is_sample_shuffle = is_sample_shuffle
+        self.use_bucket = use_bucket  # 是否使用BucketBatchSampler将长度相近的样本放到同一个batch中
+        self.max_tokens = max_tokens  # 开启use_bucket时，每个batch中 样本数 * 最大长度 的上限
+        self.flat_storage = flat_storage  # 是否以FlatTextDataset的形式保存预处理结果
 
     def get_vocab(self):
         return self.vocab.stoi
@@ -169,18 +869,51 @@ class TouTiaoNews(object):
                 labels.append(line[1])
         return samples, labels
 
-    @process_cache(unique_key=["top_k", "cut_words", "max_sen_len", "is_sample_shuffle"])
+    def iter_raw_data(self, file_path=None, worker_id=0, num_workers=1):
+        """
+        逐行读取原始文本的第worker_id个分片（共num_workers个），格式与load_raw_data一致
+        :param file_path:
+        :param worker_id:
+        :param num_workers:
+        :return: 逐个返回 (sample, label)，如 ('上联：一夜春风去，怎么对下联？', '1')
+        """
+        for line in iter_file_shard(file_path, worker_id, num_workers):
+            line = line.strip('\n').split('_!_')
+            yield line[0], line[1]
+
+    def encode_samples(self, samples, labels):
+        """
+        对一批原始样本进行tokenize和向量化，结果与data_process中的每个样本一致
+        :param samples: ['上联：一夜春风去，怎么对下联？', ...]
+        :param labels: ['1', ...]
+        :return: [(token_ids_tensor, label_tensor), ...]
+        """
+        all_tokens = _tokenize_chunk((samples, self.cut_words))
+        all_token_ids, offsets = self.vocab.encode_batch(all_tokens)
+        all_token_ids = torch.from_numpy(all_token_ids.astype(np.int64))
+        return [(all_token_ids[offsets[i]:offsets[i + 1]], torch.tensor(int(labels[i]), dtype=torch.long))
+                for i in range(len(samples))]
+
+    @process_cache(unique_key=["top_k", "cut_words", "max_sen_len", "is_sample_shuffle", "flat_storage",
+                               "vocab_digest"],
+                   depends_on=["FILE_PATH"])
     def data_process(self, file_path=None):
         samples, labels = self.load_raw_data(file_path)
         data = []
         logging.info(f" ## 处理原始文本 {file_path.split(os.path.sep)[-1]}")
-        for i in tqdm(range(len(samples)), ncols=80):
-            logging.debug(f" ## 原始输入样本为: {samples[i]}")
-            tokens = tokenize(samples[i], self.cut_words)
-            logging.debug(f" ## 分割后的样本为: {tokens}")
-            token_ids = [self.vocab[token] for token in tokens]
-            logging.debug(f" ## 向量化后样本为: {token_ids}\n")
-            token_ids_tensor = torch.tensor(token_ids, dtype=torch.long)
+        all_tokens = tokenize_batch(samples, self.cut_words, num_proc=self.num_proc)
+        all_token_ids, offsets = self.vocab.encode_batch(all_tokens)
+        if self.flat_storage:
+            labels = torch.tensor([int(l) for l in labels], dtype=torch.long)
+            return FlatTextDataset(torch.from_numpy(all_token_ids), torch.from_numpy(offsets), labels)
+        all_token_ids = torch.from_numpy(all_token_ids.astype(np.int64))
+        is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for i in range(len(samples)):
+            token_ids_tensor = all_token_ids[offsets[i]:offsets[i + 1]]
+            if is_debug:
+                logging.debug(f" ## 原始输入样本为: {samples[i]}")
+                logging.debug(f" ## 分割后的样本为: {all_tokens[i]}")
+                logging.debug(f" ## 向量化后样本为: {token_ids_tensor.tolist()}\n")
             l = torch.tensor(int(labels[i]), dtype=torch.long)
             data.append((token_ids_tensor, l))
         return data
@@ -202,20 +935,58 @@ class TouTiaoNews(object):
         batch_label = torch.tensor(batch_label, dtype=torch.long)
         return batch_sentence, batch_label
 
+    def make_data_iter(self, data, shuffle=False):
+        """
+        构造DataLoader，开启use_bucket时使用BucketBatchSampler按长度分桶
+        :param data:
+        :param shuffle:
+        :return:
+        """
+        if not self.use_bucket:
+            return self.make_loader(data, batch_size=self.batch_size, shuffle=shuffle)
+        if isinstance(data, FlatTextDataset):
+            lengths = data.lengths.tolist()
+        else:
+            lengths = [len(sample[0]) for sample in data]
+        if self.max_sen_len is not None:
+            lengths = [min(l, self.max_sen_len) for l in lengths]
+        sampler = BucketBatchSampler(lengths, self.batch_size, max_tokens=self.max_tokens, shuffle=shuffle)
+        bucket_ratio, random_ratio = sampler.padding_efficiency()
+        logging.info(f" ## 按长度分桶后一共{len(sampler)}个batch，非padding位置占比为{bucket_ratio:.2%}，"
+                     f"随机划分batch时为{random_ratio:.2%}")
+        return self.make_loader(data, batch_sampler=sampler)
+
+    def make_loader(self, data, **kwargs):
+        return make_loader(data, collate_fn=self.generate_batch, num_workers=self.num_workers,
+                           pin_memory=self.pin_memory, prefetch_factor=self.prefetch_factor,
+                           device=self.device, **kwargs)
+
+    def make_stream_iter(self, file_path, shuffle=False):
+        """
+        构造流式读取的DataLoader，样本数量未知，因此不支持len()
+        :param file_path:
+        :param shuffle: 是否通过缓冲区进行近似的随机打乱
+        :return:
+        """
+        data = StreamTextDataset(self, file_path, shuffle_buffer=self.shuffle_buffer if shuffle else 0)
+        return self.make_loader(data, batch_size=self.batch_size)
+
     def load_train_val_test_data(self, is_train=False):
+        if self.streaming:
+            if not is_train:
+                return self.make_stream_iter(self.FILE_PATH[2])
+            logging.info(f" ## 以流式方式读取训练集和验证集，worker数为{self.num_workers}")
+            return (self.make_stream_iter(self.FILE_PATH[0], shuffle=self.is_sample_shuffle),
+                    self.make_stream_iter(self.FILE_PATH[1]))
         if not is_train:
             test_data = self.data_process(file_path=self.FILE_PATH[2])
-            test_iter = DataLoader(test_data, batch_size=self.batch_size,
-                                   shuffle=False, collate_fn=self.generate_batch)
+            test_iter = self.make_data_iter(test_data, shuffle=False)
             logging.info(f" ## 测试集构建完毕，一共{len(test_data)}个样本")
             return test_iter
         train_data = self.data_process(file_path=self.FILE_PATH[0])  # 得到处理好的所有样本
         val_data = self.data_process(file_path=self.FILE_PATH[1])
-        train_iter = DataLoader(train_data, batch_size=self.batch_size,  # 构造DataLoader
-                                shuffle=self.is_sample_shuffle,
-                                collate_fn=self.generate_batch)
-        val_iter = DataLoader(val_data, batch_size=self.batch_size,
-                              shuffle=False, collate_fn=self.generate_batch)
+        train_iter = self.make_data_iter(train_data, shuffle=self.is_sample_shuffle)  # 构造DataLoader
+        val_iter = self.make_data_iter(val_data, shuffle=False)
         logging.info(f" ## 训练集和验证集构建完毕，样本数量为{len(train_data)}:{len(val_data)}")
         return train_iter, val_iter
 
@@ -288,27 +1059,54 @@ class TangShi(TouTiaoNews):
         logging.info(f" ## {file_name} 样本数量为: {len(all_samples)}")
         return all_samples, all_labels
 
-    @process_cache(unique_key=["top_k", "cut_words", "max_sen_len", "is_sample_shuffle"])
+    def iter_raw_data(self, file_path=None, worker_id=0, num_workers=1):
+        """
+        以json文件为单位进行分片，第worker_id个worker依次读取第 worker_id, worker_id + num_workers, ... 个文件
+        :param file_path: 如 poet.tang.0-55.json
+        :param worker_id:
+        :param num_workers:
+        :return: 逐个返回 (sample, label)
+        """
+        start, end = file_path.split(os.path.sep)[-1].split('.')[2].split('-')
+        for i in range(int(start), int(end) + 1)[worker_id::num_workers]:
+            samples, labels = self.load_raw_data(os.path.join(self.DATA_DIR, f'poet.tang.{i}-{i}.json'))
+            yield from zip(samples, labels)
+
+    def encode_samples(self, samples, labels):
+        all_tokens = _tokenize_chunk((samples + labels, False))
+        all_ids, offsets = self.vocab.encode_batch(all_tokens)
+        all_ids = torch.from_numpy(all_ids.astype(np.int64))
+        n = len(samples)
+        return [(all_ids[offsets[i]:offsets[i + 1]], all_ids[offsets[n + i]:offsets[n + i + 1]]) for i in range(n)]
+
+    @process_cache(unique_key=["top_k", "cut_words", "max_sen_len", "is_sample_shuffle", "flat_storage",
+                               "vocab_digest"],
+                   depends_on=["DATA_DIR"])
     def data_process(self, file_path=None):
         samples, labels = self.load_raw_data(file_path)
         data = []
         logging.info(f" ## 处理原始文本 {file_path.split(os.path.sep)[-1]}")
-        for i in tqdm(range(len(samples)), ncols=80):
-            logging.debug(f" ## 原始样本为:\n ")
-            logging.debug(f" ## 输入为: {samples[i]}")
-            x_tokens = tokenize(samples[i])
-            logging.debug(f" ## 分割后为: {x_tokens}")
-            x_token_ids = [self.vocab[token] for token in x_tokens]
-            logging.debug(f" ## 向量化后为: {x_token_ids}\n")
-
-            logging.debug(f" ## 标签为: {labels[i]}")
-            y_tokens = tokenize(labels[i])
-            logging.debug(f" ## 分割后为: {y_tokens}")
-            y_token_ids = [self.vocab[token] for token in y_tokens]
-            logging.debug(f" ## 向量化后为: {y_token_ids}\n")
-
-            x_token_ids_tensor = torch.tensor(x_token_ids, dtype=torch.long)
-            y_token_ids_tensor = torch.tensor(y_token_ids, dtype=torch.long)
+        all_tokens = tokenize_batch(samples + labels, num_proc=self.num_proc)  # 输入和标签一起分发处理
+        all_x_tokens, all_y_tokens = all_tokens[:len(samples)], all_tokens[len(samples):]
+        all_x_ids, x_offsets = self.vocab.encode_batch(all_x_tokens)
+        all_y_ids, y_offsets = self.vocab.encode_batch(all_y_tokens)
+        if self.flat_storage:
+            return FlatTextDataset(torch.from_numpy(all_x_ids), torch.from_numpy(x_offsets),
+                                   torch.from_numpy(all_y_ids), torch.from_numpy(y_offsets))
+        all_x_ids = torch.from_numpy(all_x_ids.astype(np.int64))
+        all_y_ids = torch.from_numpy(all_y_ids.astype(np.int64))
+        is_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for i in range(len(samples)):
+            x_token_ids_tensor = all_x_ids[x_offsets[i]:x_offsets[i + 1]]
+            y_token_ids_tensor = all_y_ids[y_offsets[i]:y_offsets[i + 1]]
+            if is_debug:
+                logging.debug(f" ## 原始样本为:\n ")
+                logging.debug(f" ## 输入为: {samples[i]}")
+                logging.debug(f" ## 分割后为: {all_x_tokens[i]}")
+                logging.debug(f" ## 向量化后为: {x_token_ids_tensor.tolist()}\n")
+                logging.debug(f" ## 标签为: {labels[i]}")
+                logging.debug(f" ## 分割后为: {all_y_tokens[i]}")
+                logging.debug(f" ## 向量化后为: {y_token_ids_tensor.tolist()}\n")
             data.append((x_token_ids_tensor, y_token_ids_tensor))
         return data
 
@@ -359,9 +1157,8 @@ class TangShi(TouTiaoNews):
             text = self.simplified_traditional_convert(src, 's2t')
             tokens = tokenize(text)
             logging.info(f" ## 分割后为: {tokens}")
-            token_ids = [self.vocab[token] for token in tokens]
-            logging.info(f" ## 向量化后为: {token_ids}")
-            token_ids = torch.tensor(token_ids, dtype=torch.long)
+            token_ids = torch.from_numpy(self.vocab.encode(tokens).astype(np.int64))
+            logging.info(f" ## 向量化后为: {token_ids.tolist()}")
             all_token_ids.append(torch.reshape(token_ids, [1, -1]))
         return all_token_ids
 
@@ -377,7 +1174,7 @@ class TangShi(TouTiaoNews):
         昨日上山下，达曙不能寐。
         何处接长波？东流入清渭。
         """
-        result = [self.vocab.itos[item.item()] for item in result[0]]
+        result = self.vocab.decode_batch(result[0])
         result = "".join(result)
         result = self.simplified_traditional_convert(result, 't2s')
         seps = [self.vocab.itos[idx] for idx in self.ends]
@@ -411,9 +1208,23 @@ class MR4ELMo(TouTiaoNews):
                  os.path.join(DATA_DIR, 'rt_val.txt'),
                  os.path.join(DATA_DIR, 'rt_test.txt')]
 
-    def __init__(self, batch_size=32, is_sample_shuffle=True):
+    def __init__(self, batch_size=32, is_sample_shuffle=True, use_bucket=False, max_tokens=None,
+                 streaming=False, shuffle_buffer=10000, num_workers=0, pin_memory=False, prefetch_factor=2,
+                 device=None):
         self.batch_size = batch_size
         self.is_sample_shuffle = is_sample_shuffle
+        self.use_bucket = use_bucket
+        self.max_tokens = max_tokens
+        self.max_sen_len = None
+        self.streaming = streaming
+        self.shuffle_buffer = shuffle_buffer
+        self.num_workers = num_workers
+        self.pin_memory = pin_memory
+        self.prefetch_factor = prefetch_factor
+        self.device = device
+
+    def encode_samples(self, samples, labels):
+        return [(sample.split(), label) for sample, label in zip(samples, labels)]
 
     def data_process(self, file_path=None):
         samples, labels = self.load_raw_data(file_path)
@@ -440,6 +1251,55 @@ class MR4ELMo(TouTiaoNews):
         return batch_sentence, batch_label
 
 
+class VideoBatchTransform(object):
+    """
+    对整个batch的视频片段进行变换，替代逐帧调用torchvision.transforms
+    输入为 [batch_size, frame_len, height, width, channels] 的uint8张量，
+    输出为 [batch_size, frame_len, channels, height, width] 的float32张量，
+    同一个片段中的所有帧使用相同的随机裁剪位置和翻转，从而保持时间上的一致性
+    trans = VideoBatchTransform(size=(60, 80), flip_prob=0.5)
+    """
+
+    def __init__(self, size=None, crop_size=None, flip_prob=0., mean=None, std=None):
+        """
+        :param size: 缩放后的大小 (height, width)，为None时不缩放
+        :param crop_size: 随机裁剪的大小 (height, width)，在缩放之前进行，为None时不裁剪
+        :param flip_prob: 水平翻转的概率
+        :param mean: 每个通道的均值，在除以255之后的尺度上，为None时不标准化
+        :param std: 每个通道的标准差
+        """
+        self.size = size
+        self.crop_size = crop_size
+        self.flip_prob = flip_prob
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, frames):
+        frames = torch.as_tensor(frames)
+        batch_size, frame_len, height, width, channels = frames.shape
+        if self.crop_size is not None:  # 每个片段一个裁剪位置，在uint8上裁剪以减少后续计算量
+            ch, cw = self.crop_size
+            tops = torch.randint(0, height - ch + 1, (batch_size,)).tolist()
+            lefts = torch.randint(0, width - cw + 1, (batch_size,)).tolist()
+            frames = torch.stack([clip[:, t:t + ch, l:l + cw] for clip, t, l in zip(frames, tops, lefts)])
+        if self.flip_prob > 0:
+            flip = torch.rand(batch_size) < self.flip_prob  # 每个片段是否翻转
+            frames = torch.where(flip[:, None, None, None, None], frames.flip(3), frames)
+        frames = frames.permute(0, 1, 4, 2, 3)  # [batch_size, frame_len, channels, height, width]
+        h, w = frames.shape[-2:]
+        frames = frames.reshape(-1, channels, h, w).float()
+        if self.size is not None:  # 先转换为浮点数再缩放，uint8输入的antialias插值并非在所有版本和设备上都受支持
+            frames = torch.nn.functional.interpolate(frames, size=self.size, mode='bilinear',
+                                                     align_corners=False, antialias=True)
+            h, w = self.size
+        # 除以255以及标准化：x = (x / 255 - mean) / std = x * scale - shift
+        mean = torch.zeros(channels) if self.mean is None else torch.as_tensor(self.mean, dtype=torch.float32)
+        std = torch.ones(channels) if self.std is None else torch.as_tensor(self.std, dtype=torch.float32)
+        scale, shift = (1. / (255. * std)).view(-1, 1, 1), (mean / std).view(-1, 1, 1)
+        frames = frames.mul_(scale).sub_(shift)
+        return frames.reshape(batch_size, frame_len, channels, h, w)
+
+
 class KTHData(object):
     """
     载入KTH数据集，下载地址：https://www.csc.kth.se/cvap/actions/ 一共包含6个zip压缩包
@@ -462,12 +1322,40 @@ class KTHData(object):
                  batch_size=4,
                  is_sample_shuffle=True,
                  is_gray=True,
-                 transforms=None):
+                 transforms=None,
+                 num_proc=1,
+                 stride=None,
+                 frame_step=1,
+                 batch_transforms=None,
+                 num_workers=0,
+                 pin_memory=False,
+                 prefetch_factor=2,
+                 device=None):
         self.frame_len = frame_len  # 即time_step， 以FRAME_LEN为长度进行分割
+        self.stride = frame_len if stride is None else stride  # 相邻两个样本起始帧的间隔，小于窗口长度时样本之间有重叠
+        self.frame_step = frame_step  # 样本中相邻两帧在原视频中的间隔，大于1时表示对视频进行时间上的降采样
+        self.batch_transforms = batch_transforms  # 对整个batch进行变换，如VideoBatchTransform，优先于transforms
+        self.num_workers = num_workers  # DataLoader中构造batch的进程数
+        self.pin_memory = pin_memory  # 是否将batch放入锁页内存，以便异步拷贝到GPU
+        self.prefetch_factor = prefetch_factor  # 每个worker提前准备的batch数量
+        self.device = device  # 若不为None，则在后台线程中提前将batch拷贝到device上，见DevicePrefetcher
         self.batch_size = batch_size
         self.is_sample_shuffle = is_sample_shuffle
         self.is_gray = is_gray
         self.transforms = transforms
+        self.num_proc = num_proc  # 解码视频时使用的进程数
+
+    @staticmethod
+    def to_gray(frames):
+        """
+        将BGR格式的帧（一帧或多帧）转换为灰度图，结果与 Image.fromarray(frame).convert("L") 完全一致
+        :param frames: [..., height, width, 3]
+        :return: [..., height, width, 1]
+        """
+        frames = frames.astype(np.uint32)
+        # 与PIL相同的整数近似，PIL将第0个通道视为R（此处实际为B通道）
+        gray = (frames[..., 0] * 19595 + frames[..., 1] * 38470 + frames[..., 2] * 7471 + 0x8000) >> 16
+        return gray.astype(np.uint8)[..., None]
 
     @staticmethod
     def load_avi_frames(path=None, is_gray=False):
@@ -484,43 +1372,97 @@ class KTHData(object):
             ret, frame = video.read()  # frame: (120, 160, 3) <class 'numpy.ndarray'>
             if not ret:  # ret是一个布尔值，表示是否成功读取帧图像的数据，frame是读取到的帧图像数据。
                 break
-            if is_gray:
-                frame = Image.fromarray(frame)
-                frame = frame.convert("L")
-                frame = np.array(frame.getdata()).reshape((120, 160, 1))
             frames.append(frame)
+        video.release()
         logging.info(f" ## 该视频一共有{len(frames)}帧")
-        return np.array(frames, dtype=np.uint8)  # [n, height, width, channels]
+        frames = np.array(frames, dtype=np.uint8)  # [n, height, width, channels]
         # 必须要转换成np.uint8类型，否则transforms.ToTensor()中的标准化会无效
+        return KTHData.to_gray(frames) if is_gray else frames
+
+    def decode_videos(self, video_paths, out_path):
+        """
+        多进程解码所有视频，并将所有帧依次写入同一个预先分配的 .npy 文件中
+        :param video_paths: 视频路径列表
+        :param out_path: 保存所有帧的文件路径
+        :return: frames: 以内存映射方式打开的所有帧 [num_frames, 120, 160, channels]
+                 spans: 每个视频在frames中的 [起始位置, 结束位置)
+        """
+        import cv2
+        counts = []
+        for path in video_paths:  # AVI文件头中记录了帧数，无需解码即可预先分配空间
+            video = cv2.VideoCapture(path)
+            counts.append(int(video.get(cv2.CAP_PROP_FRAME_COUNT)))
+            video.release()
+        offsets = np.cumsum([0] + counts).tolist()
+        channels = 1 if self.is_gray else 3
+        frames = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint8,
+                                           shape=(offsets[-1], 120, 160, channels))
+        tasks = [(path, self.is_gray, out_path, offsets[i], counts[i]) for i, path in enumerate(video_paths)]
+        start = time.time()
+        if self.num_proc > 1:
+            with Pool(self.num_proc) as pool:
+                written = pool.map(_decode_video, tasks, chunksize=1)
+        else:
+            written = [_decode_video(task) for task in tasks]
+        cost = time.time() - start
+        logging.info(f" ## 解码完毕，一共{sum(written)}帧，耗时{cost:.2f}s，速度{sum(written) / max(cost, 1e-6):.1f}帧/秒")
+        spans = [(offsets[i], offsets[i] + n) for i, n in enumerate(written)]
+        return frames, spans
 
-    @process_cache(unique_key=["frame_len", "is_gray"])
+    @process_cache(unique_key=["is_gray"], depends_on=["DATA_DIR"], backend="mmap")
     def data_process(self, file_path=None):
-        train_data, val_data, test_data = [], [], []
+        """
+        解码所有视频并保存到同一个帧存储中，样本的划分在 make_clips 中根据索引完成，
+        因此修改 frame_len、stride 等参数时无需重新预处理
+        :param file_path:
+        :return: frames: 所有视频的帧 [num_frames, 120, 160, channels]
+                 spans: 每个视频在frames中的 [起始位置, 结束位置), shape: [num_videos, 2]
+                 labels: 每个视频的标签, shape: [num_videos,]
+                 people_ids: 每个视频的人员编号, shape: [num_videos,]
+        """
+        videos = []
         for label, dir_name in enumerate(self.CATEGORIES):  # 遍历每个文件夹
             video_dir = os.path.join(self.DATA_DIR, dir_name)  # 构造每个文件夹的路径
-            video_names = os.listdir(video_dir)  # 列出当前文件夹的所有文件
-            for name in video_names:  # 遍历当前文件夹中的每个视频
-                people_id = int(name[6:8])  # 取人员编号
-                video_path = os.path.join(video_dir, name)  # 得到文件的绝对路径
-                frames = self.load_avi_frames(video_path, self.is_gray)  # 读取该文件
-                s_idx, e_idx = 0, self.frame_len
-                while e_idx <= len(frames):  # 开始采样样本
-                    logging.info(f" ## 截取帧子序列 [{s_idx}:{e_idx}]")
-                    sub_frames = frames[s_idx:e_idx]  # [frame_len, 120, 160, channels]
-                    if people_id in self.TRAIN_PEOPLE_ID:
-                        train_data.append((sub_frames, label))
-                    elif people_id in self.VAL_PEOPLE_ID:
-                        val_data.append((sub_frames, label))
-                    elif people_id in self.TEST_PEOPLE_ID:
-                        test_data.append((sub_frames, label))
-                    else:
-                        raise ValueError(f"people id {people_id} 有误")
-                    s_idx, e_idx = e_idx, e_idx + self.frame_len
-        logging.info(f" ## 原始数据划分完毕，训练集、验证集和测试集的数量分别为: "
-                     f"{len(train_data)}-{len(val_data)}-{len(test_data)}")
-        data = {"train_data": train_data, "val_data": val_data, "test_data": test_data}
+            video_names = sorted(os.listdir(video_dir))  # 列出当前文件夹的所有文件
+            videos += [(os.path.join(video_dir, name), int(name[6:8]), label) for name in video_names]
+            # 视频的绝对路径、人员编号和标签
+        for _, people_id, _ in videos:
+            if people_id not in self.TRAIN_PEOPLE_ID + self.VAL_PEOPLE_ID + self.TEST_PEOPLE_ID:
+                raise ValueError(f"people id {people_id} 有误")
+        fd, out_path = tempfile.mkstemp(prefix='.tmp_cache_kth_', suffix='.npy', dir=self.DATA_DIR)
+        os.close(fd)
+        try:
+            frames, spans = self.decode_videos([path for path, _, _ in videos], out_path)
+        finally:
+            try:  # 已打开的内存映射在文件删除后仍然有效，返回结果由缓存另行保存
+                os.remove(out_path)
+            except OSError:
+                pass
+        data = {"frames": frames, "spans": np.array(spans, dtype=np.int64).reshape(-1, 2),
+                "labels": np.array([label for _, _, label in videos], dtype=np.int64),
+                "people_ids": np.array([people_id for _, people_id, _ in videos], dtype=np.int64)}
         return data
 
+    def make_clips(self, data, people_ids):
+        """
+        根据frame_len、stride和frame_step计算指定人员所有视频中样本的索引
+        :param data: data_process 的返回结果
+        :param people_ids: 人员编号列表
+        :return: [num_clips, 3] 每一行为 (视频编号, 起始帧, 标签)
+        """
+        window = (self.frame_len - 1) * self.frame_step + 1  # 一个样本在原视频中覆盖的帧数
+        clips = []
+        for video_id in np.flatnonzero(np.isin(data['people_ids'], people_ids)):
+            begin, end = data['spans'][video_id]
+            starts = np.arange(0, end - begin - window + 1, self.stride)  # 开始采样样本
+            clips.append(np.stack([np.full_like(starts, video_id), starts,
+                                   np.full_like(starts, data['labels'][video_id])], axis=1))
+        return np.vstack(clips) if clips else np.zeros((0, 3), dtype=np.int64)
+
+    def make_dataset(self, data, people_ids):
+        clips = self.make_clips(data, people_ids)
+        return KTHClipDataset(data['frames'], data['spans'][:, 0], clips, self.frame_len, self.frame_step)
+
     def generate_batch(self, data_batch):
         """
         :param data_batch:
@@ -528,37 +1470,40 @@ class KTHData(object):
                  [batch_size, frame_len, channels, height, width]
                  [batch_size, ]
         """
-        batch_frames, batch_label = [], []
-        for (frames, label) in data_batch:  # 开始对一个batch中的每一个样本进行处理。
-            # frames的形状为 [frame_len, height, width,channels]
-            if self.transforms is not None:
+        batch_label = torch.tensor([label for _, label in data_batch], dtype=torch.long)
+        if self.transforms is not None and self.batch_transforms is None:
+            batch_frames = []
+            for (frames, label) in data_batch:  # 开始对一个batch中的每一个样本进行处理。
                 # 遍历序列里的每一帧，frame的形状[height, width, channels]
                 # 经过transforms.ToTensor()后的形状为[channels, height, width]
                 frames = torch.stack([self.transforms(frame) for frame in frames],
                                      dim=0)  # [frame_len, channels, height, width]
-            else:
-                frames = torch.tensor(frames.transpose(0, 3, 1, 2))  # [frame_len, channels, height, width]
-                logging.info(f"{frames.shape}")
-            batch_frames.append(frames)  # [[frame_len, channels, height, width], [], []]
-            batch_label.append(label)
-        batch_frames = torch.stack(batch_frames, dim=0)  # [batch_size, frame_len, channels, height, width]
-        batch_label = torch.tensor(batch_label, dtype=torch.long)
-        return batch_frames, batch_label
+                batch_frames.append(frames)  # [[frame_len, channels, height, width], [], []]
+            batch_frames = torch.stack(batch_frames, dim=0)  # [batch_size, frame_len, channels, height, width]
+            return batch_frames, batch_label
+        batch_frames = torch.from_numpy(np.stack([frames for frames, _ in data_batch]))
+        # [batch_size, frame_len, height, width, channels]
+        if self.batch_transforms is not None:
+            return self.batch_transforms(batch_frames), batch_label
+        return batch_frames.permute(0, 1, 4, 2, 3).contiguous(), batch_label
+        # [batch_size, frame_len, channels, height, width]
+
+    def make_data_iter(self, data, shuffle):
+        return make_loader(data, batch_size=self.batch_size, shuffle=shuffle, collate_fn=self.generate_batch,
+                           num_workers=self.num_workers, pin_memory=self.pin_memory,
+                           prefetch_factor=self.prefetch_factor, device=self.device)
 
     def load_train_val_test_data(self, is_train=False):
         data = self.data_process(file_path=self.FILE_PATH)
         if not is_train:
-            test_data = data['test_data']
-            test_iter = DataLoader(test_data, batch_size=self.batch_size,
-                                   shuffle=True, collate_fn=self.generate_batch)
+            test_data = self.make_dataset(data, self.TEST_PEOPLE_ID)
+            test_iter = self.make_data_iter(test_data, shuffle=True)
             logging.info(f" ## 测试集构建完毕，一共{len(test_data)}个样本")
             return test_iter
-        train_data, val_data = data['train_data'], data['val_data']
-        train_iter = DataLoader(train_data, batch_size=self.batch_size,  # 构造DataLoader
-                                shuffle=self.is_sample_shuffle,
-                                collate_fn=self.generate_batch)
-        val_iter = DataLoader(val_data, batch_size=self.batch_size,
-                              shuffle=False, collate_fn=self.generate_batch)
+        train_data = self.make_dataset(data, self.TRAIN_PEOPLE_ID)
+        val_data = self.make_dataset(data, self.VAL_PEOPLE_ID)
+        train_iter = self.make_data_iter(train_data, shuffle=self.is_sample_shuffle)  # 构造DataLoader
+        val_iter = self.make_data_iter(val_data, shuffle=False)
         logging.info(f" ## 训练集和验证集构建完毕，样本数量为{len(train_data)}:{len(val_data)}")
         return train_iter, val_iter
 
@@ -586,6 +1531,76 @@ class KTHData(object):
         plt.show()
 
 
+class KTHClipDataset(Dataset):
+    """
+    基于共享帧存储的视频片段数据集，每个样本只记录 (视频编号, 起始帧, 标签)，在取样本时才从帧存储中切片
+    """
+
+    def __init__(self, frames, video_offsets, clips, frame_len, frame_step=1):
+        """
+        :param frames: 所有视频的帧 [num_frames, height, width, channels]，通常为内存映射数组
+        :param video_offsets: 每个视频第一帧在frames中的位置
+        :param clips: [num_clips, 3] 每一行为 (视频编号, 起始帧, 标签)
+        :param frame_len: 每个样本的帧数
+        :param frame_step: 样本中相邻两帧在原视频中的间隔
+        """
+        super(KTHClipDataset, self).__init__()
+        self.frames = frames
+        self.video_offsets = video_offsets
+        self.clips = clips
+        self.frame_len = frame_len
+        self.frame_step = frame_step
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, idx):
+        video_id, start, label = self.clips[idx]
+        start = self.video_offsets[video_id] + start
+        sub_frames = self.frames[start:start + self.frame_len * self.frame_step:self.frame_step]
+        return sub_frames, int(label)  # [frame_len, 120, 160, channels]
+
+    def __getstate__(self):
+        # 以spawn方式启动DataLoader的worker时，只传递内存映射文件的位置，在子进程中重新打开
+        state = self.__dict__.copy()
+        reference = memmap_reference(self.frames)
+        if reference is not None:
+            state['frames'] = reference
+            state['frames_is_reference'] = True
+        return state
+
+    def __setstate__(self, state):
+        if state.pop('frames_is_reference', False):
+            state['frames'] = open_memmap_reference(state['frames'])
+        self.__dict__.update(state)
+
+
+def _decode_video(task):
+    """
+    解码一个视频并将其中的帧写入预先分配的文件中，供进程池调用
+    :param task: (视频路径, 是否转换为灰度图, 输出文件路径, 写入的起始位置, 预留的帧数)
+    :return: 实际写入的帧数
+    """
+    import cv2
+    path, is_gray, out_path, offset, count = task
+    out = np.load(out_path, mmap_mode='r+')
+    video = cv2.VideoCapture(path)
+    n = 0
+    while video.isOpened() and n < count:
+        ret, frame = video.read()  # frame: (120, 160, 3) <class 'numpy.ndarray'>
+        if not ret:
+            break
+        out[offset + n] = KTHData.to_gray(frame) if is_gray else frame
+        n += 1
+    if n == count and video.read()[0]:
+        logging.warning(f" ## 视频{path}的实际帧数多于文件头中记录的{count}帧，多余的帧将被忽略")
+    video.release()
+    out.flush()
+    if n < count:
+        logging.warning(f" ## 视频{path}的实际帧数{n}少于文件头中记录的{count}帧")
+    return n
+
+
 class STMatrix(object):
     """docstring for STMatrix
     构造采样数据帧
@@ -597,29 +1612,40 @@ class STMatrix(object):
         self.data = data
         self.timestamps = timestamps  # [b'2013070101', b'2013070102']
         self.T = T
-        self.pd_timestamps = string2timestamp(timestamps, T=self.T)
+        dates, slots = parse_timeslots(timestamps)
+        self.slot_ids = dates.astype(np.int64) * self.T + slots  # 每个时间片的全局序号，相邻时间片相差1
+        self._pd_timestamps = None
+        self._get_index = None
         if CheckComplete:
             self.check_complete()
-        # index
-        self.make_index()  # 将时间戳：做成一个字典，也就是给每个时间戳一个序号
+
+    @property
+    def pd_timestamps(self):  # 仅在按时间戳取数据时才构造
+        if self._pd_timestamps is None:
+            self._pd_timestamps = string2timestamp(self.timestamps, T=self.T)
+        return self._pd_timestamps
+
+    @property
+    def get_index(self):
+        if self._get_index is None:
+            self.make_index()  # 将时间戳：做成一个字典，也就是给每个时间戳一个序号
+        return self._get_index
 
     def make_index(self):
-        self.get_index = dict()
+        self._get_index = dict()
         for i, ts in enumerate(self.pd_timestamps):
-            self.get_index[ts] = i
+            self._get_index[ts] = i
 
     def check_complete(self):
-        missing_timestamps = []
-        offset = pd.DateOffset(minutes=24 * 60 // self.T)
-        pd_timestamps = self.pd_timestamps
-        i = 1
-        while i < len(pd_timestamps):
-            if pd_timestamps[i - 1] + offset != pd_timestamps[i]:
-                missing_timestamps.append("(%s -- %s)" % (pd_timestamps[i - 1], pd_timestamps[i]))
-            i += 1
-        for v in missing_timestamps:
-            logging.info(v)
-        assert len(missing_timestamps) == 0
+        """
+        检查时间片是否连续
+        :return: 不连续位置的列表，见 find_gaps
+        """
+        gaps = find_gaps(self.timestamps, self.T)
+        for gap in gaps:
+            logging.info(f"({gap['start']} -- {gap['end']}), 缺失{gap['missing']}个时间片")
+        assert len(gaps) == 0
+        return gaps
 
     def get_matrix(self, timestamp):  # 给定时间戳返回对于的数据
         return self.data[self.get_index[timestamp]]
@@ -633,69 +1659,113 @@ class STMatrix(object):
                 return False
         return True
 
-    def create_dataset(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+    def create_index(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
         """
+        计算每个样本所依赖的时间片在data中的索引
         :param len_closeness:
         :param len_trend:
         :param TrendInterval: 趋势性的间隔天数，默认为1周，即7天
         :param len_period:
         :param PeriodInterval: 周期性的间隔天数，默认为1天
-        :return:
+        :return: index: [n, len_closeness + len_period + len_trend]，依次为邻近性、周期性和趋势性所依赖时间片的索引
+                 target: [n,] 每个样本预测目标的索引
         """
-
-        # offset_week = pd.DateOffset(days=7)
-        offset_frame = pd.DateOffset(minutes=24 * 60 // self.T)  # 时间偏移 minutes = 30
-        XC = []
-        XP = []
-        XT = []
-        Y = []
-        timestamps_Y = []
         depends = [range(1, len_closeness + 1),
                    [PeriodInterval * self.T * j for j in range(1, len_period + 1)],
                    [TrendInterval * self.T * j for j in range(1, len_trend + 1)]]
         # depends # [range(1, 4), [48, 96, 144], [336, 672, 1008]]
-        i = max(self.T * TrendInterval * len_trend, self.T * PeriodInterval * len_period, len_closeness)
-        while i < len(self.pd_timestamps):
-            Flag = True
-            for depend in depends:
-                if Flag is False:
-                    break
-                Flag = self.check_it([self.pd_timestamps[i] - j * offset_frame for j in depend])
+        # 例如当前时刻为 2013-07-01 00:00:00，则"邻近性"取前3个时间片 [23:30, 23:00, 22:30]，
+        # "周期性"取前1、2、3天同一时刻，"趋势性"取前7、14、21天同一时刻的in-out flow
+        slot_ids = self.slot_ids
+        start = max(self.T * TrendInterval * len_trend, self.T * PeriodInterval * len_period, len_closeness)
+        offsets = np.array([j for depend in depends for j in depend], dtype=np.int64)
+        if len(slot_ids) <= start:
+            return np.zeros((0, len(offsets)), dtype=np.int64), np.zeros(0, dtype=np.int64)
+        base = slot_ids.min()
+        pos = np.full(slot_ids.max() - base + 1, -1, dtype=np.int64)  # 全局序号 -> 在data中的索引
+        np.maximum.at(pos, slot_ids - base, np.arange(len(slot_ids)))  # 时间戳重复时取最后一次出现的位置，与字典一致
+        query = slot_ids[start:, None] - offsets[None, :] - base  # [n, len_closeness + len_period + len_trend]
+        in_range = (query >= 0) & (query < len(pos))
+        index = np.where(in_range, pos[np.clip(query, 0, len(pos) - 1)], -1)
+        valid = (index >= 0).all(axis=1)  # 所依赖的时间片都存在时才构造样本
+        return index[valid], np.arange(start, len(slot_ids))[valid]
 
-            if Flag is False:
-                i += 1
-                continue
-            x_c = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[0]]
-            # 取当前时刻的前3个时间片的数据数据构成“邻近性”模块中一个输入序列
-            # 例如当前时刻为[Timestamp('2013-07-01 00:00:00')]
-            # 则取：
-            # [Timestamp('2013-06-30 23:30:00'), Timestamp('2013-06-30 23:00:00'), Timestamp('2013-06-30 22:30:00')]
-            #  三个时刻所对应的in-out flow为一个序列
-            x_p = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[1]]
-            # 取当前时刻 前 1*PeriodInterval,2*PeriodInterval,...,len_period*PeriodInterval
-            # 天对应时刻的in-out flow 作为一个序列，例如按默认值为 取前1、2、3天同一时刻的In-out flow
-            x_t = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[2]]
-            # 取当前时刻 前 1*TrendInterval,2*TrendInterval,...,len_trend*TrendInterval
-            # 天对应时刻的in-out flow 作为一个序列,例如按默认值为 取 前7、14、21天同一时刻的In-out flow
-            y = self.get_matrix(self.pd_timestamps[i])
-            if len_closeness > 0:
-                XC.append(np.vstack(x_c))
-                # a.shape=[2,32,32] b.shape=[2,32,32] c=np.vstack((a,b)) -->c.shape = [4,32,32]
-            if len_period > 0:
-                XP.append(np.vstack(x_p))
-            if len_trend > 0:
-                XT.append(np.vstack(x_t))
-            Y.append(y)
-            timestamps_Y.append(self.timestamps[i])  # []
-            i += 1
-        XC = np.asarray(XC)  # 模拟 邻近性的 数据 [?,6,32,32]
-        XP = np.asarray(XP)  # 模拟 周期性的 数据 隔天
-        XT = np.asarray(XT)  # 模拟 趋势性的 数据 隔周
-        Y = np.asarray(Y)  # [?,2,32,32]
+    def create_dataset(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+        """
+        :param len_closeness:
+        :param len_trend:
+        :param TrendInterval: 趋势性的间隔天数，默认为1周，即7天
+        :param len_period:
+        :param PeriodInterval: 周期性的间隔天数，默认为1天
+        :return:
+        """
+        index, target = self.create_index(len_closeness, len_trend, TrendInterval, len_period, PeriodInterval)
+
+        def gather(cols):
+            if cols.shape[1] == 0 or len(index) == 0:
+                return np.asarray([])
+            x = self.data[cols]  # [n, len, nb_flow, 32, 32]
+            return x.reshape(x.shape[0], -1, *x.shape[3:])  # 等价于对每个样本np.vstack
+            # a.shape=[2,32,32] b.shape=[2,32,32] c=np.vstack((a,b)) -->c.shape = [4,32,32]
+
+        split = np.cumsum([len_closeness, len_period])
+        XC = gather(index[:, :split[0]])  # 模拟 邻近性的 数据 [?,6,32,32]
+        XP = gather(index[:, split[0]:split[1]])  # 模拟 周期性的 数据 隔天
+        XT = gather(index[:, split[1]:])  # 模拟 趋势性的 数据 隔周
+        Y = self.data[target] if len(target) > 0 else np.asarray([])  # [?,2,32,32]
+        timestamps_Y = [self.timestamps[i] for i in target]
         logging.info(f"XC shape: {XC.shape}, XP shape: {XP.shape}, XT shape: {XT.shape} , Y shape: {Y.shape}")
         return XC, XP, XT, Y, timestamps_Y
 
 
+class STWindowDataset(Dataset):
+    """
+    按需构造样本的时空流量数据集
+    只保存一份标准化后的流量数据flow以及每个样本所依赖时间片的索引，在取样本时才拼接出邻近性、周期性和趋势性序列，
+    内存占用约为完全展开时的 1/(len_closeness + len_period + len_trend + 1)
+    """
+
+    def __init__(self, flow, index, target, meta_feature, timestamps, len_closeness, len_period):
+        """
+        :param flow: 标准化后的流量数据, shape: [num_frames, nb_flow, 32, 32]
+        :param index: 每个样本所依赖时间片在flow中的索引, shape: [n, len_closeness + len_period + len_trend]
+        :param target: 每个样本预测目标在flow中的索引, shape: [n,]
+        :param meta_feature: shape: [n, metadata_dim]
+        :param timestamps: 每个样本预测目标的时间戳
+        :param len_closeness:
+        :param len_period:
+        """
+        super(STWindowDataset, self).__init__()
+        self.flow = flow
+        self.index = index
+        self.target = target
+        self.meta_feature = meta_feature
+        self.timestamps = timestamps
+        self.len_closeness = len_closeness
+        self.len_period = len_period
+
+    def __len__(self):
+        return len(self.target)
+
+    def __getitem__(self, idx):
+        """
+        :param idx: 单个样本的序号，或者一个batch中所有样本的序号（配合BatchSampler一次构造整个batch）
+        :return: XC, XP, XT, Y, meta_feature, timestamp 与完全展开时的样本格式一致
+        """
+        batched = not isinstance(idx, (int, np.integer))
+        if batched:
+            idx = torch.as_tensor(idx, dtype=torch.long)
+        index = self.index[idx]
+        c, p = self.len_closeness, self.len_closeness + self.len_period
+        # [..., len, nb_flow, 32, 32] --> [..., len * nb_flow, 32, 32]
+        x_c = self.flow[index[..., :c]].flatten(-4, -3)
+        x_p = self.flow[index[..., c:p]].flatten(-4, -3)
+        x_t = self.flow[index[..., p:]].flatten(-4, -3)
+        y = self.flow[self.target[idx]]
+        timestamp = [self.timestamps[i] for i in idx.tolist()] if batched else self.timestamps[idx]
+        return x_c, x_p, x_t, y, self.meta_feature[idx], timestamp
+
+
 class TaxiBJ(object):
     """
     载入北京出租车数据集，数据集可关注微信公众号@月来客栈 获取
@@ -712,7 +1782,8 @@ class TaxiBJ(object):
 
     def __init__(self, T=48, nb_flow=2, len_test=None, len_closeness=None,
                  len_period=None, len_trend=None, meta_data=True,
-                 meteorol_data=True, holiday_data=True, batch_size=4, is_sample_shuffle=True):
+                 meteorol_data=True, holiday_data=True, batch_size=4, is_sample_shuffle=True, lazy_window=False,
+                 slot_data=False, num_workers=0, pin_memory=False, prefetch_factor=2, device=None):
         self.T = T
         self.nb_flow = nb_flow
         self.len_test = len_test
@@ -724,6 +1795,12 @@ class TaxiBJ(object):
         self.holiday_data = holiday_data
         self.batch_size = batch_size
         self.is_sample_shuffle = is_sample_shuffle
+        self.slot_data = slot_data  # 为True时在meta特征中加入时间片在当天中序号的one-hot向量
+        self.lazy_window = lazy_window  # 为True时只保存一份流量数据和样本索引，在取样本时才构造邻近性、周期性和趋势性序列
+        self.num_workers = num_workers  # DataLoader中构造batch的进程数
+        self.pin_memory = pin_memory  # 是否将batch放入锁页内存，以便异步拷贝到GPU
+        self.prefetch_factor = prefetch_factor  # 每个worker提前准备的batch数量
+        self.device = device  # 若不为None，则在后台线程中提前将batch拷贝到device上，见DevicePrefetcher
         assert len_closeness > 0, "len_closeness 需要大于0"
         assert len_period > 0, "len_period 需要大于0"
         assert len_trend > 0, "len_trend 需要大于0"
@@ -742,14 +1819,9 @@ class TaxiBJ(object):
         """
         filepath = self.FILE_PATH_HOLIDAY
         with open(filepath, 'r') as f:
-            holidays = f.readlines()
-            holidays = set([h.strip() for h in holidays])
+            holidays = [h.strip() for h in f.readlines() if h.strip()]
             # 得到一个假期列表，形如：['20130101', '20130102', '20130103', '20130209', ...]
-            H = np.zeros(len(timeslots))
-            for i, slot in enumerate(timeslots):
-                if slot[:8] in holidays:  # 取前8位为日期，判断其是否为节假日
-                    H[i] = 1
-        return H[:, None]  # shape: [n,1]
+        return holiday2vec(timeslots, holidays)  # shape: [n,1] 按日期判断是否为节假日
 
     def load_meteorology(self, timeslots=None):
         """
@@ -765,23 +1837,19 @@ class TaxiBJ(object):
             WindSpeed = f['WindSpeed'][:]  # 风速
             Weather = f['Weather'][:]  # 天气
             Temperature = f['Temperature'][:]  # 温度
-        M = dict()  # map timeslot to index
-        for i, slot in enumerate(Timeslot):
-            # 给每个时间戳赋一个索引
-            M[slot] = i  # {...,b'2016061335': 59003, b'2016061336': 59004, b'2016061337': 59005}
-
-        WS = []  # WindSpeed
-        WR = []  # Weather
-        TE = []  # Temperature
-        for slot in timeslots:
-            predicted_id = M[slot]  # 取索引
-            cur_id = predicted_id - 1  # 取上一个索引，因为一般来说预测第t时刻时只能取其t-1时刻的天气信息
-            WS.append(WindSpeed[cur_id])  #
-            WR.append(Weather[cur_id])
-            TE.append(Temperature[cur_id])
-        WS = np.asarray(WS)  # shape: (n,)
-        WR = np.asarray(WR)  # shape: (n,)
-        TE = np.asarray(TE)  # shape: (n,)
+        # 通过二分查找得到每个时间片在Timeslot中的索引，时间片重复时取最后一次出现的位置
+        order = np.argsort(Timeslot, kind='stable')
+        sorted_slots = Timeslot[order]
+        timeslots = np.asarray(timeslots, dtype=Timeslot.dtype)
+        pos = np.searchsorted(sorted_slots, timeslots, side='right') - 1
+        missing = (pos < 0) | (sorted_slots[np.maximum(pos, 0)] != timeslots)
+        if missing.any():
+            raise KeyError(f"气象数据中缺少时间片: {timeslots[missing][:10].tolist()}")
+        predicted_id = order[pos]  # 取索引
+        cur_id = predicted_id - 1  # 取上一个索引，因为一般来说预测第t时刻时只能取其t-1时刻的天气信息
+        WS = WindSpeed[cur_id]  # shape: (n,)
+        WR = Weather[cur_id]  # shape: (n,)
+        TE = Temperature[cur_id]  # shape: (n,)
 
         # 0-1 scale
         # 这里是一次对所有的温度和风速进行标准化，严格来说应该是需要划分乘训练集和测试集之后再标准化
@@ -810,11 +1878,24 @@ class TaxiBJ(object):
         return data, timestamps
 
     @staticmethod
-    def stat(fname):
+    def iter_chunks(dataset, chunk_size=1024):
+        """
+        分块读取HDF5数据集，避免一次性将整个文件读入内存
+        :param dataset: h5py.Dataset
+        :param chunk_size: 每次读取的帧数
+        :return: (起始位置, 数据块)
+        """
+        for start in range(0, dataset.shape[0], chunk_size):
+            yield start, dataset[start:start + chunk_size]
+
+    @staticmethod
+    def format_stat(f, mmax, mmin):
         """
         统计数据信息
         count the valid data
-        :param fname:
+        :param f: 已打开的h5py.File
+        :param mmax: 数据的最大值
+        :param mmin: 数据的最小值
         :return: like below
 
         ==========stat==========
@@ -844,20 +1925,96 @@ class TaxiBJ(object):
             time_s_str, time_e_str = time.strftime("%Y-%m-%d", ts), time.strftime("%Y-%m-%d", te)
             return nb_timeslot, time_s_str, time_e_str
 
-        with h5py.File(fname) as f:
-            nb_timeslot, time_s_str, time_e_str = get_nb_timeslot(f)
-            nb_day = int(nb_timeslot / 48)
-            mmax = f['data'][:].max()
-            mmin = f['data'][:].min()
-            stat = '=' * 10 + 'stat' + '=' * 10 + '\n' + \
-                   '\tdata shape: %s\n' % str(f['data'].shape) + \
-                   '\t# of days: %i, from %s to %s\n' % (nb_day, time_s_str, time_e_str) + \
-                   '\t# of timeslots: %i\n' % int(nb_timeslot) + \
-                   '\t# of timeslots (available): %i\n' % f['date'].shape[0] + \
-                   '\tmissing ratio of timeslots: %.1f%%\n' % ((1. - float(f['date'].shape[0] / nb_timeslot)) * 100) + \
-                   '\tmax: %.3f, min: %.3f\n' % (mmax, mmin) + \
-                   '\t' + '=' * 10 + 'stat' + '=' * 10
-            logging.info(f"\n\t{stat}")
+        nb_timeslot, time_s_str, time_e_str = get_nb_timeslot(f)
+        nb_day = int(nb_timeslot / 48)
+        stat = '=' * 10 + 'stat' + '=' * 10 + '\n' + \
+               '\tdata shape: %s\n' % str(f['data'].shape) + \
+               '\t# of days: %i, from %s to %s\n' % (nb_day, time_s_str, time_e_str) + \
+               '\t# of timeslots: %i\n' % int(nb_timeslot) + \
+               '\t# of timeslots (available): %i\n' % f['date'].shape[0] + \
+               '\tmissing ratio of timeslots: %.1f%%\n' % ((1. - float(f['date'].shape[0] / nb_timeslot)) * 100) + \
+               '\tmax: %.3f, min: %.3f\n' % (mmax, mmin) + \
+               '\t' + '=' * 10 + 'stat' + '=' * 10
+        return stat
+
+    @staticmethod
+    def stat(fname, chunk_size=1024):
+        """
+        统计数据信息，分块读取数据并在一次遍历中同时统计最大值和最小值
+        :param fname:
+        :param chunk_size:
+        :return:
+        """
+        with h5py.File(fname, 'r') as f:
+            mmax, mmin = -np.inf, np.inf
+            for _, chunk in TaxiBJ.iter_chunks(f['data'], chunk_size):
+                mmax, mmin = max(mmax, chunk.max()), min(mmin, chunk.min())
+            logging.info(f"\n\t{TaxiBJ.format_stat(f, mmax, mmin)}")
+
+    def load_flows(self, chunk_size=1024):
+        """
+        分块读取所有流量文件，在一次遍历中完成统计、去除不完整的天、截取前nb_flow个通道并将负值置0，
+        所有文件的结果依次写入同一块预先分配的内存中
+        :param chunk_size: 每次读取的帧数
+        :return: flow: 所有文件拼接后的流量数据 [num_frames, nb_flow, 32, 32]
+                 data_all: 每个文件对应的部分，均为flow的视图
+                 timestamps_all: 每个文件中保留的时间戳
+                 frame_min, frame_max: 每一帧的最小值和最大值, shape: [num_frames,]
+        """
+        files, timestamps_all = [], []
+        for fname in self.FILE_PATH_FLOW:
+            with h5py.File(fname, 'r') as f:
+                timestamps = f['date'][:]
+                shape, dtype = f['data'].shape, f['data'].dtype
+            idx = self.complete_day_index(timestamps, self.T)
+            files.append((fname, idx))
+            timestamps_all.append([timestamps[i] for i in idx])
+        num_frames = sum(len(idx) for _, idx in files)
+        dtype = np.result_type(dtype, 1.)  # 与标准化后的数据类型一致，以便原地标准化
+        flow = np.empty((num_frames, self.nb_flow) + shape[2:], dtype=dtype)
+        frame_min, frame_max = np.empty(num_frames, dtype=dtype), np.empty(num_frames, dtype=dtype)
+        data_all, offset = [], 0
+        for fname, idx in files:
+            logging.info(f" # 正在载入文件: {fname}")
+            with h5py.File(fname, 'r') as f:
+                keep = np.zeros(f['data'].shape[0], dtype=bool)
+                keep[idx] = True
+                mmax, mmin, start = -np.inf, np.inf, offset
+                for s, chunk in self.iter_chunks(f['data'], chunk_size):
+                    mmax, mmin = max(mmax, chunk.max()), min(mmin, chunk.min())
+                    chunk = chunk[keep[s:s + len(chunk)], :self.nb_flow]
+                    chunk[chunk < 0] = 0.  # 处理异常，把小于0的数据替换为0
+                    flow[offset:offset + len(chunk)] = chunk
+                    frame_min[offset:offset + len(chunk)] = chunk.reshape(len(chunk), -1).min(axis=1)
+                    frame_max[offset:offset + len(chunk)] = chunk.reshape(len(chunk), -1).max(axis=1)
+                    offset += len(chunk)
+                logging.info(f"\n\t{self.format_stat(f, mmax, mmin)}")
+            data_all.append(flow[start:offset])
+            logging.info(data_all[-1].shape)
+        return flow, data_all, timestamps_all, frame_min, frame_max
+
+    @staticmethod
+    def complete_day_index(timestamps, T=48):
+        """
+        返回属于完整天（即包含全部T个时间片）的时间戳的索引
+        :param timestamps:
+        :param T:
+        :return:
+        """
+        dates, slots = parse_timeslots(timestamps)
+        if len(dates) == 0:
+            return np.zeros(0, dtype=np.int64)
+        days = dates.astype(np.int64)
+        first_day = days.min()
+        days -= first_day
+        valid = (slots >= 0) & (slots < T)
+        seen = np.zeros((days.max() + 1, T), dtype=bool)  # 每一天中出现过的时间片，重复出现只记一次
+        seen[days[valid], slots[valid]] = True
+        present = np.bincount(days, minlength=len(seen)) > 0
+        complete = seen.all(axis=1)  # available days: some day only contain some seqs
+        days_incomplete = (np.flatnonzero(present & ~complete) + first_day).astype('datetime64[D]')
+        logging.info(f"Incomplete days: {[str(d).replace('-', '') for d in days_incomplete]}")
+        return np.flatnonzero(complete[days])
 
     @staticmethod
     def remove_incomplete_days(data, timestamps, T=48):
@@ -868,61 +2025,43 @@ class TaxiBJ(object):
         :param T:
         :return:
         """
-        days = []  # available days: some day only contain some seqs
-        days_incomplete = []
-        i = 0
-        while i < len(timestamps):
-            if int(timestamps[i][8:]) != 1:
-                i += 1
-            elif i + T - 1 < len(timestamps) and int(timestamps[i + T - 1][8:]) == T:
-                days.append(timestamps[i][:8])
-                i += T
-            else:
-                days_incomplete.append(timestamps[i][:8])
-                i += 1
-        logging.info(f"Incomplete days: {days_incomplete}")
-        days = set(days)
-        idx = []
-        for i, t in enumerate(timestamps):
-            if t[:8] in days:
-                idx.append(i)
-
+        idx = TaxiBJ.complete_day_index(timestamps, T)
         data = data[idx]
         timestamps = [timestamps[i] for i in idx]
         return data, timestamps
 
     @process_cache(unique_key=["T", "nb_flow", "len_test", "len_closeness",
-                               "len_period", "meta_data", "meteorology_data", "holiday_data"])
+                               "len_period", "meta_data", "meteorology_data", "holiday_data", "lazy_window",
+                               "slot_data"],
+                   depends_on=["FILE_PATH_FLOW", "FILE_PATH_HOLIDAY", "FILE_PATH_METEORO"],
+                   backend="mmap")
     def data_process(self, file_path=None):
-        data_all = []
-        timestamps_all = list()
-        for fname in self.FILE_PATH_FLOW:
-            logging.info(f" # 正在载入文件: {fname}")
-            self.stat(fname)
-            data, timestamps = self.load_stdata(fname)
-            data, timestamps = self.remove_incomplete_days(data, timestamps, self.T)
-            # data: ndarray  shape: [num, 2, 32, 32]
-            # timestamps: [b'2013070101', b'2013070102', b'2013070103',...]
-            data = data[:, :self.nb_flow]
-            logging.info(data.shape)
-            data[data < 0] = 0.  # 处理异常，把小于0的数据替换为0
-            data_all.append(data)  # 保存每个文件读取处理完成后的结果
-            timestamps_all.append(timestamps)
-            logging.info("\n")
+        flow, data_all, timestamps_all, frame_min, frame_max = self.load_flows()
+        # data: ndarray  shape: [num, 2, 32, 32]
+        # timestamps: [b'2013070101', b'2013070102', b'2013070103',...]
         # minmax_scale
-        data_train = np.vstack(copy(data_all))[:-self.len_test]  # 划分出训练集部分
-        logging.info(f'train data shape: {data_train.shape}')
+        num_train = len(flow) - self.len_test  # 划分出训练集部分
+        logging.info(f'train data shape: {flow[:num_train].shape}')
         mmn = MinMaxNormalization()
-        mmn.fit(data_train)  # 在训练集上计算相关参数
-        data_all_mmn = [mmn.transform(d) for d in data_all]  # 依次对所有数据用训练集中计算得到的参数进行标准化
+        mmn.fit(np.hstack([frame_min[:num_train], frame_max[:num_train]]))  # 训练集中每帧的最值即可确定整体最值
+        mmn.transform(flow, inplace=True)  # 用训练集中计算得到的参数对所有数据原地标准化，data_all中的视图随之更新
         logging.info(f"timestamps_all示例: {timestamps_all[0][:10]}")
         XC, XP, XT = [], [], []
         Y = []
         timestamps_Y = []
-        for data, timestamps in zip(data_all_mmn, timestamps_all):  # 遍历4个文件中每个文件里的流量数据
+        index, target, num_frames = [], [], 0
+        for data, timestamps in zip(data_all, timestamps_all):  # 遍历4个文件中每个文件里的流量数据
             # instance-based dataset --> sequences with format as (X, Y) where X is
             # a sequence of images and Y is an image.
             st = STMatrix(data, timestamps, self.T, CheckComplete=False)  # 采样构造流量数据
+            if self.lazy_window:  # 只计算索引，索引需加上前面文件中的帧数
+                _index, _target = st.create_index(
+                    len_closeness=self.len_closeness, len_period=self.len_period, len_trend=self.len_trend)
+                index.append(_index + num_frames)
+                target.append(_target + num_frames)
+                num_frames += len(data)
+                timestamps_Y += [timestamps[i] for i in _target]
+                continue
             _XC, _XP, _XT, _Y, _timestamps_Y = st.create_dataset(
                 len_closeness=self.len_closeness, len_period=self.len_period, len_trend=self.len_trend)
             XC.append(_XC)
@@ -935,6 +2074,9 @@ class TaxiBJ(object):
             # load time feature
             time_feature = timestamp2vec(timestamps_Y)  # array: [?,8] 将字符串类型的时间换为表示星期几和工作日的向量
             meta_feature.append(time_feature)
+        if self.slot_data:
+            slot_feature = slot2vec(timestamps_Y, self.T)  # array: [?,T] 时间片在当天中的序号
+            meta_feature.append(slot_feature)
         if self.holiday_data:
             # load holiday
             holiday_feature = self.load_holiday(timestamps_Y)  # array: [?,1]加载节假日列表，并返回给定时间戳中那些日期是节假日，哪些不是
@@ -954,6 +2096,8 @@ class TaxiBJ(object):
             logging.info(f' ## time feature: {time_feature.shape}, holiday feature: {holiday_feature.shape},'
                          f'meteorol feature: {meteorol_feature.shape} mete feature: {meta_feature.shape}')
             ## time feature: (15072, 8), holiday feature: (15072, 1),meteorol feature: (15072, 19) mete feature: (15072, 28)
+        if self.lazy_window:
+            return self._make_window_data(flow, index, target, meta_feature, timestamps_Y, mmn)
         XC = torch.tensor(np.vstack(XC), dtype=torch.float32)  # shape = [15072,6,32,32]
         XP = torch.tensor(np.vstack(XP), dtype=torch.float32)  # shape = [15072,2,32,32]
         XT = torch.tensor(np.vstack(XT), dtype=torch.float32)  # shape = [15072,2,32,32]
@@ -986,16 +2130,46 @@ class TaxiBJ(object):
         data = {"train_data": train_data, "test_data": test_data, "mmn": mmn}
         return data
 
+    def _make_window_data(self, flow, index, target, meta_feature, timestamps_Y, mmn):
+        """
+        构造按需取样本的训练集和测试集，两者共享同一份流量数据
+        """
+        flow = torch.tensor(flow, dtype=torch.float32)  # shape = [num_frames,2,32,32]
+        index = torch.from_numpy(np.vstack(index))  # shape = [15072, len_closeness + len_period + len_trend]
+        target = torch.from_numpy(np.hstack(target))  # shape = [15072]
+        meta_feature = torch.tensor(meta_feature, dtype=torch.float32)  # shape =[15072, 28]
+        timestamps_Y = [str(item) for item in timestamps_Y]
+        n = len(target) - self.len_test
+        train_data = STWindowDataset(flow, index[:n], target[:n], meta_feature[:n], timestamps_Y[:n],
+                                     self.len_closeness, self.len_period)
+        test_data = STWindowDataset(flow, index[n:], target[n:], meta_feature[n:], timestamps_Y[n:],
+                                    self.len_closeness, self.len_period)
+        frames_per_sample = index.shape[1] + 1
+        logging.info(f"数据集构建完毕，训练集样本数: {len(train_data)}, 测试集样本数: {len(test_data)}, "
+                     f"流量数据占用: {flow.nbytes / 1024 ** 2:.1f}MB, "
+                     f"完全展开时约占用: {len(target) * frames_per_sample * flow[0].nbytes / 1024 ** 2:.1f}MB")
+        return {"train_data": train_data, "test_data": test_data, "mmn": mmn}
+
+    def make_data_iter(self, data, shuffle):
+        kwargs = dict(num_workers=self.num_workers, pin_memory=self.pin_memory,
+                      prefetch_factor=self.prefetch_factor, device=self.device)
+        if not self.lazy_window:
+            return make_loader(data, batch_size=self.batch_size, shuffle=shuffle, **kwargs)
+        # 每次直接按一个batch的索引构造样本，避免逐样本索引再拼接
+        sampler = RandomSampler(data) if shuffle else SequentialSampler(data)
+        return make_loader(data, sampler=BatchSampler(sampler, self.batch_size, drop_last=False), batch_size=None,
+                           **kwargs)
+
     def load_train_test_data(self, is_train=False):
         data = self.data_process(file_path=self.CATH_FILE_PATH)
         mmn = data['mmn']
         if not is_train:
             test_data = data['test_data']
-            test_iter = DataLoader(test_data, batch_size=self.batch_size, shuffle=True)
+            test_iter = self.make_data_iter(test_data, shuffle=True)
             logging.info(f" ## 测试集构建完毕，一共{len(test_data)}个样本")
             return test_iter, mmn
         train_data = data['train_data']
-        train_iter = DataLoader(train_data, batch_size=self.batch_size, shuffle=self.is_sample_shuffle)
+        train_iter = self.make_data_iter(train_data, shuffle=self.is_sample_shuffle)
         logging.info(f" ## 训练集构建完毕，样本数量为{len(train_data)}")
         return train_iter, mmn
 
@@ -1011,18 +2185,48 @@ class TaxiBJ(object):
         plt.show()
 
 
+def _process_news_file(args):
+    """
+    读取并处理一个新闻文件，供进程池调用
+    :param args: (文件路径, use_in)
+    :return: (处理后的一行文本, 有效行数, 失败原因（成功时为None）, 耗时, 进程号)
+    """
+    file_path, use_in = args
+    start = time.time()
+    result, num_lines, error = [], 0, None
+    try:
+        with open(file_path, 'r', encoding='gbk') as f:
+            for line in f:
+                line = line.strip().replace('&nbsp', '')
+                if len(line) < 30:
+                    continue
+                line = unicodedata.normalize('NFKC', line)  # 将全角字符转换为半角字符
+                if use_in == 'word2vec':
+                    line = tokenize(line, cut_words=True)
+                elif use_in == 'fasttext':
+                    line = [line]
+                result += line
+                num_lines += 1
+    except Exception as e:  # 与之前一样保留出错之前已经处理的内容
+        error = type(e).__name__
+    return " ".join(result) + '\n', num_lines, error, time.time() - start, os.getpid()
+
+
 class SougoNews(object):
     DATA_DIR = os.path.join(DATA_HOME, 'SougoNews')
 
-    def __init__(self, use_in='word2vec'):
+    def __init__(self, use_in='word2vec', num_proc=1):
         """
 
         :param use_in: 区分是用于word2vec的数据集还是用于fasttext的数据集
                        因为word2vec中需要分词，而fasttext中不需要
                        取值为 word2vec, fasttext
+        :param num_proc: 预处理时使用的进程数
         """
         self.use_in = use_in
+        self.num_proc = num_proc
         self.PROCESSED_FILE_PATH = os.path.join(self.DATA_DIR, f'SougoNews_{use_in}.txt')
+        self.MANIFEST_PATH = self.PROCESSED_FILE_PATH + '.manifest.jsonl'  # 记录每个文件在语料中的位置及处理结果
         self.make_corpus()
 
     def make_corpus(self):
@@ -1034,53 +2238,172 @@ class SougoNews(object):
                 time.sleep(1)
             self.data_process()
 
-    def data_process(self, ):
-        dir_lists = os.listdir(self.DATA_DIR)  # 列出当前文件夹中的所有文件夹
-        num_file = 0
-        num_failed = 0
-        new_file = open(self.PROCESSED_FILE_PATH, 'w', encoding='utf-8')
+    def list_files(self):
+        """
+        按固定顺序列出所有待处理的文件
+        :return: 相对于DATA_DIR的路径列表
+        """
+        dir_lists = sorted(os.listdir(self.DATA_DIR))  # 列出当前文件夹中的所有文件夹
         logging.info(f"候选文件夹：{dir_lists}")
+        files = []
         for dir in dir_lists:
             if '.' in dir:  # 排除掉文件夹（如：.DS_Store），或者文件（如：.txt）
                 continue
             dir_name = os.path.join(self.DATA_DIR, dir)  # 构造得到每个目录的路径
-            file_lists = os.listdir(dir_name)
-            logging.info(f" ## 正在读取文件夹【{dir_name}】中的文件")
-            for file in tqdm(file_lists):
-                file_path = os.path.join(dir_name, file)
-                logging.debug(f" ## 正在读取第{num_file + 1}个文件：{file_path}")
-                num_file += 1
-                result = []
-                try:
-                    with open(file_path, 'r', encoding='gbk') as f:
-                        for line in f:
-                            line = line.strip().replace('&nbsp', '')
-                            if len(line) < 30:
-                                continue
-                            line = unicodedata.normalize('NFKC', line)  # 将全角字符转换为半角字符
-                            if self.use_in == 'word2vec':
-                                line = tokenize(line, cut_words=True)
-                            elif self.use_in == 'fasttext':
-                                line = [line]
-                            result += line
-                except:
-                    num_failed += 1
-                new_file.write(" ".join(result) + '\n')
-        new_file.close()
-        logging.info(f"一共读取文件个数为: {num_file}, 读取失败个数为: {num_failed}")
+            files += [os.path.join(dir, file) for file in sorted(os.listdir(dir_name))]
+        return files
+
+    def load_manifest(self, partial_path):
+        """
+        读取已完成文件的记录，并将未完成的语料文件截断到最后一个已记录文件的末尾
+        :param partial_path: 正在生成的语料文件
+        :return: 已完成的记录列表
+        """
+        records = []
+        if os.path.exists(self.MANIFEST_PATH) and os.path.exists(partial_path):
+            with open(self.MANIFEST_PATH, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:  # 中断时最后一行可能不完整
+                        break
+        end = records[-1]['offset'] + records[-1]['length'] if records else 0
+        if records and os.path.getsize(partial_path) < end:  # 记录与语料不一致时重新开始
+            records, end = [], 0
+        with open(partial_path, 'ab') as f:
+            f.truncate(end)
+        with open(self.MANIFEST_PATH, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        return records
+
+    def data_process(self, ):
+        """
+        多进程处理所有文件，并按文件顺序将结果写入语料（每个文件对应一行）。
+        每处理完一个文件就在 MANIFEST_PATH 中记录该文件在语料中的字节位置，中断后再次运行时将从中断处继续
+        :return:
+        """
+        files = self.list_files()
+        partial_path = self.PROCESSED_FILE_PATH + '.partial'
+        records = self.load_manifest(partial_path)
+        done = len(records)
+        if done > 0:
+            if [record['file'] for record in records] != files[:done]:
+                raise ValueError(f"{self.MANIFEST_PATH}中的记录与当前文件列表不一致，请删除该文件及{partial_path}后重新运行")
+            logging.info(f" ## 已完成{done}个文件，从第{done + 1}个文件继续处理")
+        tasks = [(os.path.join(self.DATA_DIR, file), self.use_in) for file in files[done:]]
+        failed = Counter(record['error'] for record in records if record['error'] is not None)
+        workers = {}  # 进程号 -> [文件数, 行数, 耗时]
+        start = time.time()
+        with open(partial_path, 'ab') as corpus, open(self.MANIFEST_PATH, 'a', encoding='utf-8') as manifest:
+            offset = corpus.tell()
+            pool = Pool(self.num_proc) if self.num_proc > 1 else None
+            try:
+                results = pool.imap(_process_news_file, tasks, chunksize=8) if pool else map(_process_news_file, tasks)
+                for file, (text, num_lines, error, cost, pid) in tqdm(zip(files[done:], results), total=len(tasks)):
+                    text = text.encode('utf-8')
+                    corpus.write(text)
+                    corpus.flush()  # 先写入语料再记录，保证记录中的文件均已完整写入
+                    manifest.write(json.dumps({"file": file, "offset": offset, "length": len(text),
+                                               "lines": num_lines, "error": error}, ensure_ascii=False) + '\n')
+                    manifest.flush()
+                    offset += len(text)
+                    if error is not None:
+                        failed[error] += 1
+                        logging.debug(f" ## 文件{file}读取失败: {error}")
+                    stat = workers.setdefault(pid, [0, 0, 0.])
+                    stat[0], stat[1], stat[2] = stat[0] + 1, stat[1] + num_lines, stat[2] + cost
+            finally:
+                if pool is not None:
+                    pool.terminate()
+        os.replace(partial_path, self.PROCESSED_FILE_PATH)
+        cost = time.time() - start
+        logging.info(f"一共读取文件个数为: {len(files)}, 读取失败个数为: {sum(failed.values())}, 失败原因: {dict(failed)}")
+        logging.info(f"本次处理{len(tasks)}个文件，耗时{cost:.2f}s，速度{len(tasks) / max(cost, 1e-6):.1f}个文件/秒")
+        for pid, (num_files, num_lines, busy) in workers.items():
+            logging.info(f" ## 进程{pid}: 处理文件{num_files}个，共{num_lines}行，"
+                         f"速度{num_files / max(busy, 1e-6):.1f}个文件/秒，{num_lines / max(busy, 1e-6):.1f}行/秒")
 
 
 class MyCorpus(SougoNews):
     """An iterator that yields sentences (lists of str).
     用于gensim训练word2vec
+    第一次使用时会将文本语料转换为二进制的词表序号语料，此后每轮训练直接以内存映射的方式读取，无需重复分词
     """
 
-    def __init__(self):
+    def __init__(self, use_binary=True):
+        """
+        :param use_binary: 是否使用二进制语料，为False时与之前一样每次遍历都重新读取文本并分词
+        """
         super(MyCorpus, self).__init__(use_in='word2vec')
-        pass
+        self.use_binary = use_binary
+        self.IDS_PATH = self.PROCESSED_FILE_PATH + '.ids.npy'  # 所有词的序号, uint32
+        self.OFFSETS_PATH = self.PROCESSED_FILE_PATH + '.offsets.npy'  # 每行在IDS中的起始位置, int64
+        self.VOCAB_PATH = self.PROCESSED_FILE_PATH + '.vocab.txt'  # 每行一个词，行号即为序号
+        self.CORPUS_FILE_PATH = self.PROCESSED_FILE_PATH + '.corpus_file.txt'  # gensim corpus_file 格式的语料
+        if self.use_binary:
+            self.make_binary_corpus()
+
+    def is_up_to_date(self, path):
+        return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.corpus_path)
+
+    def make_binary_corpus(self):
+        """
+        遍历一次文本语料，将每行分词后的结果转换为词表中的序号并保存
+        :return:
+        """
+        if all(self.is_up_to_date(path) for path in [self.IDS_PATH, self.OFFSETS_PATH, self.VOCAB_PATH]):
+            return
+        logging.info(f" ## 正在将{self.corpus_path}转换为二进制语料")
+        stoi, itos = {}, []
+        ids, offsets = array.array('I'), array.array('q', [0])
+        with open(self.corpus_path, encoding='utf-8') as f:
+            for line in tqdm(f):
+                for word in utils.simple_preprocess(line):
+                    idx = stoi.get(word)
+                    if idx is None:
+                        idx = stoi[word] = len(itos)
+                        itos.append(word)
+                    ids.append(idx)
+                offsets.append(len(ids))
+        for path, data in [(self.IDS_PATH, np.frombuffer(ids, dtype=np.uint32)),
+                           (self.OFFSETS_PATH, np.frombuffer(offsets, dtype=np.int64))]:
+            tmp_path = path + '.tmp.npy'
+            np.save(tmp_path, data)
+            os.replace(tmp_path, path)
+        with open(self.VOCAB_PATH + '.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(word + '\n' for word in itos)
+        os.replace(self.VOCAB_PATH + '.tmp', self.VOCAB_PATH)
+        logging.info(f" ## 转换完毕，一共{len(offsets) - 1}行，{len(ids)}个词，词表大小为{len(itos)}")
+
+    def load_binary_corpus(self):
+        ids = np.load(self.IDS_PATH, mmap_mode='r')
+        offsets = np.load(self.OFFSETS_PATH)
+        with open(self.VOCAB_PATH, encoding='utf-8') as f:
+            itos = np.array([line.rstrip('\n') for line in f], dtype=object)
+        return ids, offsets, itos
 
     def __iter__(self):
         logging.info(f" ## 读取预处理文件进行训练: {self.PROCESSED_FILE_PATH}")
-        for line in open(self.corpus_path):
-            # assume there's one document per line, tokens separated by whitespace
-            yield utils.simple_preprocess(line)
+        if not self.use_binary:
+            for line in open(self.corpus_path):
+                # assume there's one document per line, tokens separated by whitespace
+                yield utils.simple_preprocess(line)
+            return
+        ids, offsets, itos = self.load_binary_corpus()
+        for s, e in zip(offsets[:-1], offsets[1:]):
+            yield itos[ids[s:e]].tolist()
+
+    def export_corpus_file(self):
+        """
+        导出为gensim的corpus_file格式（每行一个句子，词之间以空格分隔），
+        可通过 Word2Vec(corpus_file=...) 以多个worker并行读取语料进行训练
+        :return: 文件路径
+        """
+        if self.is_up_to_date(self.CORPUS_FILE_PATH):
+            return self.CORPUS_FILE_PATH
+        tmp_path = self.CORPUS_FILE_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for sentence in self:
+                f.write(' '.join(sentence) + '\n')
+        os.replace(tmp_path, self.CORPUS_FILE_PATH)
+        return self.CORPUS_FILE_PATH
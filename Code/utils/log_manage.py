@@ -10,6 +10,13 @@ from datetime import datetime
 import logging
 import os
 import sys
+import csv
+import json
+import time
+import queue
+import threading
+import atexit
+import torch
 
 
 def logger_init(log_file_name='monitor',
@@ -29,3 +36,106 @@ def logger_init(log_file_name='monitor',
         logging.basicConfig(level=log_level, format=formatter, datefmt=datefmt,
                             handlers=[logging.FileHandler(log_path),
                                       logging.StreamHandler(sys.stdout)])
+
+
+class MetricsSink(object):
+    """
+    批量、异步记录训练指标，用法与SummaryWriter.add_scalar一致，但可以直接传入设备上的张量：
+    sink = MetricsSink(writer=SummaryWriter(dir), csv_path='log/metrics.csv', jsonl_path='log/metrics.jsonl')
+    sink.add_scalar('Training/Loss', loss.detach(), global_steps)  # 不会触发同步
+    sink.close()
+    每累计window个指标后，将同一窗口内的所有张量拼接后一次性拷贝到CPU（使用GPU时为异步拷贝），
+    再交由后台线程批量写入TensorBoard、CSV和JSONL文件。每一个指标仍然按原来的step和时间分别写入，
+    因此得到的曲线与逐步调用 writer.add_scalar(tag, loss.item(), step) 完全一致。
+    :param writer: SummaryWriter，为None时不写入TensorBoard
+    :param csv_path: 若不为None，则以 tag,step,value,walltime 的格式追加写入
+    :param jsonl_path: 若不为None，则每行写入一个 {"tag", "step", "value", "walltime"}
+    :param window: 每次拷贝到CPU的指标数量
+    """
+
+    def __init__(self, writer=None, csv_path=None, jsonl_path=None, window=50):
+        self.writer = writer
+        self.csv_path = csv_path
+        self.jsonl_path = jsonl_path
+        self.window = window
+        self._pending = []  # [(tag, value, step, walltime), ...]
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)  # 程序退出前写入剩余的指标
+
+    def add_scalar(self, tag, value, step=None, walltime=None):
+        self._pending.append((tag, value, step, time.time() if walltime is None else walltime))
+        if len(self._pending) >= self.window:
+            self._submit()
+
+    def _submit(self):
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        tensors = [i for i, r in enumerate(records) if isinstance(r[1], torch.Tensor)]
+        values, event = None, None
+        if tensors:
+            stacked = torch.stack([records[i][1].detach().float().reshape(()) for i in tensors])
+            if stacked.is_cuda:
+                values = stacked.to('cpu', non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+            else:
+                values = stacked
+        self._queue.put((records, tensors, values, event))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            try:
+                self._write(*item)
+            except Exception as e:  # 写入失败不应影响训练
+                logging.warning(f" ## 写入训练指标失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, records, tensors, values, event):
+        if event is not None:
+            event.synchronize()  # 等待拷贝完成，只阻塞后台线程
+        records = [list(r) for r in records]
+        if values is not None:
+            for i, v in zip(tensors, values.tolist()):
+                records[i][1] = v
+        records = [(tag, float(value), step, walltime) for tag, value, step, walltime in records]
+        if self.writer is not None:
+            for tag, value, step, walltime in records:
+                self.writer.add_scalar(tag, value, step, walltime=walltime)
+            self.writer.flush()
+        if self.csv_path is not None:
+            is_new = not os.path.exists(self.csv_path)
+            with open(self.csv_path, 'a', newline='') as f:
+                w = csv.writer(f)
+                if is_new:
+                    w.writerow(['tag', 'step', 'value', 'walltime'])
+                w.writerows([(tag, step, value, walltime) for tag, value, step, walltime in records])
+        if self.jsonl_path is not None:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps({"tag": tag, "step": step, "value": value, "walltime": walltime}) + '\n'
+                             for tag, value, step, walltime in records)
+
+    def flush(self):
+        """
+        提交当前窗口中的指标，并等待后台线程全部写入完毕
+        """
+        self._submit()
+        self._queue.join()
+
+    def close(self):
+        if self._thread is None:  # 已经关闭过
+            return
+        atexit.unregister(self.flush)  # 否则atexit会一直持有该对象，直到解释器退出
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.writer is not None:
+            self.writer.close()
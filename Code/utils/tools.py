@@ -11,14 +11,22 @@ import logging
 import time
 import os
 import numpy as np
-from datetime import datetime
 import pandas as pd
 import re
+import heapq
+import json
+import hashlib
+import inspect
+import tempfile
+import shutil
+import pickle
+
+
+CHINESE_PATTERN = re.compile(r'[\u4e00-\u9fff]')  # 匹配中文字符的正则表达式
 
 
 def contains_chinese(text):
-    pattern = re.compile(r'[\u4e00-\u9fff]')  # 匹配中文字符的正则表达式
-    return bool(re.search(pattern, text))
+    return CHINESE_PATTERN.search(text) is not None
 
 
 def get_gpus(num=None):
@@ -39,17 +47,276 @@ def get_gpus(num=None):
     return devices if devices else [torch.device('cpu')]
 
 
-def process_cache(unique_key=None):
+CACHE_CONFIG = {"cache_dir": None,  # 缓存目录，为None时缓存在原始数据文件所在的目录中
+                "max_cache_size": None,  # 缓存目录的容量上限（字节），超过后按最近最少使用（LRU）的顺序删除
+                "use_hash": False}  # 是否将原始数据文件内容的哈希值作为缓存键的一部分
+CACHE_STATS = {"hits": 0, "misses": 0, "hit_time": 0., "miss_time": 0.,
+               "invalidated": 0, "evictions": 0, "evicted_bytes": 0}
+
+
+def set_cache_config(cache_dir=None, max_cache_size=None, use_hash=None):
+    """
+    设置process_cache的全局配置，修饰器中显式指定的参数优先
+    set_cache_config(cache_dir='/data/shared_cache', max_cache_size=50 * 1024 ** 3)
+    :param cache_dir: 所有缓存文件的保存目录，可以是多个任务共享的目录
+    :param max_cache_size: 缓存目录的容量上限（字节）
+    :param use_hash: 是否计算原始数据文件内容的哈希值
+    :return:
+    """
+    if cache_dir is not None:
+        CACHE_CONFIG["cache_dir"] = cache_dir
+    if max_cache_size is not None:
+        CACHE_CONFIG["max_cache_size"] = max_cache_size
+    if use_hash is not None:
+        CACHE_CONFIG["use_hash"] = use_hash
+
+
+def get_cache_stats():
+    """
+    返回process_cache的命中、未命中次数以及耗时等统计信息
+    :return: {'hits': 2, 'misses': 1, 'hit_time': 0.52, 'miss_time': 31.7, ...}
+    """
+    return dict(CACHE_STATS)
+
+
+def is_cache_file(name):
+    """
+    缓存文件（及写入过程中的临时文件）均以 cache_ 或 .tmp_cache_ 开头，计算原始数据的指纹时需要排除
+    """
+    return name.startswith('cache_') or name.startswith('.tmp_cache_')
+
+
+def _file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_fingerprint(path, use_hash=False):
+    """
+    计算原始数据文件（或目录）的指纹，包括文件大小、修改时间以及可选的内容哈希值；
+    对于目录，则递归计算其中每个文件（排除缓存文件）的指纹
+    :param path:
+    :param use_hash:
+    :return: [[相对路径, 大小, 修改时间(ns), 哈希值或None], ...]
+    """
+    if not os.path.exists(path):
+        return [[os.path.basename(path), None, None, None]]
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [[os.path.basename(path), stat.st_size, stat.st_mtime_ns,
+                 _file_digest(path) if use_hash else None]]
+    result = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not is_cache_file(d))
+        for name in sorted(files):
+            if is_cache_file(name):
+                continue
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            result.append([os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns,
+                           _file_digest(file_path) if use_hash else None])
+    return result
+
+
+def _func_source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return func.__qualname__
+
+
+def _cache_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(path) for name in files)
+
+
+def _remove_cache(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def evict_cache(cache_dir, max_cache_size, keep=None):
+    """
+    当缓存目录中所有缓存文件的大小超过max_cache_size时，按最近使用时间从旧到新依次删除
+    （命中缓存时会更新文件的修改时间，因此修改时间即为最近使用时间）
+    :param cache_dir:
+    :param max_cache_size:
+    :param keep: 不允许删除的缓存文件，一般为刚写入的缓存
+    :return:
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.startswith('cache_'):
+            continue
+        path = os.path.join(cache_dir, name)
+        entries.append((os.path.getmtime(path), _cache_size(path), path))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_cache_size:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        logging.info(f" ## 缓存目录超出容量上限{max_cache_size}字节，删除最久未使用的缓存 {path}")
+        _remove_cache(path)
+        total -= size
+        CACHE_STATS["evictions"] += 1
+        CACHE_STATS["evicted_bytes"] += size
+
+
+class _MmapPickler(pickle.Pickler):
+    """
+    将对象中较大的numpy数组和张量单独保存为.npy文件，其余部分正常序列化。
+    多个张量（或数组）共享同一块内存时（如 XC[:-n] 和 XC[i] 均为 XC 的视图），只保存一份，
+    并在序列化结果中记录每个视图的形状、步长和偏移量。
+    """
+
+    def __init__(self, file, array_dir, min_bytes):
+        super(_MmapPickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.array_dir = array_dir
+        self.min_bytes = min_bytes
+        self.saved = {}  # 内存块 -> 文件名
+        self.keep_alive = []  # 保证在序列化过程中内存块不被回收，从而id不会被复用
+
+    def _save_buffer(self, key, owner, buffer):
+        if key not in self.saved:
+            name = f"arr_{len(self.saved)}.npy"
+            np.save(os.path.join(self.array_dir, name), buffer)
+            self.saved[key] = name
+            self.keep_alive.append(owner)
+        return self.saved[key]
+
+    def persistent_id(self, obj):
+        if type(obj) is torch.Tensor and obj.device.type == 'cpu' and not obj.requires_grad:
+            storage = obj.untyped_storage()
+            if storage.nbytes() < self.min_bytes:
+                return None
+            raw = torch.empty(0, dtype=torch.uint8).set_(storage).numpy()  # 整个内存块的字节视图
+            name = self._save_buffer(('tensor', storage.data_ptr()), storage, raw)
+            return 'tensor', name, str(obj.dtype).split('.')[-1], tuple(obj.size()), obj.stride(), \
+                obj.storage_offset()
+        if type(obj) in (np.ndarray, np.memmap) and not obj.dtype.hasobject:
+            root = obj
+            while isinstance(root.base, np.ndarray):
+                root = root.base
+            if root.nbytes < self.min_bytes or not (root.flags.c_contiguous or root.flags.f_contiguous):
+                return None
+            raw = np.frombuffer(root.reshape(-1, order='A').view(np.uint8), dtype=np.uint8)
+            name = self._save_buffer(('ndarray', id(root)), root, raw)
+            offset = obj.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+            return 'ndarray', name, obj.dtype.str, obj.shape, obj.strides, offset
+        return None
+
+
+class _MmapUnpickler(pickle.Unpickler):
+    def __init__(self, file, array_dir):
+        super(_MmapUnpickler, self).__init__(file)
+        self.array_dir = array_dir
+        self.buffers = {}  # 文件名 -> 以内存映射方式打开的字节数组
+
+    def _buffer(self, name):
+        if name not in self.buffers:
+            # 'c' 表示写时复制：各进程共享操作系统的页缓存，修改只对当前进程可见且不会写回文件
+            self.buffers[name] = np.load(os.path.join(self.array_dir, name), mmap_mode='c')
+        return self.buffers[name]
+
+    def persistent_load(self, pid):
+        kind, name, dtype, shape, strides, offset = pid
+        if kind == 'tensor':
+            raw = torch.from_numpy(self._buffer(name)).view(getattr(torch, dtype))
+            return raw.as_strided(shape, strides, offset)
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._buffer(name), offset=offset, strides=strides)
+
+
+def save_mmap_cache(data, cache_dir, min_bytes=1 << 20):
+    """
+    以可内存映射的格式保存对象：大于min_bytes的数组和张量保存为 cache_dir/arr_*.npy，其余部分保存为 cache_dir/data.pkl
+    :param data:
+    :param cache_dir:
+    :param min_bytes:
+    :return:
+    """
+    with open(os.path.join(cache_dir, 'data.pkl'), 'wb') as f:
+        _MmapPickler(f, cache_dir, min_bytes).dump(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_mmap_cache(cache_dir):
+    """
+    载入由save_mmap_cache保存的对象，其中的大数组和张量通过内存映射的方式打开，并不会立即读入内存，
+    因此载入耗时与数据集大小无关，且DataLoader的多个worker进程之间可以共享同一份页缓存
+    :param cache_dir:
+    :return:
+    """
+    with open(os.path.join(cache_dir, 'data.pkl'), 'rb') as f:
+        return _MmapUnpickler(f, cache_dir).load()
+
+
+def memmap_reference(array):
+    """
+    若array是某个内存映射文件（np.memmap）的视图，则返回重新打开该视图所需的信息，否则返回None
+    用于在多进程间传递数据集时只传递文件位置而不是复制整个数组
+    :param array:
+    :return: (文件路径, 在文件中的字节偏移, dtype, shape, strides)
+    """
+    root = array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or not root.filename or not os.path.exists(root.filename):
+        return None
+    offset = root.offset + array.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+    return root.filename, offset, array.dtype.str, array.shape, array.strides
+
+
+def open_memmap_reference(reference):
+    """
+    根据memmap_reference返回的信息重新以写时复制的方式打开数组
+    :param reference:
+    :return:
+    """
+    filename, offset, dtype, shape, strides = reference
+    raw = np.memmap(filename, dtype=np.uint8, mode='c')
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=raw, offset=offset, strides=strides)
+
+
+def process_cache(unique_key=None, depends_on=None, version=None, use_hash=None,
+                  cache_dir=None, max_cache_size=None, backend='torch'):
     """
     数据预处理结果缓存修饰器
-    :param : unique_key
+    缓存键由以下几部分构成，任意一部分发生变化时都会重新处理：
+        1. unique_key 中指定的成员变量；
+        2. 原始数据文件（即 file_path，以及 depends_on 中指定的成员变量所表示的文件或目录）的大小、修改时间以及可选的内容哈希值；
+        3. 被修饰函数的源代码以及用户指定的版本号 version。
+    缓存文件名为 cache_{文件名}_{参数}_{摘要}.pt（或 .mmap 目录），写入时先写临时文件再原子地重命名，
+    写入新的缓存后会删除同一参数下已经失效的旧缓存，并在超出容量上限时按LRU的顺序清理缓存目录。
+    :param unique_key: 相关数据集构造类的成员变量，如['top_k', 'cut_words', 'max_sen_len']
+    :param depends_on: 表示原始数据路径的成员变量名（值可以为路径或路径列表），如['FILE_PATH']
+    :param version: 预处理逻辑的版本号，当被修饰函数之外的预处理代码发生变化时可手动修改
+    :param use_hash: 是否计算原始数据内容的哈希值，默认使用全局配置
+    :param cache_dir: 缓存目录，默认使用全局配置，均为None时缓存在 file_path 所在的目录中
+    :param max_cache_size: 缓存目录的容量上限（字节），默认使用全局配置
+    :param backend: 'torch' 表示使用torch.save/torch.load保存和载入缓存；
+                    'mmap' 表示将其中较大的数组和张量单独保存为.npy文件，载入时通过内存映射的方式打开，
+                    适用于KTH、TaxiBJ等包含大量数值数据的数据集
     :return:
     """
+    if backend not in ('torch', 'mmap'):
+        raise ValueError(f"backend 只能为 'torch' 或 'mmap'，当前为{backend}")
+    suffix = '.pt' if backend == 'torch' else '.mmap'
     if unique_key is None:
         raise ValueError(
             "unique_key 不能为空, 请指定相关数据集构造类的成员变量，如['top_k', 'cut_words', 'max_sen_len']")
 
     def decorating_function(func):
+        code_digest = hashlib.sha1(_func_source(func).encode('utf-8')).hexdigest()
+
         def wrapper(*args, **kwargs):
             logging.info(f" ## 索引预处理缓存文件的参数为：{unique_key}")
             obj = args[0]  # 获取类对象，因为data_process(self, file_path=None)中的第1个参数为self
@@ -59,17 +326,69 @@ def process_cache(unique_key=None):
             paras = f"cache_{file_name}_"
             for k in unique_key:
                 paras += f"{k}{obj.__dict__[k]}_"  # 遍历对象中的所有参数
-            cache_path = os.path.join(file_dir, paras[:-1] + '.pt')
+            paras = paras[:-1]
+            hashing = CACHE_CONFIG["use_hash"] if use_hash is None else use_hash
+            sources = [file_path]
+            for attr in depends_on or []:
+                value = getattr(obj, attr)
+                sources += value if isinstance(value, (list, tuple)) else [value]
+            key = {"paras": paras, "code": code_digest, "version": version, "backend": backend,
+                   "sources": [file_fingerprint(path, hashing) for path in sources]}
+            digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+            save_dir = cache_dir or CACHE_CONFIG["cache_dir"] or file_dir or '.'
+            os.makedirs(save_dir, exist_ok=True)
+            cache_path = os.path.join(save_dir, f"{paras}_{digest}{suffix}")
             start_time = time.time()
             if not os.path.exists(cache_path):
                 logging.info(f"缓存文件 {cache_path} 不存在，重新处理并缓存！")
                 data = func(*args, **kwargs)
-                with open(cache_path, 'wb') as f:
-                    torch.save(data, f)
+                if backend == 'torch':
+                    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_cache_', suffix=suffix, dir=save_dir)
+                else:
+                    tmp_path = tempfile.mkdtemp(prefix='.tmp_cache_', suffix=suffix, dir=save_dir)
+                try:
+                    if backend == 'torch':
+                        with os.fdopen(fd, 'wb') as f:
+                            torch.save(data, f)
+                            f.flush()
+                            os.fsync(f.fileno())
+                    else:
+                        save_mmap_cache(data, tmp_path)
+                    try:
+                        os.replace(tmp_path, cache_path)  # 原子操作，避免中断时留下不完整的缓存文件
+                    except OSError:
+                        # 目录无法被覆盖：其它任务已经发布了同一份缓存（内容相同），丢弃自己的结果，直接载入已有的缓存
+                        if backend != 'mmap' or not os.path.isdir(cache_path):
+                            raise
+                        logging.info(f"缓存文件 {cache_path} 已由其它任务写入，直接载入该缓存")
+                        _remove_cache(tmp_path)
+                except BaseException:
+                    _remove_cache(tmp_path)
+                    raise
+                if backend == 'mmap':  # 返回以内存映射方式载入的结果，释放计算过程中的内存，并与命中缓存时的行为一致
+                    data = load_mmap_cache(cache_path)
+                stale = re.compile(re.escape(paras) + r'(_[0-9a-f]{16})?\.(pt|mmap)$')
+                for name in os.listdir(save_dir):
+                    path = os.path.join(save_dir, name)
+                    if stale.match(name) and path != cache_path:
+                        logging.info(f"删除已失效的缓存文件 {path}")
+                        _remove_cache(path)
+                        CACHE_STATS["invalidated"] += 1
+                limit = max_cache_size or CACHE_CONFIG["max_cache_size"]
+                if limit is not None:
+                    evict_cache(save_dir, limit, keep=cache_path)
+                CACHE_STATS["misses"] += 1
+                CACHE_STATS["miss_time"] += time.time() - start_time
             else:
                 logging.info(f"缓存文件 {cache_path} 存在，直接载入缓存文件！")
-                with open(cache_path, 'rb') as f:
-                    data = torch.load(f)
+                if backend == 'torch':
+                    with open(cache_path, 'rb') as f:
+                        data = torch.load(f, weights_only=False)
+                else:
+                    data = load_mmap_cache(cache_path)
+                os.utime(cache_path)  # 更新最近使用时间
+                CACHE_STATS["hits"] += 1
+                CACHE_STATS["hit_time"] += time.time() - start_time
             end_time = time.time()
             logging.info(f"数据预处理一共耗时{(end_time - start_time):.3f}s")
             return data
@@ -91,16 +410,61 @@ def string2timestamp(strings, T=48):
     print(string2timestamp(str))
     [Timestamp('2013-07-01 00:00:00'), Timestamp('2013-07-01 00:30:00')]
     """
-    timestamps = []
+    dates, slots = parse_timeslots(strings)
+    timestamps = dates.astype('datetime64[m]') + (slots * (24 * 60 // T)).astype('timedelta64[m]')
+    return pd.DatetimeIndex(timestamps).tolist()
+
+
+def parse_timeslots(strings):
+    """
+    将字符串类型的时间片批量解析为日期和当天的时间片序号（从0开始），无需逐个构造datetime对象
+    :param strings: [b'2013070101', b'2013070102'] 或对应的np.ndarray（dtype为S10）
+    :return: dates: np.datetime64[D]类型的日期，shape: [n,]
+             slots: 当天的时间片序号，shape: [n,]
+    example:
+    dates, slots = parse_timeslots([b'2013070101', b'2013070148'])
+    dates: ['2013-07-01', '2013-07-01'], slots: [0, 47]
+    # 时间片的全局序号可由 dates.astype(np.int64) * T + slots 得到，相邻时间片的序号相差1
+    """
+    if len(strings) == 0:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64)
+    if isinstance(strings, list) and isinstance(strings[0], bytes) and \
+            len(set(map(len, strings))) == 1:  # 等长字节串直接拼接，比np.asarray快
+        digits = np.frombuffer(b''.join(strings), dtype=np.uint8).reshape(len(strings), -1)
+    else:
+        strings = np.asarray(strings)
+        if strings.dtype.kind == 'U':
+            strings = np.char.encode(strings, 'ascii')
+        digits = strings.view(np.uint8).reshape(len(strings), -1)
+    digits = digits - np.uint8(ord('0'))
+
+    def to_int(d):
+        ret = d[:, 0].astype(np.int64)
+        for i in range(1, d.shape[1]):
+            ret *= 10
+            ret += d[:, i]
+        return ret
 
-    time_per_slot = 24.0 / T  # 每个时间片多少小时
-    num_per_T = T // 24  # 每个小时有多少时间片
-    for t in strings:
-        year, month, day, slot = int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:]) - 1
-        timestamp = datetime(year, month, day, hour=int(slot * time_per_slot),
-                             minute=(slot % num_per_T) * int(60.0 * time_per_slot))
-        timestamps.append(pd.Timestamp(timestamp))
-    return timestamps
+    year, month, day = to_int(digits[:, :4]), to_int(digits[:, 4:6]), to_int(digits[:, 6:8])
+    slots = to_int(digits[:, 8:]) - 1
+    months = (year - 1970) * 12 + month - 1
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    return dates, slots
+
+
+def find_gaps(strings, T=48):
+    """
+    检测时间片序列中不连续的位置
+    :param strings: [b'2013070101', b'2013070102', b'2013070105']
+    :param T: 表示一天有多少个时间片
+    :return: [{'start': b'2013070102', 'end': b'2013070105', 'missing': 2}]
+             每一项表示start与end之间不连续，missing为其间缺失的时间片个数（重复或乱序时小于0）
+    """
+    dates, slots = parse_timeslots(strings)
+    slot_ids = dates.astype(np.int64) * T + slots
+    steps = np.diff(slot_ids)
+    return [{'start': strings[i], 'end': strings[i + 1], 'missing': int(steps[i] - 1)}
+            for i in np.flatnonzero(steps != 1)]
 
 
 def timestamp2vec(timestamps):
@@ -114,19 +478,38 @@ def timestamp2vec(timestamps):
      [0 0 0 0 0 1 0 0]]  当天是星期六，且为休息日
 
     """
-    # tm_wday range [0, 6], Monday is 0
-    vec = [time.strptime(str(t[:8], encoding='utf-8'), '%Y%m%d').tm_wday for t in timestamps]
-    # 通过tm_wday方法得到当天是星期几
-    ret = []
-    for i in vec:
-        v = [0 for _ in range(7)]
-        v[i] = 1
-        if i >= 5:
-            v.append(0)  # weekend
-        else:
-            v.append(1)  # weekday
-        ret.append(v)
-    return np.asarray(ret)
+    dates, _ = parse_timeslots(timestamps)
+    weekday = (dates.astype(np.int64) + 3) % 7  # 1970-01-01 为星期四，Monday is 0
+    ret = np.zeros((len(weekday), 8), dtype=np.int64)
+    ret[np.arange(len(weekday)), weekday] = 1
+    ret[:, 7] = weekday < 5  # 工作日为1，周末为0
+    return ret
+
+
+def holiday2vec(timestamps, holidays):
+    """
+    判断给定时间片所在日期是否为节假日
+    :param timestamps: [b'2014120106', b'2014010106']
+    :param holidays: 节假日列表，如 ['20130101', '20130102']
+    :return: [[0.], [1.]] shape: [n,1]
+    """
+    dates, _ = parse_timeslots(timestamps)
+    holidays = [h + '01' if isinstance(h, str) else h + b'01' for h in holidays]  # 补上时间片以复用解析函数
+    holiday_dates, _ = parse_timeslots(holidays)
+    return np.isin(dates, holiday_dates).astype(np.float64)[:, None]
+
+
+def slot2vec(timestamps, T=48):
+    """
+    将时间片在当天中的序号转换为one-hot向量
+    :param timestamps: [b'2013070101', b'2013070148']
+    :param T: 表示一天有多少个时间片
+    :return: shape: [n,T]
+    """
+    _, slots = parse_timeslots(timestamps)
+    ret = np.zeros((len(slots), T), dtype=np.int64)
+    ret[np.arange(len(slots)), slots] = 1
+    return ret
 
 
 class MinMaxNormalization(object):
@@ -145,7 +528,13 @@ class MinMaxNormalization(object):
         self._max = X.max()
         logging.info(f"MinMaxNormalization: min = {self._min}, max = {self._max}")
 
-    def transform(self, X):
+    def transform(self, X, inplace=False):
+        if inplace:  # 直接在X上计算，避免为大数组分配新的内存
+            np.subtract(X, self._min, out=X)
+            np.divide(X, self._max - self._min, out=X)
+            np.multiply(X, 2., out=X)
+            np.subtract(X, 1., out=X)
+            return X
         X = 1. * (X - self._min) / (self._max - self._min)
         X = X * 2. - 1.
         return X
@@ -158,3 +547,74 @@ class MinMaxNormalization(object):
         X = (X + 1.) / 2.
         X = 1. * X * (self._max - self._min) + self._min
         return X
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving算法[1]，在固定内存（最多capacity个计数器）下近似统计数据流中出现频率最高的元素。
+    当计数器已满且出现新元素时，替换当前计数最小的元素m，新元素的计数记为count(m) + 1，
+    并记录其可能被高估的值error = count(m)。
+    对于任意元素，估计值满足：真实频次 <= count <= 真实频次 + error，且 error <= total / capacity
+    [1] Metwally A, Agrawal D, El Abbadi A. Efficient computation of frequent and top-k elements in data streams. ICDT 2005.
+    sketch = SpaceSaving(capacity=3)
+    sketch.update(['a', 'b', 'a', 'c', 'd', 'a'])
+    print(sketch.most_common(2))  # [('a', 3), ('d', 2)]
+    print(sketch.error_bound)  # 2.0
+    """
+
+    def __init__(self, capacity=100000):
+        if capacity < 1:
+            raise ValueError(f"capacity 必须大于0，当前为{capacity}")
+        self.capacity = capacity
+        self.counts = {}  # 元素 -> 估计频次
+        self.errors = {}  # 元素 -> 可能被高估的频次
+        self.heap = []  # 小根堆 [(入堆时的频次, 元素)]，频次只增不减，出堆时再校正
+        self.total = 0  # 数据流中一共出现的元素个数
+
+    def update(self, items):
+        counts, errors, heap = self.counts, self.errors, self.heap
+        for item in items:
+            self.total += 1
+            if item in counts:
+                counts[item] += 1
+            elif len(counts) < self.capacity:
+                counts[item] = 1
+                errors[item] = 0
+                heapq.heappush(heap, (1, item))
+            else:
+                count, m = heap[0]
+                while counts[m] != count:  # 堆顶记录已过期，用最新频次重新入堆
+                    heapq.heapreplace(heap, (counts[m], m))
+                    count, m = heap[0]
+                heapq.heapreplace(heap, (count + 1, item))  # 替换频次最小的元素
+                del counts[m], errors[m]
+                counts[item] = count + 1
+                errors[item] = count
+
+    def most_common(self, n=None):
+        """
+        返回估计频次最高的n个元素，频次相同时按进入计数器的先后顺序排列
+        :param n:
+        :return: [(item, count), ...]
+        """
+        items = sorted(self.counts.items(), key=lambda x: x[1], reverse=True)
+        return items if n is None else items[:n]
+
+    @property
+    def error_bound(self):
+        """
+        任意元素频次估计值的最大误差上界
+        """
+        return self.total / self.capacity
+
+    def guaranteed(self, n):
+        """
+        在most_common(n)返回的元素中，能够保证真实频次一定位于前n的元素个数
+        :param n:
+        :return:
+        """
+        items = self.most_common(n + 1)
+        if len(items) <= n:
+            return len(items)
+        threshold = items[n][1]
+        return sum(1 for item, count in items[:n] if count - self.errors[item] >= threshold)
@@ -0,0 +1,531 @@
+"""
+文件名: Code/utils/trainer.py
+"""
+import os
+import json
+import math
+import time
+import queue
+import random
+import shutil
+import logging
+import tempfile
+import threading
+import itertools
+import numpy as np
+import torch
+from .data_helper import move_to_device
+from .log_manage import MetricsSink
+
+AMP_DTYPES = {"bf16": torch.bfloat16, "bfloat16": torch.bfloat16,
+              "fp16": torch.float16, "float16": torch.float16}
+
+
+def count_correct(logits, y):
+    """
+    统计分类正确的样本数，结果保留在logits所在的设备上，不会触发同步
+    :param logits: [batch_size, num_classes]
+    :param y: [batch_size, ]
+    :return: (correct, total)
+    """
+    return (logits.argmax(-1) == y).sum(), y.numel()
+
+
+def num_update_steps(num_batches, config):
+    """
+    计算整个训练过程中参数更新的次数，Trainer每更新一次参数调用一次scheduler.step()，
+    因此使用梯度累积时学习率调度器的 num_training_steps 应为该值，而不是 batch数 * epochs
+    steps = num_update_steps(len(train_iter), config)
+    :param num_batches: 每一轮的batch数
+    :param config: 读取其中的 epochs 和 accumulation_steps（默认为1）
+    """
+    return math.ceil(num_batches / getattr(config, 'accumulation_steps', 1)) * config.epochs
+
+
+def snapshot_to_cpu(obj, pin_memory=False):
+    """
+    复制一份位于CPU上的状态（支持张量以及由其构成的dict、list、tuple），复制后训练过程对参数的原地修改不会影响快照。
+    GPU上的张量以非阻塞的方式拷贝到锁页内存中，需要在读取之前等待拷贝完成
+    """
+    if isinstance(obj, torch.Tensor):
+        obj = obj.detach()
+        if obj.is_cuda:
+            out = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=pin_memory)
+            return out.copy_(obj, non_blocking=pin_memory)
+        return obj.clone()
+    if isinstance(obj, dict):
+        out = type(obj)((key, snapshot_to_cpu(value, pin_memory)) for key, value in obj.items())
+        if hasattr(obj, '_metadata'):  # state_dict中记录的各个模块的版本信息
+            out._metadata = obj._metadata
+        return out
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(item, pin_memory) for item in obj)
+    return obj
+
+
+def get_rng_state():
+    """
+    :return: Python、NumPy和PyTorch（包括所有GPU）的全局随机状态
+    """
+    return {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state(),
+            "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else []}
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def find_sampler(train_iter):
+    """
+    找到train_iter（DataLoader或DevicePrefetcher）中决定样本顺序的采样器
+    :return: (sampler, batch_size)，sampler为带有set_epoch方法的batch_sampler或sampler，找不到时为None
+    """
+    loader = getattr(train_iter, 'loader', train_iter)
+    batch_sampler = getattr(loader, 'batch_sampler', None)
+    if hasattr(batch_sampler, 'set_epoch'):  # 如BucketBatchSampler
+        return batch_sampler, None
+    sampler = getattr(batch_sampler, 'sampler', None)
+    if hasattr(sampler, 'set_epoch'):  # 如ResumableSampler、DistributedSampler
+        return sampler, getattr(batch_sampler, 'batch_size', None)
+    return None, None
+
+
+def atomic_save(obj, path, save_fn=torch.save):
+    """
+    先写入同一目录下的临时文件，再通过重命名替换目标文件，写入过程中断时不会破坏已有的文件
+    :param save_fn: save_fn(obj, f) 将obj写入已打开的二进制文件
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_ckpt_', suffix='.pt', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            save_fn(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CheckpointManager(object):
+    """
+    在后台线程中保存模型的checkpoint：调用save()时只将参数复制到CPU，写入磁盘在后台线程中完成，
+    每个checkpoint都先写入临时文件再重命名，因此任何时候中断都不会损坏已有的文件。
+    checkpoint保存在checkpoint_dir中，文件名为 ckpt_{step}.pt，只保留最近的keep_last个以及指标最好的keep_best个；
+    同时model_save_path始终为指标最好的模型参数（格式与之前直接 torch.save(model.state_dict()) 的结果一致）。
+    传入extra时checkpoint中保存的是 {"model": 模型参数, **extra}，可用于保存优化器等完整的训练状态。
+    已保存的checkpoint记录在checkpoint_dir下的index.json中。resume=True时会载入其中的记录，
+    继续按同样的规则保留和删除；否则视为一次新的训练，清空之前的记录，最优指标也重新开始比较。
+    manager = CheckpointManager(config.model_save_path, keep_last=2, keep_best=1)
+    manager.save(model.state_dict(), step=global_steps, metric=test_acc)
+    manager.close()
+    print(manager.history)  # 每个checkpoint的路径、大小和写入耗时
+    :param model_save_path:
+    :param checkpoint_dir: 默认为 model_save_path去掉扩展名 + '_checkpoints'
+    :param keep_last: 保留最近的checkpoint数量
+    :param keep_best: 保留指标最好的checkpoint数量
+    :param mode: 'max' 表示指标越大越好（如准确率），'min' 表示越小越好（如损失）
+    :param resume: 是否接着index.json中记录的上一次训练继续保存
+    """
+
+    def __init__(self, model_save_path, checkpoint_dir=None, keep_last=2, keep_best=1, mode='max', resume=False):
+        if mode not in ['max', 'min']:
+            raise ValueError(f" ## mode 必须为 'max' 或 'min'，当前为 {mode}")
+        self.model_save_path = model_save_path
+        self.checkpoint_dir = checkpoint_dir or os.path.splitext(model_save_path)[0] + '_checkpoints'
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.mode = mode
+        self.best_metric = None
+        self.history = []  # 已写入的checkpoint: [{"step", "metric", "path", "bytes", "seconds"}, ...]
+        self.index_path = os.path.join(self.checkpoint_dir, 'index.json')
+        if resume and os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            self.best_metric = index["best_metric"]
+            self.history = [r for r in index["history"] if os.path.exists(r["path"])]
+        else:
+            self._write_index()
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def is_better(self, metric):
+        if metric is None:
+            return False
+        if self.best_metric is None:
+            return True
+        return metric > self.best_metric if self.mode == 'max' else metric < self.best_metric
+
+    def save(self, state_dict, step, metric=None, extra=None):
+        """
+        :param state_dict: 模型参数
+        :param step: 当前的训练步数，用于命名checkpoint
+        :param metric: 验证集上的指标，为None时只作为最近的checkpoint保留，不参与最优模型的比较
+        :param extra: 随模型参数一起保存在checkpoint中的其它状态，如 {"optimizer": optimizer.state_dict()}
+        :return: 该checkpoint是否为目前最好的
+        """
+        self._raise_error()
+        is_best = self.is_better(metric)
+        if is_best:
+            self.best_metric = metric
+        use_cuda = torch.cuda.is_available()
+        state_dict, extra = snapshot_to_cpu((state_dict, extra), pin_memory=use_cuda)
+        event = None
+        if use_cuda:  # 拷贝在当前stream上进行，之后对参数的修改都排在拷贝之后
+            event = torch.cuda.Event()
+            event.record()
+        self._queue.put((state_dict, extra, event, step, metric, is_best))
+        return is_best
+
+    def latest(self):
+        """
+        :return: 最近一个已经写入完成的checkpoint的路径，不存在时返回None
+        """
+        if not self.history:
+            return None
+        return max(self.history, key=lambda r: r["step"])["path"]
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(*item)
+            except Exception as e:  # 在下一次调用save()或wait()时抛出
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, state_dict, extra, event, step, metric, is_best):
+        if event is not None:
+            event.synchronize()
+        start = time.time()
+        path = os.path.join(self.checkpoint_dir, f'ckpt_{step:08d}.pt')
+        atomic_save(state_dict if extra is None else {"model": state_dict, **extra}, path)
+        if is_best and extra is not None:  # model_save_path中只保存模型参数
+            atomic_save(state_dict, self.model_save_path)
+        elif is_best:  # 复制后再重命名，同样保证model_save_path在任何时候都是完整的
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp_ckpt_', suffix='.pt',
+                                            dir=os.path.dirname(os.path.abspath(self.model_save_path)))
+            os.close(fd)
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, self.model_save_path)
+        record = {"step": step, "metric": metric, "path": path, "bytes": os.path.getsize(path),
+                  "seconds": time.time() - start}
+        self.history = [r for r in self.history if r["path"] != path] + [record]
+        logging.info(f" ## 保存checkpoint {path}，大小: {record['bytes'] / 1024 ** 2:.2f}MB，"
+                     f"写入耗时: {record['seconds']:.3f}s" + (f"，已更新 {self.model_save_path}" if is_best else ""))
+        self._remove_stale()
+
+    def _remove_stale(self):
+        keep = {r["path"] for r in sorted(self.history, key=lambda r: r["step"])[-self.keep_last:]} \
+            if self.keep_last > 0 else set()
+        scored = [r for r in self.history if r["metric"] is not None]
+        scored = sorted(scored, key=lambda r: r["metric"], reverse=self.mode == 'max')
+        keep |= {r["path"] for r in scored[:self.keep_best]}
+        for r in self.history:
+            if r["path"] not in keep and os.path.exists(r["path"]):
+                os.remove(r["path"])
+        self.history = [r for r in self.history if r["path"] in keep]
+        self._write_index()
+
+    def _write_index(self):
+        index = {"best_metric": self.best_metric, "history": self.history}
+        atomic_save(index, self.index_path,
+                    save_fn=lambda obj, f: f.write(json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')))
+
+    def reset(self):
+        """
+        放弃之前的记录，将之后保存的checkpoint视为一次新的训练
+        """
+        self.wait()
+        self.best_metric = None
+        self.history = []
+        self._write_index()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """
+        等待所有checkpoint写入完毕
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Trainer(object):
+    """
+    各章节中分类模型通用的训练引擎，模型需满足 loss, logits = model(x, y) 以及 logits = model(x)。
+    所有配置项优先从关键字参数中读取，其次从config中读取（与各train.py中的ModelConfig保持一致），最后使用默认值：
+        device: 训练设备
+        epochs: 训练轮数
+        model_save_path: 验证集上准确率提升时保存模型参数的路径
+        log_interval: 每隔多少个batch输出一次训练集上的损失和准确率，默认50
+        amp_dtype: 混合精度训练的数据类型，可取 'bf16' 或 'fp16'（及对应的torch.dtype），默认None表示不开启
+        accumulation_steps: 梯度累积的步数，每accumulation_steps个batch更新一次参数，默认1；
+            每一轮最后不足accumulation_steps个batch时按实际的batch数求平均，scheduler只在更新参数时调用，
+            其总步数见num_update_steps
+        clip_max_norm: 梯度裁剪的阈值，默认None表示不裁剪
+        keep_last: 保留最近的checkpoint数量，默认2，见CheckpointManager
+        keep_best: 保留验证集上准确率最高的checkpoint数量，默认1
+        save_every_steps: 每训练多少个batch额外保存一次完整的训练状态，默认None表示只在每轮结束时保存
+        resume: 是否从最近的checkpoint恢复训练，默认False
+    checkpoint中保存了模型、优化器、学习率调度器、GradScaler、随机状态、采样器状态以及当前训练到的位置，
+    恢复时会跳过当前轮中已经训练过的batch（使用ResumableSampler或BucketBatchSampler时直接从该位置开始读取），
+    因此被中断的训练最多只需重新训练save_every_steps个batch。
+    训练过程中损失和准确率在设备上累计，只在每log_interval个batch时同步一次到CPU；
+    写入TensorBoard的每一步的损失通过MetricsSink批量异步写入，曲线与逐步调用 writer.add_scalar 时一致。
+    trainer = Trainer(model, optimizer, config, scheduler=scheduler, writer=writer, clip_max_norm=0.5)
+    max_test_acc = trainer.train(train_iter, val_iter)
+    :param model:
+    :param optimizer:
+    :param config: ModelConfig
+    :param scheduler: 每次更新参数后调用 scheduler.step()
+    :param writer: SummaryWriter或MetricsSink，为None时不写入TensorBoard
+    :param batch_fn: 在移动到设备之前对每个batch (x, y) 进行变换，返回新的 (x, y)
+    :param metric_fn: 计算 (正确数, 总数) 的函数，默认为count_correct
+    """
+
+    def __init__(self, model, optimizer, config=None, scheduler=None, writer=None,
+                 batch_fn=None, metric_fn=None, **kwargs):
+        def get(name, default=None):
+            return kwargs[name] if name in kwargs else getattr(config, name, default)
+
+        self.model = model
+        self.optimizer = optimizer
+        self.config = config
+        self.scheduler = scheduler
+        self.writer = writer
+        self._owns_metrics = writer is not None and not isinstance(writer, MetricsSink)  # 由Trainer创建的sink在train()结束时关闭
+        self.metrics = MetricsSink(writer) if self._owns_metrics else writer
+        self.batch_fn = batch_fn
+        self.metric_fn = metric_fn or count_correct
+        self.device = torch.device(get('device', 'cpu'))
+        self.epochs = get('epochs', 1)
+        self.model_save_path = get('model_save_path')
+        self.checkpoints = None
+        self.resume = get('resume', False)
+        if self.model_save_path is not None:
+            self.checkpoints = CheckpointManager(self.model_save_path, keep_last=get('keep_last', 2),
+                                                 keep_best=get('keep_best', 1), resume=self.resume)
+        self.save_every_steps = get('save_every_steps')
+        self.log_interval = get('log_interval', 50)
+        self.accumulation_steps = get('accumulation_steps', 1)
+        self.clip_max_norm = get('clip_max_norm')
+        amp_dtype = get('amp_dtype')
+        self.amp_dtype = AMP_DTYPES.get(amp_dtype, amp_dtype)
+        # 只有在GPU上使用fp16时需要对损失进行缩放以避免梯度下溢（torch.cuda.amp.GradScaler 兼容 torch 2.0）
+        use_scaler = self.device.type == 'cuda' and self.amp_dtype == torch.float16
+        self.scaler = torch.cuda.amp.GradScaler(enabled=use_scaler)
+        self.non_blocking = self.device.type == 'cuda'
+        self.global_steps = 0  # 已经训练的batch数
+        self.max_test_acc = 0
+        self.epoch = 0  # 当前所在的轮数
+        self.batch_in_epoch = 0  # 当前轮中已经训练的batch数
+        self.sampler = None
+        self._last_saved_step = 0
+        self._resume_state = None  # 恢复训练时尚未应用到采样器和随机状态上的部分
+
+    def autocast(self):
+        return torch.autocast(self.device.type, dtype=self.amp_dtype, enabled=self.amp_dtype is not None)
+
+    def prepare_batch(self, batch):
+        if self.batch_fn is not None:
+            batch = self.batch_fn(*batch)
+        return move_to_device(batch, self.device, non_blocking=self.non_blocking)
+
+    def optimizer_step(self):
+        if self.clip_max_norm is not None:
+            self.scaler.unscale_(self.optimizer)
+            torch.nn.utils.clip_grad_norm_(self.model.parameters(), self.clip_max_norm)
+        self.scaler.step(self.optimizer)  # 执行梯度下降
+        self.scaler.update()
+        self.optimizer.zero_grad(set_to_none=True)
+        if self.scheduler is not None:
+            self.scheduler.step()
+
+    def iter_epoch(self, train_iter, epoch):
+        """
+        设置采样器的轮数并返回本轮的迭代器，恢复训练时跳过当前轮中已经训练过的batch
+        """
+        self.sampler, batch_size = find_sampler(train_iter)
+        resume_state, self._resume_state = self._resume_state, None
+        skip = self.batch_in_epoch
+        if resume_state is not None and resume_state["sampler"] is not None and self.sampler is not None:
+            self.sampler.load_state_dict(resume_state["sampler"])
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+        if skip > 0 and hasattr(self.sampler, 'start_batch'):
+            self.sampler.start_batch, skip = skip, 0
+        elif skip > 0 and hasattr(self.sampler, 'start_index') and batch_size is not None:
+            self.sampler.start_index, skip = skip * batch_size, 0
+        batches = iter(train_iter)
+        if skip > 0:  # 无法直接定位时，逐个读取并丢弃已经训练过的batch
+            logging.info(f" ## 跳过已经训练过的{skip}个batch")
+            for _ in itertools.islice(batches, skip):
+                pass
+        if resume_state is not None:  # 在创建迭代器之后恢复，使其之后的随机数与中断前一致
+            set_rng_state(resume_state["rng"])
+        return batches
+
+    def train_epoch(self, train_iter, epoch):
+        try:
+            num_batches = len(train_iter)
+        except TypeError:  # 流式读取时batch数量未知
+            num_batches = '?'
+        self.model.train()
+        self.optimizer.zero_grad(set_to_none=True)
+        running = torch.zeros(3, device=self.device)  # 损失之和, 正确数, 样本数
+        pending, n_batches = 0, 0  # pending: 已经累积但尚未用于更新参数的batch数
+        self.epoch = epoch
+        for i, batch in enumerate(self.iter_epoch(train_iter, epoch), start=self.batch_in_epoch):
+            x, y = self.prepare_batch(batch)
+            with self.autocast():
+                loss, logits = self.model(x, y)
+            self.scaler.scale(loss / self.accumulation_steps).backward()
+            pending += 1
+            if pending == self.accumulation_steps:
+                self.optimizer_step()
+                pending = 0
+            self.global_steps += 1
+            self.batch_in_epoch = i + 1
+            n_batches += 1
+            with torch.no_grad():
+                correct, total = self.metric_fn(logits, y)
+                running[0] += loss.detach().float()
+                running[1] += correct
+                running[2] += total
+            if self.metrics is not None:
+                self.metrics.add_scalar('Training/Loss', loss.detach(), self.global_steps)
+            if i % self.log_interval == 0:
+                if self.metrics is not None:
+                    self.metrics.add_scalar('Training/Accuracy', correct / total, self.global_steps)
+                loss_sum, correct, total = running.tolist()  # 每log_interval个batch只同步一次
+                running.zero_()
+                acc, loss = correct / max(total, 1), loss_sum / n_batches
+                n_batches = 0
+                logging.info(f"Epochs[{epoch + 1}/{self.epochs}]--batch[{i}/{num_batches}]"
+                             f"--Acc: {round(acc, 4)}--loss: {round(loss, 4)}")
+            if pending == 0 and self.save_every_steps is not None and \
+                    self.global_steps - self._last_saved_step >= self.save_every_steps:
+                self.save_model()  # 只在参数更新之后保存，此时没有累积中的梯度
+        if pending > 0:  # 最后不足accumulation_steps个batch的梯度，改为按实际的batch数求平均
+            for p in self.model.parameters():
+                if p.grad is not None:
+                    p.grad.mul_(self.accumulation_steps / pending)
+            self.optimizer_step()
+        self.epoch, self.batch_in_epoch = epoch + 1, 0
+        if hasattr(train_iter, 'wait_stats'):
+            stats = train_iter.wait_stats()
+            logging.info(f"Epochs[{epoch + 1}/{self.epochs}]--等待数据总耗时: {stats['wait_total']:.2f}s, "
+                         f"平均每个batch: {stats['wait_mean'] * 1000:.2f}ms")
+
+    def evaluate(self, data_iter):
+        self.model.eval()
+        running = torch.zeros(2, device=self.device)  # 正确数, 样本数
+        with torch.no_grad(), self.autocast():
+            for batch in data_iter:
+                x, y = self.prepare_batch(batch)
+                logits = self.model(x)
+                correct, total = self.metric_fn(logits, y)
+                running[0] += correct
+                running[1] += total
+        self.model.train()
+        correct, total = running.tolist()
+        return correct / max(total, 1)
+
+    def training_state(self):
+        """
+        :return: 除模型参数之外，从当前位置继续训练所需的全部状态
+        """
+        return {"optimizer": self.optimizer.state_dict(),
+                "scheduler": None if self.scheduler is None else self.scheduler.state_dict(),
+                "scaler": self.scaler.state_dict(),
+                "sampler": self.sampler.state_dict() if hasattr(self.sampler, 'state_dict') else None,
+                "rng": get_rng_state(),
+                "epoch": self.epoch, "batch_in_epoch": self.batch_in_epoch,
+                "global_steps": self.global_steps, "max_test_acc": self.max_test_acc}
+
+    def save_model(self, metric=None):
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.model.state_dict(), step=self.global_steps, metric=metric,
+                                  extra=self.training_state())
+            self._last_saved_step = self.global_steps
+
+    def load_checkpoint(self, path=None):
+        """
+        载入完整的训练状态，之后调用train()会从保存时的位置继续训练。已经训练完成的checkpoint不会被载入
+        :param path: 默认为最近一个checkpoint
+        :return: 是否成功载入
+        """
+        path = path or (self.checkpoints.latest() if self.checkpoints is not None else None)
+        if path is None or not os.path.exists(path):
+            return False
+        logging.info(f" # 从{path}恢复训练状态...")
+        # checkpoint中包含随机状态等非张量对象，且由训练过程自己写入，因此不使用weights_only
+        checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+        if checkpoint["epoch"] >= self.epochs:
+            logging.warning(f" ## {path} 已经训练完{checkpoint['epoch']}轮，不再从中恢复，将重新开始训练")
+            return False
+        self.model.load_state_dict(checkpoint["model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        if self.scheduler is not None and checkpoint["scheduler"] is not None:
+            self.scheduler.load_state_dict(checkpoint["scheduler"])
+        self.scaler.load_state_dict(checkpoint["scaler"])
+        self.epoch, self.batch_in_epoch = checkpoint["epoch"], checkpoint["batch_in_epoch"]
+        self.global_steps = self._last_saved_step = checkpoint["global_steps"]
+        self.max_test_acc = checkpoint["max_test_acc"]
+        self._resume_state = {"sampler": checkpoint["sampler"], "rng": checkpoint["rng"]}
+        logging.info(f" # 从第{self.epoch + 1}轮的第{self.batch_in_epoch}个batch继续训练")
+        return True
+
+    def train(self, train_iter, val_iter=None):
+        """
+        :return: 验证集上的最高准确率
+        """
+        self.model.to(self.device)
+        if self._owns_metrics and self.metrics is None:  # 再次调用train()时重新创建
+            self.metrics = MetricsSink(self.writer)
+        if self.resume and not self.load_checkpoint() and self.checkpoints is not None:
+            self.checkpoints.reset()  # 没有可以恢复的checkpoint时，之前的记录不再参与比较和保留
+        try:
+            for epoch in range(self.epoch, self.epochs):
+                self.train_epoch(train_iter, epoch)
+                self.evaluate_epoch(val_iter, epoch)
+                if self.metrics is not None:
+                    self.metrics.flush()
+            if self.checkpoints is not None:
+                self.checkpoints.wait()
+        finally:
+            if self._owns_metrics:
+                self.metrics.close()  # 结束后台线程并注销atexit，Trainer才能被回收
+                self.metrics = None
+        return self.max_test_acc
+
+    def evaluate_epoch(self, val_iter, epoch):
+        if val_iter is None:
+            self.save_model()
+            return
+        test_acc = self.evaluate(val_iter)
+        logging.info(f"Epochs[{epoch + 1}/{self.epochs}]--Acc on val {test_acc}")
+        if self.metrics is not None:
+            self.metrics.add_scalar('Testing/Accuracy', test_acc, self.global_steps)
+        self.max_test_acc = max(self.max_test_acc, test_acc)
+        self.save_model(test_acc)  # 准确率提升时会同时更新model_save_path